@@ -4,23 +4,44 @@ import urllib.parse
 import logging
 import json
 import os
-import sys
+import time
 from flask_cors import CORS
 from datetime import datetime
+from proxy_stream import (conditional_request_headers, multirange_response, not_modified_response, parse_byte_range,
+                          range_request_headers, relay_response)
+from rewrite_cache import RewriteCache
+from catalog_index import CatalogIndex
+from segment_cache import SegmentCache, serve_segment
+import server_timing
+import app_logging
+from app_logging import configure_logging, parse_sample_rates
+from single_flight import SingleFlight
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, UPSTREAM_TTFB_SECONDS, cache_collector,
+                     instrument_flask, render_metrics)
+from config import (SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES, SEGMENT_CACHE_POLICY, SEGMENT_CACHE_MAX_FILL_BYTES,
+                    SEGMENT_CACHE_MAX_AGE,
+                    REWRITE_CACHE_MAX_ENTRIES, REWRITE_CACHE_MAX_BYTES, CATALOG_DB_PATH, CATALOG_MAX_PAGE_SIZE,
+                    INGEST_METRICS_PATH, SERVER_TIMING_LOG_SAMPLE_RATE, LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES,
+                    LOG_SAMPLE_DEFAULT, LOG_QUEUE_SIZE, LOG_BODY_DUMP)
 
 # Configure logging before anything else
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+configure_logging(LOG_LEVEL, LOG_FORMAT, parse_sample_rates(LOG_SAMPLE_RATES), LOG_SAMPLE_DEFAULT, LOG_QUEUE_SIZE)
 logger = logging.getLogger(__name__)
 
 def create_app():
     """Create and configure the Flask application"""
     app = Flask(__name__)
+    single_flight = SingleFlight()
+    segment_cache = SegmentCache(
+        SEGMENT_CACHE_DIR,
+        max_bytes=SEGMENT_CACHE_MAX_BYTES,
+        policy=SEGMENT_CACHE_POLICY,
+        max_fill_bytes=SEGMENT_CACHE_MAX_FILL_BYTES,
+        max_age=SEGMENT_CACHE_MAX_AGE,
+        single_flight=single_flight
+    )
+    rewrite_cache = RewriteCache(max_entries=REWRITE_CACHE_MAX_ENTRIES, max_bytes=REWRITE_CACHE_MAX_BYTES)
+    catalog_index = CatalogIndex(CATALOG_DB_PATH)
     CORS(app, resources={
         r"/*": {
             "origins": "*",
@@ -28,6 +49,10 @@ def create_app():
             "allow_headers": ["Content-Type", "Authorization", "Range"]
         }
     })
+    instrument_flask(app)
+    server_timing.instrument_flask(app, sample_rate=SERVER_TIMING_LOG_SAMPLE_RATE)
+    app_logging.instrument_flask(app)
+    REGISTRY.register_collector(cache_collector({'rewrite': rewrite_cache, 'segment': segment_cache}))
 
     @app.route('/health')
     def health_check():
@@ -38,6 +63,21 @@ def create_app():
             logger.error(f"Health check failed: {str(e)}")
             return {"status": "unhealthy", "error": str(e)}, 500
 
+    @app.route('/stats')
+    def stats():
+        """Expose cache and fetch-coalescing statistics, including playlist rewrite CPU time"""
+        return {
+            "rewrite_cache": rewrite_cache.stats(),
+            "segment_cache": segment_cache.stats(),
+            "single_flight": single_flight.stats(),
+            "logging": app_logging.stats(),
+        }
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus scrape endpoint: request latencies, upstream TTFB, bytes sent, cache metrics, ingest stages"""
+        return Response(render_metrics([INGEST_METRICS_PATH]), content_type=METRICS_CONTENT_TYPE)
+
     # Add error handlers
     @app.errorhandler(500)
     def handle_500(e):
@@ -202,9 +242,9 @@ def create_app():
 
     @app.route('/videos')
     def get_videos():
-        """Get list of available videos"""
-        videos = ['fly', 'song', 'sparkle', 'maverick', 'transformers', 'whiplash']
-        return json.dumps(videos)
+        """Get list of available videos from the catalog index (optionally ?q=<title prefix>)"""
+        videos, _ = catalog_index.page(prefix=request.args.get('q'), limit=CATALOG_MAX_PAGE_SIZE)
+        return json.dumps([video['id'] for video in videos])
 
     @app.route('/player')
     def serve_video_player():
@@ -486,22 +526,61 @@ def create_app():
                     'Connection': 'keep-alive'
                 }
 
-                # Make the request to the CDN
-                response = requests.get(cdn_url, headers=headers, timeout=30, stream=True)
+                # Single-file TS byte ranges are served from the local segment cache when possible
+                if target_path.endswith('.ts'):
+                    return add_proxy_headers(serve_segment(
+                        segment_cache, fetch_cdn, cdn_url, request, get_content_type(target_path), headers))
+
+                # Forward the client's byte range for media so seeking only pulls the requested bytes.
+                # Playlists are always fetched whole because they get rewritten.
+                is_playlist = target_path.endswith('.m3u8')
+                byte_range = None if is_playlist else parse_byte_range(request.headers)
+                if not is_playlist:
+                    # The proxy keeps no copy of these, so the CDN answers the client's revalidation
+                    headers.update(conditional_request_headers(request.headers))
+                if byte_range is not None:
+                    headers.update(range_request_headers(request.headers))
+                    if len(byte_range.ranges) > 1:
+                        return add_proxy_headers(multirange_response(
+                            fetch_cdn, cdn_url, byte_range, headers, get_content_type(target_path)))
+
+                # Make the request to the CDN (HEAD stays a HEAD upstream so it never pulls a body).
+                # Concurrent requests for the same playlist share one fetch.
+                method = 'HEAD' if request.method == 'HEAD' and not is_playlist else 'GET'
+                if is_playlist:
+                    response, _ = single_flight.do(
+                        ('playlist', cdn_url), lambda: timed_cdn_request('GET', cdn_url, headers))
+                else:
+                    response = fetch_cdn(method, cdn_url, headers)
                 logger.info(f"CDN response status: {response.status_code}")
-                logger.info(f"CDN response headers: {dict(response.headers)}")
+                if LOG_BODY_DUMP:
+                    logger.info(f"CDN response headers: {dict(response.headers)}")
+
+                # Only playlists are buffered (they need rewriting); everything else is relayed as it arrives
+                if not is_playlist and response.status_code in (200, 206, 416):
+                    return stream_cdn_response(response, target_path, byte_range)
+                if not is_playlist and response.status_code == 304:
+                    response.close()
+                    return add_proxy_headers(not_modified_response(response.headers.get('ETag'),
+                                                                   response.headers.get('Last-Modified')))
 
                 if response.status_code == 200:
+
                     content = response.content
                     logger.info(f"Received content length: {len(content)} bytes")
 
-                    # If this is an m3u8 file, modify the URLs
-                    if target_path.endswith('.m3u8'):
+                    # Only playlists get here: modify the URLs, or reuse the rewrite of these exact upstream bytes
+                    rewrite_key = rewrite_cache.key(cdn_url, response.headers.get('ETag'), content, video_name)
+                    cached = rewrite_cache.get(rewrite_key)
+                    server_timing.record('rewrite-cache', desc='hit' if cached is not None else 'miss')
+                    if cached is not None:
+                        content = cached
+                    else:
+                        rewrite_started = time.thread_time()
                         try:
                             decoded_content = content.decode('utf-8')
-                            logger.info("=== Original m3u8 content ===")
-                            logger.info(decoded_content)
-                            logger.info("=== End original m3u8 content ===")
+                            if LOG_BODY_DUMP:
+                                logger.info(f"=== Original m3u8 content ===\n{decoded_content}")
                             
                             # Basic content validation
                             if not decoded_content.strip():
@@ -514,12 +593,13 @@ def create_app():
                                 return {"error": "Invalid Content", "message": "Invalid m3u8 file format"}, 500
 
                             # Modify URLs
-                            content = modify_m3u8_urls(decoded_content, video_name)
+                            with server_timing.measure('rewrite'):
+                                content = modify_m3u8_urls(decoded_content, video_name)
                             content = content.encode('utf-8')
+                            rewrite_cache.put(rewrite_key, content, time.thread_time() - rewrite_started)
                             
-                            logger.info("=== Modified m3u8 content ===")
-                            logger.info(content.decode('utf-8'))
-                            logger.info("=== End modified m3u8 content ===")
+                            if LOG_BODY_DUMP:
+                                logger.info(f"=== Modified m3u8 content ===\n{content.decode('utf-8')}")
                             
                         except UnicodeDecodeError as e:
                             logger.error(f"Failed to decode m3u8 content: {str(e)}")
@@ -541,9 +621,8 @@ def create_app():
                     flask_response.headers['Access-Control-Allow-Headers'] = '*'
                     flask_response.headers['Cache-Control'] = 'public, max-age=3600'
                     
-                    logger.info("=== Response headers ===")
-                    logger.info(dict(flask_response.headers))
-                    logger.info("=== End response headers ===")
+                    if LOG_BODY_DUMP:
+                        logger.info(f"=== Response headers ===\n{dict(flask_response.headers)}")
                     
                     return flask_response
                     
@@ -551,7 +630,8 @@ def create_app():
                     logger.error("CDN returned 501 Not Implemented - retrying without compression")
                     # Retry without any encoding
                     headers['Accept-Encoding'] = 'identity'
-                    response = requests.get(cdn_url, headers=headers, timeout=30)
+                    response.close()
+                    response = fetch_cdn(method, cdn_url, headers)
                     if response.status_code == 200:
                         return handle_cdn_response(response, target_path, video_name)
                     else:
@@ -579,15 +659,23 @@ def create_app():
     def handle_cdn_response(response, target_path, video_name):
         """Helper function to process CDN response"""
         try:
+            if not target_path.endswith('.m3u8'):
+                return stream_cdn_response(response, target_path)
+
             content = response.content
             logger.info(f"Received content length: {len(content)} bytes")
 
-            if target_path.endswith('.m3u8'):
+            rewrite_key = rewrite_cache.key(response.url, response.headers.get('ETag'), content, video_name)
+            cached = rewrite_cache.get(rewrite_key)
+            server_timing.record('rewrite-cache', desc='hit' if cached is not None else 'miss')
+            if cached is not None:
+                content = cached
+            else:
+                rewrite_started = time.thread_time()
                 try:
                     decoded_content = content.decode('utf-8')
-                    logger.info("=== Original m3u8 content ===")
-                    logger.info(decoded_content)
-                    logger.info("=== End original m3u8 content ===")
+                    if LOG_BODY_DUMP:
+                        logger.info(f"=== Original m3u8 content ===\n{decoded_content}")
                     
                     if not decoded_content.strip():
                         logger.error("Empty m3u8 content received")
@@ -597,12 +685,13 @@ def create_app():
                         logger.error("Invalid m3u8 content - missing #EXTM3U header")
                         return {"error": "Invalid Content", "message": "Invalid m3u8 file format"}, 500
 
-                    content = modify_m3u8_urls(decoded_content, video_name)
+                    with server_timing.measure('rewrite'):
+                        content = modify_m3u8_urls(decoded_content, video_name)
                     content = content.encode('utf-8')
+                    rewrite_cache.put(rewrite_key, content, time.thread_time() - rewrite_started)
                     
-                    logger.info("=== Modified m3u8 content ===")
-                    logger.info(content.decode('utf-8'))
-                    logger.info("=== End modified m3u8 content ===")
+                    if LOG_BODY_DUMP:
+                        logger.info(f"=== Modified m3u8 content ===\n{content.decode('utf-8')}")
                     
                 except UnicodeDecodeError as e:
                     logger.error(f"Failed to decode m3u8 content: {str(e)}")
@@ -623,6 +712,35 @@ def create_app():
             logger.error(f"Error handling CDN response: {str(e)}", exc_info=True)
             return {"error": "Processing Error", "message": str(e)}, 500
 
+    def timed_cdn_request(method, url, headers, stream=False):
+        """Request ``url`` from the CDN, recording the time until its response headers arrived"""
+        started = time.perf_counter()
+        response = requests.request(method, url, headers=headers, timeout=30, stream=stream)
+        headers_received = response.elapsed.total_seconds()  # connect included: these requests aren't pooled
+        UPSTREAM_TTFB_SECONDS.observe(headers_received, host=urllib.parse.urlsplit(url).hostname)
+        # Not "upstream-ttfb": the pooled apps report that without the connect time, which can't be split out here
+        server_timing.record('upstream-headers', headers_received, desc='connect+ttfb')
+        if not stream:
+            server_timing.record('upstream-transfer', max(time.perf_counter() - started - headers_received, 0.0))
+        return response
+
+    def fetch_cdn(method, url, headers):
+        """Open a streamed request to the CDN"""
+        return timed_cdn_request(method, url, headers, stream=True)
+
+    def stream_cdn_response(response, target_path, byte_range=None):
+        """Relay a non-playlist CDN body (full or partial) to the client chunk by chunk without buffering it"""
+        return add_proxy_headers(relay_response(response, get_content_type(target_path), byte_range))
+
+    def add_proxy_headers(flask_response):
+        """Add the CORS and caching headers every proxied response carries"""
+        flask_response.headers['Access-Control-Allow-Origin'] = '*'
+        flask_response.headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
+        flask_response.headers['Access-Control-Allow-Headers'] = '*'
+        flask_response.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges'
+        flask_response.headers['Cache-Control'] = 'public, max-age=3600'
+        return flask_response
+
     def get_content_type(path):
         """Determine content type based on file extension"""
         if path.endswith('.m3u8'):
@@ -654,8 +772,10 @@ def create_app():
             else:
                 modified_lines.append(line)
         
-        logger.info(f"Modified m3u8 content:\n{'\n'.join(modified_lines)}")
-        return '\n'.join(modified_lines)
+        modified_content = '\n'.join(modified_lines)
+        if LOG_BODY_DUMP:
+            logger.info(f"Modified m3u8 content:\n{modified_content}")
+        return modified_content
 
     return app
 
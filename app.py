@@ -1,9 +1,36 @@
 import requests
+from urllib.parse import quote
+from botocore.exceptions import BotoCoreError, ClientError
 from flask import Flask, render_template_string, request, Response
 from flask_cors import CORS
 from folder_storage_handler import FolderStorageHandler  # Ensure this import is present
+from upstream_client import UpstreamClient
+from proxy_stream import conditional_request_headers, not_modified_response
+from playlist_cache import PlaylistCache
+from segment_cache import SegmentCache, serve_segment
+from key_store import KeyStore
+from catalog_service import CatalogService
+from catalog_index import CatalogIndex
+import server_timing
+import app_logging
+from app_logging import configure_logging, parse_sample_rates
+from single_flight import SingleFlight
+from presigned_url_cache import MAX_PRESIGN_EXPIRATION
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, cache_collector, instrument_flask,
+                     render_metrics)
+from config import (UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT, UPSTREAM_ACQUIRE_TIMEOUT,
+                    PLAYLIST_CACHE_TTL, PLAYLIST_CACHE_MAX_ENTRIES, PLAYLIST_CACHE_MAX_BYTES, CACHE_INVALIDATE_TOKEN,
+                    SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES, SEGMENT_CACHE_POLICY, SEGMENT_CACHE_MAX_FILL_BYTES,
+                    SEGMENT_CACHE_MAX_AGE,
+                    KEY_STORE_TTL, KEY_STORE_NEGATIVE_TTL, KEY_STORE_MAX_ENTRIES, CATALOG_REFRESH_INTERVAL,
+                    CATALOG_LIST_SHARDS, CATALOG_DB_PATH, CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE, PREVIEW_ENABLED,
+                    TRICKPLAY_ENABLED, PRESIGN_DEFAULT_EXPIRATION, INGEST_METRICS_PATH,
+                    SERVER_TIMING_LOG_SAMPLE_RATE, LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES, LOG_SAMPLE_DEFAULT,
+                    LOG_QUEUE_SIZE)
 
-    app = Flask(__name__)
+configure_logging(LOG_LEVEL, LOG_FORMAT, parse_sample_rates(LOG_SAMPLE_RATES), LOG_SAMPLE_DEFAULT, LOG_QUEUE_SIZE)
+
+app = Flask(__name__)
 CORS(app, resources={
     r"/*": {
         "origins": "*",
@@ -11,6 +38,9 @@ CORS(app, resources={
         "allow_headers": ["Content-Type", "Authorization", "Range"]
     }
 })
+instrument_flask(app)
+server_timing.instrument_flask(app, sample_rate=SERVER_TIMING_LOG_SAMPLE_RATE)
+app_logging.instrument_flask(app)
 
 # HTML template for the video player
 HTML_TEMPLATE = """
@@ -18,9 +48,6 @@ HTML_TEMPLATE = """
 <html>
 <head>
     <title>Video Library</title>
-    <link href="https://unpkg.com/video.js/dist/video-js.css" rel="stylesheet">
-    <script src="https://unpkg.com/video.js/dist/video.js"></script>
-    <script src="https://unpkg.com/@videojs/http-streaming/dist/videojs-http-streaming.js"></script>
     <style>
         body {
             margin: 0;
@@ -56,28 +83,77 @@ HTML_TEMPLATE = """
             height: 150px;
             background: #000;
         }
-        .video-thumbnail video {
+        .video-thumbnail img {
             width: 100%;
             height: 100%;
+            object-fit: cover;
         }
     </style>
 </head>
 <body>
     <div class="container">
         <h1>Video Library</h1>
+        <form method="get" action="/">
+            <input type="text" name="q" value="{{ q or '' }}" placeholder="Search videos...">
+        </form>
         <div class="video-grid">
             {% for video in videos %}
             <div class="video-card" onclick="window.location.href='/play/{{ video.id }}'">
                 <div class="video-thumbnail">
-                    <video width="100%" height="100%" muted playsinline>
-                        <source src="/proxy/{{ video.id }}" type="application/x-mpegURL">
-            </video>
-        </div>
+                    {% set image_base = 'https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_m3u8/' ~ video.id %}
+                    {% set version = '?v=' ~ (video.uploaded_at|urlencode) if video.uploaded_at else '' %}
+                    <img src="{{ image_base }}/poster.jpg{{ version }}" alt="{{ video.name }}" loading="lazy" decoding="async"
+                         {% if preview_enabled %}data-preview="{{ image_base }}/preview.webp{{ version }}"{% endif %}
+                         onerror="this.style.visibility='hidden'">
+                </div>
                 <p>{{ video.name }}</p>
             </div>
             {% endfor %}
         </div>
+        {% if next_cursor %}
+        <p><a href="/?cursor={{ next_cursor }}{% if q %}&q={{ q|urlencode }}{% endif %}">Next page</a></p>
+        {% endif %}
     </div>
+    {% if preview_enabled %}
+    <script>
+        // Swap in the animated preview while hovering; it is only downloaded on the first hover
+        document.querySelectorAll('img[data-preview]').forEach(function (img) {
+            var poster = img.src;
+            img.addEventListener('mouseenter', function () { img.src = img.dataset.preview; });
+            img.addEventListener('mouseleave', function () { img.src = poster; });
+        });
+    </script>
+    {% endif %}
+</body>
+</html>
+"""
+
+# HTML template for the player page
+PLAYER_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>{{ video_name }} - Video Player</title>
+    <link href="https://unpkg.com/video.js/dist/video-js.css" rel="stylesheet">
+    <script src="https://unpkg.com/video.js/dist/video.js"></script>
+    <script src="https://unpkg.com/@videojs/http-streaming/dist/videojs-http-streaming.js"></script>
+    {% if thumbnails_url %}
+    <link href="https://unpkg.com/videojs-vtt-thumbnails/dist/videojs-vtt-thumbnails.css" rel="stylesheet">
+    <script src="https://unpkg.com/videojs-vtt-thumbnails/dist/videojs-vtt-thumbnails.min.js"></script>
+    {% endif %}
+</head>
+<body>
+    <h1>Now Playing: {{ video_name }}</h1>
+    <video id="video-player" class="video-js" controls preload="auto" width="640" height="264">
+        <source src="{{ m3u8_url }}" type="application/x-mpegURL">
+    </video>
+    <script>
+        var player = videojs('video-player');
+        {% if thumbnails_url %}
+        // Scrubber previews come from cached sprite sheets, not from segment downloads
+        player.vttThumbnails({ src: '{{ thumbnails_url }}' });
+        {% endif %}
+    </script>
 </body>
 </html>
 """
@@ -87,22 +163,29 @@ def favicon():
     return '', 204  # No content for favicon
 
 class HLSPlayer:
-    def __init__(self, storage_handler):
+    def __init__(self, storage_handler, list_shards=1):
         self.storage = storage_handler
+        self.list_shards = list_shards
+        self.manifest = None  # last catalog manifest loaded, so reloads can be conditional
+        self.listed_ids = None  # every folder name of the last full bucket listing, None when the manifest was used
 
     def scan_videos(self):
         """Fetch available videos from the storage bucket."""
-        video_ids = self.storage.list_videos()  # Implement this method in your storage handler
+        # One conditional GET of the manifest ingest maintains; the bucket is only listed when there is none
+        self.manifest = self.storage.load_manifest(self.manifest)
+        if self.manifest is not None:
+            video_ids = sorted(self.manifest['videos'])
+            self.listed_ids = None
+        else:
+            video_ids = self.storage.list_videos(shards=self.list_shards)  # Implement this method in your storage handler
+            self.listed_ids = video_ids
         videos = []
         
-        print('Fetched Video IDs:', video_ids)  # Log the fetched video IDs
-        
         for video_id in video_ids:
             # Filter out unwanted titles
             if 'iframe' in video_id.lower():
                 continue
             m3u8_url = f'https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_m3u8/{video_id}/stream.m3u8'
-            print('Constructed m3u8 URL:', m3u8_url)  # Log the constructed m3u8 URL
             video_info = self.get_video_info(video_id, m3u8_url)
             if video_info:
                 videos.append(video_info)
@@ -114,7 +197,7 @@ class HLSPlayer:
         # Extract the folder name and file name from the m3u8 URL
         folder_name = m3u8_url.split('/')[-2]  # Get the folder name (e.g., 'maverick')
         file_name = m3u8_url.split('/')[-1].replace('.m3u8', '')  # Get the file name without extension (e.g., 'stream')
-            return {
+        return {
             'id': video_id,
             'name': f'{folder_name.capitalize()} {file_name.capitalize()}',  # e.g., 'Maverick Stream'
             'url': m3u8_url
@@ -130,55 +213,244 @@ LEASEWEB_PRIVATE_CONFIG = {  # Define your configuration here
 }
 storage_handler = FolderStorageHandler(LEASEWEB_PRIVATE_CONFIG)  # Replace with your actual config
 
+# Shared keep-alive client for all upstream (CDN / object storage) fetches
+upstream = UpstreamClient(
+    pool_size=UPSTREAM_POOL_SIZE,
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    acquire_timeout=UPSTREAM_ACQUIRE_TIMEOUT
+)
+
+# Concurrent identical upstream fetches (playlists, keys, segment fills) share one request
+single_flight = SingleFlight()
+
+# VOD playlists never change after upload, so proxy_video serves them from memory
+playlist_cache = PlaylistCache(
+    ttl=PLAYLIST_CACHE_TTL,
+    max_entries=PLAYLIST_CACHE_MAX_ENTRIES,
+    max_bytes=PLAYLIST_CACHE_MAX_BYTES
+)
+
+# Hot byte ranges of single-file TS objects are kept on local disk
+segment_cache = SegmentCache(
+    SEGMENT_CACHE_DIR,
+    max_bytes=SEGMENT_CACHE_MAX_BYTES,
+    policy=SEGMENT_CACHE_POLICY,
+    max_fill_bytes=SEGMENT_CACHE_MAX_FILL_BYTES,
+    max_age=SEGMENT_CACHE_MAX_AGE,
+    single_flight=single_flight
+)
+
+# Keys are fetched once through the authenticated storage session, then served from memory
+key_store = KeyStore(
+    storage_handler,
+    ttl=KEY_STORE_TTL,
+    negative_ttl=KEY_STORE_NEGATIVE_TTL,
+    max_entries=KEY_STORE_MAX_ENTRIES,
+    single_flight=single_flight
+)
+
+# Videos recorded by ingest; the index page and /videos page through it instead of listing the bucket
+catalog_index = CatalogIndex(CATALOG_DB_PATH)
+
+catalog_player = HLSPlayer(storage_handler, list_shards=CATALOG_LIST_SHARDS)
+
+REGISTRY.register_collector(cache_collector({
+    'playlist': playlist_cache,
+    'segment': segment_cache,
+    'key': key_store,
+    'presigned_url': storage_handler.presigned_urls
+}))
+
+def load_catalog():
+    """Scan the bucket (from the background refresher) and index videos ingest didn't record"""
+    videos = catalog_player.scan_videos()
+    catalog_index.backfill(video['id'] for video in videos)
+    if catalog_player.listed_ids is not None:
+        # Only a full listing (unfiltered) proves a video is gone; the manifest may predate older uploads
+        catalog_index.prune(catalog_player.listed_ids)
+    return videos
+
+catalog = CatalogService(load_catalog, refresh_interval=CATALOG_REFRESH_INTERVAL).start()
+
+def catalog_page(args):
+    """Look up one page of the catalog index from ``q``/``cursor``/``limit`` query arguments"""
+    limit = min(max(args.get('limit', CATALOG_PAGE_SIZE, type=int), 1), CATALOG_MAX_PAGE_SIZE)
+    return catalog_index.page(prefix=args.get('q'), cursor=args.get('cursor'), limit=limit)
+
+def sign_video(video_id, expires_in):
+    """Presign a video's playlists, segment and key in one batch; None if the video isn't in the catalog"""
+    video_info = catalog_index.get(video_id)
+    if video_info is None:
+        return None
+    key_filename = video_info.get('key_filename')
+    if not key_filename and catalog_player.manifest is not None:
+        key_filename = catalog_player.manifest['videos'].get(video_id, {}).get('key_filename')
+    expires_in = min(max(expires_in, 1), MAX_PRESIGN_EXPIRATION)
+    objects = storage_handler.video_objects(video_id, key_filename)
+    urls = storage_handler.generate_presigned_urls(objects.values(), expiration=expires_in)
+    return {"video_id": video_id, "expires_in": expires_in, "urls": dict(zip(objects, urls))}
+
+def trickplay_url(video_id, video_info):
+    """WebVTT thumbnails track for the player, versioned like the posters; None for videos ingest never indexed"""
+    if not TRICKPLAY_ENABLED or not video_info or not video_info.get('uploaded_at'):
+        return None
+    return (f"https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_m3u8/{quote(video_id)}/trickplay/thumbnails.vtt"
+            f"?v={quote(video_info['uploaded_at'])}")
+
+def segment_url(video_id):
+    """CDN URL of a video's single-file TS, the segment cache key"""
+    return f"https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_TS/{video_id}/{video_id}.ts"
+
+def proxy_segment_uris(body, video_id):
+    """Point a playlist's TS URIs at /proxy/ts/<video_id>, so playback goes through the segment cache"""
+    return body.replace(segment_url(video_id).encode('utf-8'), f"/proxy/ts/{quote(video_id)}".encode('utf-8'))
+
+def fetch_upstream(method, url, headers):
+    """Streamed upstream fetch used by the range-aware proxy helpers"""
+    return upstream.request(method, url, headers=headers, stream=True)
+
 @app.route('/')
 def index():
-    player = HLSPlayer(storage_handler)  # Pass your storage handler
-    videos = player.scan_videos()  # Fetch videos dynamically
-    return render_template_string(HTML_TEMPLATE, videos=videos)
+    try:
+        videos, next_cursor = catalog_page(request.args)
+    except ValueError as e:
+        return {"error": "Bad Request", "message": str(e)}, 400
+    # Cards are poster <img>s pointing at the CDN; no playlist is fetched until a video is opened
+    return render_template_string(HTML_TEMPLATE, videos=videos, next_cursor=next_cursor, q=request.args.get('q'),
+                                  preview_enabled=PREVIEW_ENABLED)
+
+@app.route('/videos')
+def list_videos():
+    """Page through the catalog index: ?q=<title prefix>&cursor=<next_cursor>&limit=<n>"""
+    try:
+        videos, next_cursor = catalog_page(request.args)
+    except ValueError as e:
+        return {"error": "Bad Request", "message": str(e)}, 400
+    return {"videos": videos, "next_cursor": next_cursor}
+
+@app.route('/sign/<video_id>')
+def sign_video_urls(video_id):
+    """Presigned URLs for everything a player needs for one video: ?expires_in=<seconds>"""
+    signed = sign_video(video_id, request.args.get('expires_in', PRESIGN_DEFAULT_EXPIRATION, type=int))
+    if signed is None:
+        return {"error": "Not Found", "message": "Unknown video"}, 404
+    if None in signed['urls'].values():
+        return {"error": "Signing Failed", "message": "Could not presign every object", **signed}, 500
+    return signed
 
 @app.route('/proxy/<path:video_name>')
 def proxy_video(video_name):
     """Proxy video requests to avoid CORS issues"""
-    cdn_url = f"https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_m3u8/{video_name}/stream.m3u8"
-    response = requests.get(cdn_url)
-    return Response(response.content, content_type='application/x-mpegURL')
+    playlist = playlist_cache.get(video_name)
+    if playlist is None:
+        cdn_url = f"https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_m3u8/{video_name}/stream.m3u8"
+        stale = playlist_cache.stale(video_name)
+        if stale is not None:
+            # Revalidate the expired copy rather than downloading it again
+            conditional = {'If-Modified-Since': stale.last_modified}
+            if stale.upstream_etag:
+                conditional['If-None-Match'] = stale.upstream_etag
+        else:
+            conditional = conditional_request_headers(request.headers)
+        try:
+            response, shared = single_flight.do(('playlist', cdn_url, tuple(sorted(conditional.items()))),
+                                                lambda: upstream.get(cdn_url, headers=conditional))
+        except requests.Timeout:
+            return {"error": "Gateway Timeout", "message": "Request to CDN timed out"}, 504
+        except requests.RequestException as e:
+            return {"error": "CDN Request Failed", "message": str(e)}, 502
+        if shared:
+            server_timing.record('upstream', desc='coalesced')
+        if response.status_code == 304 and stale is not None:
+            server_timing.record('playlist-cache', desc='revalidated')
+            playlist = playlist_cache.refresh(video_name) or stale
+        elif response.status_code == 304:
+            return not_modified_response(response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        elif response.status_code != 200:
+            return Response(response.content, status=response.status_code, content_type='application/x-mpegURL')
+        else:
+            server_timing.record('playlist-cache', desc='miss')
+            playlist = playlist_cache.put(video_name, proxy_segment_uris(response.content, video_name),
+                                          etag=response.headers.get('ETag'),
+                                          last_modified=response.headers.get('Last-Modified'))
+    else:
+        server_timing.record('playlist-cache', desc='hit')
+
+    # Range, If-Range, If-None-Match/If-Modified-Since and HEAD are answered from the cached copy
+    flask_response = Response(playlist.body, content_type='application/x-mpegURL')
+    flask_response.headers['ETag'] = playlist.etag
+    flask_response.headers['Last-Modified'] = playlist.last_modified
+    return flask_response.make_conditional(request, accept_ranges=True, complete_length=len(playlist.body))
+
+@app.route('/proxy/ts/<video_id>')
+def proxy_segment(video_id):
+    """Proxy byte ranges of a video's single-file TS through the on-disk segment cache"""
+    try:
+        return serve_segment(segment_cache, fetch_upstream, segment_url(video_id), request, 'video/mp2t')
+    except requests.Timeout:
+        return {"error": "Gateway Timeout", "message": "Request to CDN timed out"}, 504
+    except requests.RequestException as e:
+        return {"error": "CDN Request Failed", "message": str(e)}, 502
 
 @app.route('/proxy/key/<path:key_name>')
 def proxy_key(key_name):
     """Proxy key requests to avoid CORS issues"""
-    key_url = f"https://nl.object-storage.io/private-bucket-nl/Example_folder_for_Key/{key_name}"
-    response = requests.get(key_url)
-    return Response(response.content, content_type='application/octet-stream')
+    if '/' in key_name:
+        return {"error": "Not Found", "message": "Unknown key"}, 404
+    try:
+        key = key_store.get(key_name)
+    except (BotoCoreError, ClientError) as e:
+        return {"error": "Storage Request Failed", "message": str(e)}, 502
+    if key is None:
+        return {"error": "Not Found", "message": "Unknown key"}, 404
+
+    flask_response = Response(key, content_type='application/octet-stream')
+    flask_response.headers['Cache-Control'] = 'private, no-transform'
+    flask_response.add_etag()  # strong, derived from the key bytes
+    return flask_response.make_conditional(request, accept_ranges=True, complete_length=len(key))
+
+@app.route('/stats')
+def stats():
+    """Expose internal statistics used to size the proxy"""
+    return {
+        "upstream": upstream.stats(),
+        "playlist_cache": playlist_cache.stats(),
+        "segment_cache": segment_cache.stats(),
+        "key_store": key_store.stats(),
+        "single_flight": single_flight.stats(),
+        "catalog": dict(catalog.stats(), indexed=catalog_index.count()),
+        "presigned_urls": storage_handler.presigned_urls.stats(),
+        "logging": app_logging.stats()
+    }
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: request latencies, upstream TTFB, bytes sent, cache and S3 metrics, ingest stages"""
+    return Response(render_metrics([INGEST_METRICS_PATH]), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/cache/invalidate/<video_id>', methods=['POST'])
+def invalidate_video(video_id):
+    """Invalidation hook called by the ingest pipeline after (re-)uploading a video"""
+    if CACHE_INVALIDATE_TOKEN and request.headers.get('X-Invalidate-Token') != CACHE_INVALIDATE_TOKEN:
+        return {"error": "Forbidden", "message": "Invalid invalidation token"}, 403
+    removed = playlist_cache.invalidate(video_id, request.args.get('variant'))
+    segments_removed = segment_cache.discard(segment_url(video_id))  # a re-upload replaces the TS bytes
+    catalog.invalidate()  # a new upload must show up on the index page
+    return {"video_id": video_id, "playlists_invalidated": removed, "segments_invalidated": segments_removed,
+            "catalog_refresh_scheduled": True}
 
 @app.route('/play/<video_id>')
 def play_video(video_id):
     """Render the video player for the selected video."""
     m3u8_url = f'https://di-yusrkfqf.leasewebultracdn.com/Example_folder_for_m3u8/{video_id}/stream.m3u8'
-    # Get video name from HLSPlayer
-    player = HLSPlayer(storage_handler)
-    video_info = player.get_video_info(video_id, m3u8_url)
+    # Get video name from the catalog index (videos not indexed yet fall back to HLSPlayer's naming)
+    video_info = catalog_index.get(video_id) or HLSPlayer(storage_handler).get_video_info(video_id, m3u8_url)
     video_name = video_info['name'] if video_info else video_id
+    thumbnails_url = trickplay_url(video_id, video_info)
     
-    return render_template_string('''
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>{{ video_name }} - Video Player</title>
-        <link href="https://unpkg.com/video.js/dist/video-js.css" rel="stylesheet">
-        <script src="https://unpkg.com/video.js/dist/video.js"></script>
-        <script src="https://unpkg.com/@videojs/http-streaming/dist/videojs-http-streaming.js"></script>
-    </head>
-    <body>
-        <h1>Now Playing: {{ video_name }}</h1>
-        <video id="video-player" class="video-js" controls preload="auto" width="640" height="264">
-            <source src="{{ m3u8_url }}" type="application/x-mpegURL">
-        </video>
-        <script>
-            var player = videojs('video-player');
-        </script>
-    </body>
-    </html>
-    ''', video_id=video_id, m3u8_url=m3u8_url, video_name=video_name)
+    return render_template_string(PLAYER_TEMPLATE, video_id=video_id, m3u8_url=m3u8_url, video_name=video_name,
+                                  thumbnails_url=thumbnails_url)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True) 
\ No newline at end of file
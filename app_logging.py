@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Path of the request being handled, used to pick its sampling rate and added to its records
+_request_path = contextvars.ContextVar('log_request_path', default=None)
+
+# Attributes every LogRecord has; anything else was passed with ``extra=`` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sampled'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, plus any ``extra=`` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                document[name] = value
+        if record.exc_info:
+            document['exc'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of INFO/DEBUG records per request path prefix (longest prefix wins).
+
+    Warnings and errors always pass, as do records logged with ``extra={'sampled': True}``
+    (they were sampled by their caller already) and records outside any request.
+    """
+
+    def __init__(self, rates: dict = None, default_rate: float = 1.0):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.default_rate = default_rate
+        self.sampled_out = 0
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        path = _request_path.get()
+        if path is not None:
+            record.path = path
+        if record.levelno >= logging.WARNING or getattr(record, 'sampled', False) or path is None:
+            return True
+        rate = self.rate_for(path)
+        if rate >= 1 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the message arguments here; formatting (tracebacks included) is left to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_lock = threading.Lock()
+_state = {}
+
+
+def _reset_after_fork():
+    # A forked child has the queue handler but not the listener thread draining it;
+    # forget the setup so the child's own configure_logging() call starts a new one
+    global _lock
+    _lock = threading.Lock()
+    _state.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def parse_sample_rates(spec: str) -> dict:
+    """Parse ``"/proxy/ts/=0.001,/proxy/=0.01"`` into ``{prefix: rate}``"""
+    rates = {}
+    for item in spec.split(','):
+        if '=' in item:
+            prefix, rate = item.rsplit('=', 1)
+            rates[prefix.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level: str = 'INFO', fmt: str = 'json', sample_rates: dict = None, default_rate: float = 1.0,
+                      queue_size: int = 10000):
+    """Route the root logger through a bounded queue drained by a background thread.
+
+    Callers only render the message and enqueue the record; formatting and writing
+    to stdout happen on the listener thread, so a slow or blocked stdout never
+    stalls a request. Safe to call more than once; later calls are ignored.
+    """
+    with _lock:
+        if _state:
+            return
+        log_queue = queue.Queue(maxsize=queue_size)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        sampling = SamplingFilter(sample_rates, default_rate)
+        queue_handler.addFilter(sampling)
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if fmt == 'json':
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)  # flushes what is still queued
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+        _state.update(queue=log_queue, handler=queue_handler, sampling=sampling, listener=listener)
+
+
+def bind_request_path(path: str):
+    """Mark the records logged from here on (in this thread or task) as belonging to ``path``"""
+    return _request_path.set(path)
+
+
+def instrument_flask(app):
+    """Bind each Flask request's path so its records are sampled by route"""
+    from flask import request
+
+    @app.before_request
+    def bind_path():
+        bind_request_path(request.path)
+
+    return app
+
+
+class ASGILogContextMiddleware:
+    """ASGI counterpart of ``instrument_flask``"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            bind_request_path(scope.get('path', ''))
+        await self.app(scope, receive, send)
+
+
+def stats() -> dict:
+    """Return queue depth and how many records were dropped or sampled out"""
+    if not _state:
+        return {'configured': False}
+    return {
+        'configured': True,
+        'queued': _state['queue'].qsize(),
+        'dropped': _state['handler'].dropped,
+        'sampled_out': _state['sampling'].sampled_out,
+    }
@@ -0,0 +1,378 @@
+# Async (ASGI) serving mode for the catalog and proxy routes: `uvicorn asgi_app:app`
+# (or `python asgi_app.py`). Proxied streams are relayed on the event loop, so one
+# process serves thousands of slow clients without pinning a worker thread per
+# transfer. Storage, playlist cache, key store and segment cache are the same layers
+# the Flask app in app.py uses.
+import os
+import time
+
+import anyio
+import httpx
+from jinja2 import Environment
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import generate_etag, parse_content_range_header, quote_etag
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import (HTML_TEMPLATE, PLAYER_TEMPLATE, HLSPlayer, catalog, catalog_index, catalog_page, key_store,
+                 playlist_cache, proxy_segment_uris, segment_cache, segment_url, sign_video, storage_handler,
+                 trickplay_url)
+from config import (UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT, UPSTREAM_ACQUIRE_TIMEOUT,
+                    PREVIEW_ENABLED, PRESIGN_DEFAULT_EXPIRATION, INGEST_METRICS_PATH, SERVER_TIMING_LOG_SAMPLE_RATE,
+                    CACHE_INVALIDATE_TOKEN)
+from proxy_stream import (RELAYED_RESPONSE_HEADERS, STREAM_CHUNK_SIZE, conditional_request_headers, if_range_matches,
+                          not_modified, parse_byte_range, range_request_headers, resolve_span)
+import server_timing
+import app_logging
+from segment_cache import unchanged
+from single_flight import AsyncSingleFlight
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, UPSTREAM_TTFB_SECONDS, ASGIMetricsMiddleware,
+                     render_metrics)
+
+CDN_BASE_URL = 'https://di-yusrkfqf.leasewebultracdn.com'
+
+templates = Environment(autoescape=True)
+index_template = templates.from_string(HTML_TEMPLATE)
+player_template = templates.from_string(PLAYER_TEMPLATE)
+
+# Relayed bytes buffered between segment cache writes while a fill streams through
+FILL_FLUSH_BYTES = 1024 * 1024
+
+single_flight = AsyncSingleFlight()
+client = None  # httpx.AsyncClient, opened on startup
+
+
+async def startup():
+    global client
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE * 4, max_keepalive_connections=UPSTREAM_POOL_SIZE),
+        timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT, pool=UPSTREAM_ACQUIRE_TIMEOUT)
+    )
+
+
+async def shutdown():
+    await client.aclose()
+
+
+async def send_upstream(method: str, url: str, headers: dict, stream: bool = False) -> httpx.Response:
+    """Send an upstream request, recording connect, time to first byte and (if buffered) transfer time"""
+    marks = {}
+
+    async def trace(event_name, info):
+        # httpcore connection events: connect_tcp / start_tls, then request headers out, response headers in
+        marks.setdefault(event_name, time.perf_counter())
+
+    upstream_request = client.build_request(method, url, headers=headers, extensions={'trace': trace})
+    started = time.perf_counter()
+    response = await client.send(upstream_request, stream=stream)
+    finished = time.perf_counter()
+
+    connect_started = marks.get('connection.connect_tcp.started')
+    connected = marks.get('connection.start_tls.complete', marks.get('connection.connect_tcp.complete'))
+    headers_sent = marks.get('http11.send_request_headers.started', marks.get('http2.send_request_headers.started'))
+    headers_received = marks.get('http11.receive_response_headers.complete',
+                                 marks.get('http2.receive_response_headers.complete', finished))
+    UPSTREAM_TTFB_SECONDS.observe(headers_received - started, host=upstream_request.url.host)
+    if connect_started is not None and connected is not None:
+        server_timing.record('upstream-connect', connected - connect_started)
+    server_timing.record('upstream-ttfb', headers_received - (headers_sent or started))
+    if not stream:
+        server_timing.record('upstream-transfer', finished - headers_received)
+    return response
+
+
+def not_modified_response(etag: str, last_modified: str) -> Response:
+    """A header-only 304 carrying the validators the client should keep"""
+    headers = {}
+    if etag:
+        headers['ETag'] = etag
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+    return Response(status_code=304, headers=headers)
+
+
+def gateway_error(e: httpx.HTTPError) -> JSONResponse:
+    """Map an upstream failure to the same JSON errors the Flask app returns"""
+    if isinstance(e, httpx.TimeoutException):
+        return JSONResponse({"error": "Gateway Timeout", "message": "Request to CDN timed out"}, status_code=504)
+    return JSONResponse({"error": "CDN Request Failed", "message": str(e)}, status_code=502)
+
+
+async def index(request):
+    """Render the video library"""
+    try:
+        videos, next_cursor = await run_in_threadpool(catalog_page, MultiDict(request.query_params.multi_items()))
+    except ValueError as e:
+        return JSONResponse({"error": "Bad Request", "message": str(e)}, status_code=400)
+    return HTMLResponse(index_template.render(videos=videos, next_cursor=next_cursor,
+                                              q=request.query_params.get('q'), preview_enabled=PREVIEW_ENABLED))
+
+
+async def list_videos(request):
+    """Page through the catalog index: ?q=<title prefix>&cursor=<next_cursor>&limit=<n>"""
+    try:
+        videos, next_cursor = await run_in_threadpool(catalog_page, MultiDict(request.query_params.multi_items()))
+    except ValueError as e:
+        return JSONResponse({"error": "Bad Request", "message": str(e)}, status_code=400)
+    return JSONResponse({"videos": videos, "next_cursor": next_cursor})
+
+
+async def play_video(request):
+    """Render the video player for the selected video"""
+    video_id = request.path_params['video_id']
+    m3u8_url = f'{CDN_BASE_URL}/Example_folder_for_m3u8/{video_id}/stream.m3u8'
+    video_info = (await run_in_threadpool(catalog_index.get, video_id)
+                  or HLSPlayer(storage_handler).get_video_info(video_id, m3u8_url))
+    video_name = video_info['name'] if video_info else video_id
+    return HTMLResponse(player_template.render(video_id=video_id, m3u8_url=m3u8_url, video_name=video_name,
+                                               thumbnails_url=trickplay_url(video_id, video_info)))
+
+
+async def invalidate_video(request):
+    """Invalidation hook called by the ingest pipeline after (re-)uploading a video"""
+    video_id = request.path_params['video_id']
+    if CACHE_INVALIDATE_TOKEN and request.headers.get('X-Invalidate-Token') != CACHE_INVALIDATE_TOKEN:
+        return JSONResponse({"error": "Forbidden", "message": "Invalid invalidation token"}, status_code=403)
+    removed = playlist_cache.invalidate(video_id, request.query_params.get('variant'))
+    segments_removed = segment_cache.discard(segment_url(video_id))  # a re-upload replaces the TS bytes
+    catalog.invalidate()  # a new upload must show up on the index page
+    return JSONResponse({"video_id": video_id, "playlists_invalidated": removed,
+                         "segments_invalidated": segments_removed, "catalog_refresh_scheduled": True})
+
+
+async def sign_video_urls(request):
+    """Presigned URLs for everything a player needs for one video: ?expires_in=<seconds>"""
+    try:
+        expires_in = int(request.query_params.get('expires_in', PRESIGN_DEFAULT_EXPIRATION))
+    except ValueError:
+        expires_in = PRESIGN_DEFAULT_EXPIRATION
+    signed = await run_in_threadpool(sign_video, request.path_params['video_id'], expires_in)
+    if signed is None:
+        return JSONResponse({"error": "Not Found", "message": "Unknown video"}, status_code=404)
+    if None in signed['urls'].values():
+        return JSONResponse({"error": "Signing Failed", "message": "Could not presign every object", **signed},
+                            status_code=500)
+    return JSONResponse(signed)
+
+
+async def proxy_video(request):
+    """Serve a video's playlist from the shared playlist cache, fetching it once on a miss"""
+    video_name = request.path_params['video_name']
+    playlist = playlist_cache.get(video_name)
+    if playlist is None:
+        cdn_url = f'{CDN_BASE_URL}/Example_folder_for_m3u8/{video_name}/stream.m3u8'
+        stale = playlist_cache.stale(video_name)
+        if stale is not None:
+            # Revalidate the expired copy rather than downloading it again
+            conditional = {'If-Modified-Since': stale.last_modified}
+            if stale.upstream_etag:
+                conditional['If-None-Match'] = stale.upstream_etag
+        else:
+            conditional = conditional_request_headers(request.headers)
+        try:
+            response, shared = await single_flight.do(('playlist', cdn_url, tuple(sorted(conditional.items()))),
+                                                      lambda: send_upstream('GET', cdn_url, conditional))
+        except httpx.HTTPError as e:
+            return gateway_error(e)
+        if shared:
+            server_timing.record('upstream', desc='coalesced')
+        if response.status_code == 304 and stale is not None:
+            server_timing.record('playlist-cache', desc='revalidated')
+            playlist = playlist_cache.refresh(video_name) or stale
+        elif response.status_code == 304:
+            return not_modified_response(response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        elif response.status_code != 200:
+            return Response(response.content, status_code=response.status_code, media_type='application/x-mpegURL')
+        else:
+            server_timing.record('playlist-cache', desc='miss')
+            playlist = playlist_cache.put(video_name, proxy_segment_uris(response.content, video_name),
+                                          etag=response.headers.get('ETag'),
+                                          last_modified=response.headers.get('Last-Modified'))
+    else:
+        server_timing.record('playlist-cache', desc='hit')
+
+    if not_modified(request.headers, playlist.etag, playlist.last_modified):
+        return not_modified_response(playlist.etag, playlist.last_modified)
+    return Response(playlist.body, media_type='application/x-mpegURL',
+                    headers={'ETag': playlist.etag, 'Last-Modified': playlist.last_modified})
+
+
+async def proxy_key(request):
+    """Serve a key from the shared key store"""
+    key_name = request.path_params['key_name']
+    if '/' in key_name:
+        return JSONResponse({"error": "Not Found", "message": "Unknown key"}, status_code=404)
+    try:
+        key = await run_in_threadpool(key_store.get, key_name)
+    except Exception as e:
+        return JSONResponse({"error": "Storage Request Failed", "message": str(e)}, status_code=502)
+    if key is None:
+        return JSONResponse({"error": "Not Found", "message": "Unknown key"}, status_code=404)
+    etag = quote_etag(generate_etag(key))
+    if not_modified(request.headers, etag, None):
+        return not_modified_response(etag, None)
+    return Response(key, media_type='application/octet-stream',
+                    headers={'Cache-Control': 'private, no-transform', 'ETag': etag})
+
+
+async def _iter_disk(f, start: int, stop: int):
+    """Read [start, stop) of an opened cached object without blocking the event loop, then close it"""
+    async with f:
+        await f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = await f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _relay_and_fill(response: httpx.Response, ts_url: str, content_range):
+    """Relay a 206 body to the client, writing it into the segment cache as it arrives"""
+    entry = await run_in_threadpool(segment_cache.begin, ts_url, content_range.length, response.headers.get('ETag'),
+                                    response.headers.get('Last-Modified'))
+    offset = content_range.start
+    pending, pending_bytes = [], 0
+    async for chunk in response.aiter_raw(STREAM_CHUNK_SIZE):
+        yield chunk
+        if entry is None:
+            continue
+        pending.append(chunk)
+        pending_bytes += len(chunk)
+        if pending_bytes >= FILL_FLUSH_BYTES:
+            written = await run_in_threadpool(segment_cache.write, entry, offset, pending)
+            if written < pending_bytes:
+                entry = None  # evicted mid-fill: keep relaying, stop caching
+            offset += written
+            pending, pending_bytes = [], 0
+    if entry is not None and pending:
+        await run_in_threadpool(segment_cache.write, entry, offset, pending)
+
+
+async def _revalidate(ts_url: str, entry):
+    """Check an expired segment cache entry with an upstream HEAD; returns it if unchanged, else drops it"""
+    check_headers = {'Accept-Encoding': 'identity'}
+    if entry.etag:
+        check_headers['If-None-Match'] = entry.etag
+    elif entry.last_modified:
+        check_headers['If-Modified-Since'] = entry.last_modified
+    response = await send_upstream('HEAD', ts_url, check_headers)
+    if unchanged(entry, response.status_code, response.headers):
+        await run_in_threadpool(segment_cache.revalidated, entry)
+        return entry
+    segment_cache.discard(ts_url)
+    return None
+
+
+async def proxy_segment(request):
+    """Relay (ranges of) a video's single-file TS, serving cached spans from the segment cache and filling it"""
+    video_id = request.path_params['video_id']
+    ts_url = segment_url(video_id)
+
+    byte_range = parse_byte_range(request.headers)
+    entry = segment_cache.lookup(ts_url)
+    if entry is not None and segment_cache.expired(entry):
+        try:
+            entry, _ = await single_flight.do(('revalidate', ts_url), lambda: _revalidate(ts_url, entry))
+        except httpx.HTTPError as e:
+            return gateway_error(e)
+    if entry is not None and not_modified(request.headers, entry.etag, entry.last_modified):
+        segment_cache.count('not_modified')
+        return not_modified_response(entry.etag, entry.last_modified)
+    if (request.method == 'GET' and entry is not None and byte_range is not None and len(byte_range.ranges) == 1
+            and if_range_matches(request.headers.get('If-Range'), entry.etag, entry.last_modified)):
+        span = resolve_span(*byte_range.ranges[0], entry.size)
+        cached_file = None
+        if span is not None and not entry.missing(*span):
+            try:
+                cached_file = await anyio.open_file(segment_cache.data_path(ts_url), 'rb')
+            except OSError:
+                pass  # evicted since the lookup: relayed from upstream below
+        if cached_file is not None:
+            start, stop = span
+            segment_cache.count('hits')
+            segment_cache.count('bytes_from_disk', stop - start)
+            headers = {'Content-Length': str(stop - start), 'Accept-Ranges': 'bytes',
+                       'Content-Range': f'bytes {start}-{stop - 1}/{entry.size}'}
+            if entry.etag:
+                headers['ETag'] = entry.etag
+            if entry.last_modified:
+                headers['Last-Modified'] = entry.last_modified
+            return StreamingResponse(_iter_disk(cached_file, start, stop), status_code=206, headers=headers,
+                                     media_type='video/mp2t')
+
+    if request.method == 'GET':
+        segment_cache.count('misses')
+    try:
+        upstream_headers = dict(range_request_headers(request.headers), **conditional_request_headers(request.headers))
+        # Raw bytes are relayed and cached as-is, so they must not come back content-encoded
+        upstream_headers['Accept-Encoding'] = 'identity'
+        response = await send_upstream(request.method, ts_url, upstream_headers, stream=True)
+    except httpx.HTTPError as e:
+        return gateway_error(e)
+    headers = {name: response.headers[name] for name in RELAYED_RESPONSE_HEADERS if name in response.headers}
+    headers.setdefault('Accept-Ranges', 'bytes')
+    if request.method == 'HEAD' or response.status_code == 304:
+        await response.aclose()
+        return Response(status_code=response.status_code, headers=headers, media_type='video/mp2t')
+    content_range = parse_content_range_header(response.headers.get('Content-Range'))
+    if (response.status_code == 206 and content_range is not None and content_range.length is not None
+            and content_range.stop - content_range.start <= segment_cache.max_fill_bytes):
+        body = _relay_and_fill(response, ts_url, content_range)
+    else:
+        body = response.aiter_raw(STREAM_CHUNK_SIZE)
+    return StreamingResponse(body, status_code=response.status_code, headers=headers, media_type='video/mp2t',
+                             background=BackgroundTask(response.aclose))
+
+
+async def metrics(request):
+    """Prometheus scrape endpoint: request latencies, upstream TTFB, bytes sent, cache and S3 metrics, ingest stages"""
+    return Response(render_metrics([INGEST_METRICS_PATH]), media_type=METRICS_CONTENT_TYPE)
+
+
+async def stats(request):
+    """Expose the statistics of the shared caching layers and the async fetch coalescing"""
+    return JSONResponse({
+        "playlist_cache": playlist_cache.stats(),
+        "segment_cache": segment_cache.stats(),
+        "key_store": key_store.stats(),
+        "single_flight": single_flight.stats(),
+        "catalog": dict(catalog.stats(), indexed=catalog_index.count()),
+        "presigned_urls": storage_handler.presigned_urls.stats(),
+        "logging": app_logging.stats(),
+    })
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/videos', list_videos),
+        Route('/play/{video_id}', play_video),
+        Route('/sign/{video_id}', sign_video_urls),
+        Route('/cache/invalidate/{video_id}', invalidate_video, methods=['POST']),
+        Route('/proxy/key/{key_name:path}', proxy_key, methods=['GET', 'HEAD']),
+        Route('/proxy/ts/{video_id}', proxy_segment, methods=['GET', 'HEAD']),
+        Route('/proxy/{video_name:path}', proxy_video, methods=['GET', 'HEAD']),
+        Route('/stats', stats),
+        Route('/metrics', metrics),
+    ],
+    middleware=[
+        Middleware(ASGIMetricsMiddleware),
+        Middleware(server_timing.ASGIServerTimingMiddleware, sample_rate=SERVER_TIMING_LOG_SAMPLE_RATE),
+        Middleware(app_logging.ASGILogContextMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'HEAD', 'POST', 'OPTIONS'],
+                   allow_headers=['Content-Type', 'Authorization', 'Range'])
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
@@ -0,0 +1,124 @@
+import base64
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    duration REAL,
+    size_bytes INTEGER,
+    segment_count INTEGER,
+    key_filename TEXT,
+    uploaded_at TEXT
+);
+CREATE INDEX IF NOT EXISTS videos_by_name ON videos (name_key, id);
+"""
+
+_COLUMNS = ('id', 'name', 'duration', 'size_bytes', 'segment_count', 'key_filename', 'uploaded_at')
+
+
+def display_name(video_id: str) -> str:
+    """Human-readable title for a video ID (the ingested file's stem)"""
+    return ' '.join(video_id.replace('_', ' ').replace('-', ' ').split()).title() or video_id
+
+
+def encode_cursor(name_key: str, video_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([name_key, video_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor from ``CatalogIndex.page``; raises ValueError if it is malformed"""
+    try:
+        name_key, video_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    return str(name_key), str(video_id)
+
+
+class CatalogIndex:
+    """Persistent SQLite index of ingested videos.
+
+    Ingest writes one row per video; the web apps page through it ordered by title,
+    with prefix search served from the (name_key, id) index rather than a bucket
+    listing. Each thread gets its own connection; WAL mode lets readers run while
+    ingest writes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, video_id: str, name: str = None, duration: float = None, size_bytes: int = None,
+               segment_count: int = None, key_filename: str = None, uploaded_at: str = None):
+        """Insert or replace the row for an ingested video"""
+        name = name or display_name(video_id)
+        uploaded_at = uploaded_at or datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO videos (id, name, name_key, duration, size_bytes, segment_count, key_filename,"
+                " uploaded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, name, name.casefold(), duration, size_bytes, segment_count, key_filename, uploaded_at)
+            )
+
+    def backfill(self, video_ids) -> int:
+        """Add bare rows for videos found in storage but never indexed (e.g. ingested elsewhere)"""
+        rows = [(video_id, display_name(video_id), display_name(video_id).casefold()) for video_id in video_ids]
+        with self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO videos (id, name, name_key) VALUES (?, ?, ?)", rows)
+            return conn.total_changes - before
+
+    def prune(self, video_ids) -> int:
+        """Delete rows for videos missing from ``video_ids``, which must be a complete bucket listing"""
+        with self._connect() as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS listed (id TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO listed (id) VALUES (?)", ((video_id,) for video_id in video_ids))
+            removed = conn.execute("DELETE FROM videos WHERE id NOT IN (SELECT id FROM listed)").rowcount
+            conn.execute("DELETE FROM listed")
+            return removed
+
+    def get(self, video_id: str):
+        """Return the indexed video as a dict, or None"""
+        row = self._connect().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM videos WHERE id = ?", (video_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def page(self, prefix: str = None, cursor: str = None, limit: int = 50) -> tuple:
+        """Return ``(videos, next_cursor)`` ordered by title, optionally limited to titles starting with ``prefix``.
+
+        ``next_cursor`` is None on the last page. Raises ValueError for a malformed cursor.
+        """
+        clauses, params = [], []
+        if prefix:
+            clauses.append("name_key >= ? AND name_key < ?")
+            params += [prefix.casefold(), prefix.casefold() + '\U0010ffff']
+        if cursor:
+            clauses.append("(name_key, id) > (?, ?)")
+            params += list(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(
+            f"SELECT {', '.join(_COLUMNS)}, name_key FROM videos {where} ORDER BY name_key, id LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1]['name_key'], rows[limit - 1]['id']) if len(rows) > limit else None
+        return [{column: row[column] for column in _COLUMNS} for row in rows[:limit]], next_cursor
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
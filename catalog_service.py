@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogService:
+    """In-memory video catalog, refreshed from object storage by a background thread.
+
+    Readers always get the list held in memory and never wait on storage: between
+    refreshes (and while one is running or failing) the previous list keeps being
+    served. ``invalidate()`` lets ingest trigger a refresh without waiting for the
+    next interval.
+    """
+
+    def __init__(self, load, refresh_interval: float = 60):
+        self._load = load  # returns a list of video dicts with at least an 'id'
+        self.refresh_interval = refresh_interval
+
+        self._videos = []
+        self._by_id = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.invalidations = 0
+        self.last_error = None
+
+    def start(self):
+        """Start the background refresh thread (the first load happens right away)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='catalog-refresh', daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+
+    def refresh(self) -> bool:
+        """Reload the catalog from storage; on failure the previous list stays in place"""
+        try:
+            videos = self._load()
+        except Exception as e:
+            with self._lock:
+                self.refresh_errors += 1
+                self.last_error = str(e)
+            logger.warning(f"Catalog refresh failed, still serving the previous list: {str(e)}")
+            return False
+        with self._lock:
+            if {video['id'] for video in videos} != set(self._by_id):
+                logger.info(f"Catalog refreshed: {len(videos)} videos")
+            self._videos = videos
+            self._by_id = {video['id']: video for video in videos}
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+        return True
+
+    def videos(self) -> list:
+        """Return the current video list without touching storage"""
+        with self._lock:
+            return list(self._videos)
+
+    def get(self, video_id: str):
+        """Return the catalog entry for ``video_id``, or None if it isn't listed (yet)"""
+        with self._lock:
+            return self._by_id.get(video_id)
+
+    def invalidate(self):
+        """Schedule an immediate background refresh, e.g. after ingest uploaded a video"""
+        with self._lock:
+            self.invalidations += 1
+        self._wake.set()
+
+    def stats(self) -> dict:
+        """Return catalog size, age and refresh counters"""
+        with self._lock:
+            return {
+                'videos': len(self._videos),
+                'age_seconds': round(time.monotonic() - self._loaded_at, 3) if self._loaded_at is not None else None,
+                'refresh_interval': self.refresh_interval,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'invalidations': self.invalidations,
+                'last_error': self.last_error,
+            }
@@ -33,7 +33,8 @@ LEASEWEB_PRIVATE_CONFIG = {
     'bucket_name': os.getenv('LEASEWEB_PRIVATE_BUCKET', 'private-bucket-nl'),
     'access_key': os.getenv('LEASEWEB_ACCESS_KEY'),
     'secret_key': os.getenv('LEASEWEB_SECRET_KEY'),
-    'region': os.getenv('LEASEWEB_REGION', 'nl')
+    'region': os.getenv('LEASEWEB_REGION', 'nl'),
+    'manifest_shards': int(os.getenv('CATALOG_MANIFEST_SHARDS', '1'))  # >1 spreads _catalog.json over shard objects
 }
 
 # Validate required configuration
@@ -47,4 +48,92 @@ OUTPUT_DIR = BASE_DIR / 'output'
 # FFmpeg Configuration (optional in production)
 FFMPEG_PATH = os.getenv('FFMPEG_PATH', r"C:\ffmpeg\ffmpeg.exe")
 SEGMENT_DURATION = int(os.getenv('SEGMENT_DURATION', '6'))
-KEY_LENGTH = int(os.getenv('KEY_LENGTH', '16'))  # 128-bit key 
\ No newline at end of file
+KEY_LENGTH = int(os.getenv('KEY_LENGTH', '16'))  # 128-bit key 
+
+# Ingest Concurrency
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '1'))  # videos encoded at once (worker processes); 0 = one per CPU core
+INGEST_UPLOAD_WORKERS = int(os.getenv('INGEST_UPLOAD_WORKERS', '4'))  # encoded videos uploaded at once (threads)
+INGEST_PIPELINED_UPLOAD = os.getenv('INGEST_PIPELINED_UPLOAD', 'false').lower() in ('1', 'true', 'yes')  # upload TS while ffmpeg writes it
+PIPELINED_UPLOAD_PART_SIZE = int(os.getenv('PIPELINED_UPLOAD_PART_SIZE', str(16 * 1024 * 1024)))  # bytes, at least 5 MiB
+PIPELINED_UPLOAD_POLL_INTERVAL = float(os.getenv('PIPELINED_UPLOAD_POLL_INTERVAL', '0.5'))  # seconds between size checks
+
+# Upload Transfer Engine (TS files)
+TRANSFER_MAX_CONCURRENCY = int(os.getenv('TRANSFER_MAX_CONCURRENCY', '16'))  # parts in flight across all uploads (= S3 connections)
+TRANSFER_MIN_PART_SIZE = int(os.getenv('TRANSFER_MIN_PART_SIZE', str(8 * 1024 * 1024)))  # bytes; smaller files go up in one PUT
+TRANSFER_MAX_PART_SIZE = int(os.getenv('TRANSFER_MAX_PART_SIZE', str(64 * 1024 * 1024)))  # bytes; bounds memory per part in flight
+TRANSFER_TARGET_PART_SECONDS = float(os.getenv('TRANSFER_TARGET_PART_SECONDS', '2'))  # part size aims at this per part
+TRANSFER_MAX_BANDWIDTH = float(os.getenv('TRANSFER_MAX_BANDWIDTH', '0'))  # bytes/s across all uploads, 0 = unlimited
+STORAGE_UPLOAD_WORKERS = int(os.getenv('STORAGE_UPLOAD_WORKERS', '8'))  # files (key, playlists, TS, assets) uploaded at once
+
+# Poster / Preview Configuration (library grid images extracted at ingest)
+POSTER_WIDTH = int(os.getenv('POSTER_WIDTH', '320'))
+POSTER_OFFSET = float(os.getenv('POSTER_OFFSET', '5'))  # seconds into the video (capped at half its duration)
+PREVIEW_ENABLED = os.getenv('PREVIEW_ENABLED', 'false').lower() in ('1', 'true', 'yes')  # animated WebP on hover
+PREVIEW_DURATION = float(os.getenv('PREVIEW_DURATION', '3'))
+POSTER_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # URLs are versioned by upload time
+
+# Trickplay Configuration (scrubber thumbnails: sprite sheets + WebVTT track extracted at ingest)
+TRICKPLAY_ENABLED = os.getenv('TRICKPLAY_ENABLED', 'false').lower() in ('1', 'true', 'yes')  # costs a second decode pass per video
+TRICKPLAY_INTERVAL = float(os.getenv('TRICKPLAY_INTERVAL', '5'))  # seconds between thumbnails
+TRICKPLAY_WIDTH = int(os.getenv('TRICKPLAY_WIDTH', '160'))
+TRICKPLAY_HEIGHT = int(os.getenv('TRICKPLAY_HEIGHT', '90'))  # thumbnails are letterboxed to a fixed size
+TRICKPLAY_COLUMNS = int(os.getenv('TRICKPLAY_COLUMNS', '10'))
+TRICKPLAY_ROWS = int(os.getenv('TRICKPLAY_ROWS', '10'))
+
+# Upstream HTTP Client Configuration (proxy routes)
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '50'))  # connections (and concurrent requests) per host
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '30'))
+UPSTREAM_ACQUIRE_TIMEOUT = float(os.getenv('UPSTREAM_ACQUIRE_TIMEOUT', '10'))
+
+# Playlist Cache Configuration (proxy_video)
+PLAYLIST_CACHE_TTL = float(os.getenv('PLAYLIST_CACHE_TTL', '300'))  # seconds; VOD playlists only change on re-upload
+PLAYLIST_CACHE_MAX_ENTRIES = int(os.getenv('PLAYLIST_CACHE_MAX_ENTRIES', '1024'))
+PLAYLIST_CACHE_MAX_BYTES = int(os.getenv('PLAYLIST_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Presigned URL Cache Configuration (FolderStorageHandler.generate_presigned_url and /sign)
+PRESIGN_BUCKET_SECONDS = int(os.getenv('PRESIGN_BUCKET_SECONDS', '60'))  # requested expirations are rounded up to this
+PRESIGN_REUSE_FRACTION = float(os.getenv('PRESIGN_REUSE_FRACTION', '0.25'))  # extra lifetime a signature is reused for
+PRESIGN_CACHE_MAX_ENTRIES = int(os.getenv('PRESIGN_CACHE_MAX_ENTRIES', '10000'))
+PRESIGN_DEFAULT_EXPIRATION = int(os.getenv('PRESIGN_DEFAULT_EXPIRATION', '3600'))
+
+# Catalog Configuration (index page)
+CATALOG_REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_INTERVAL', '60'))  # seconds between background listings
+CATALOG_LIST_SHARDS = int(os.getenv('CATALOG_LIST_SHARDS', '1'))  # parallel listers splitting the video name space
+CATALOG_DB_PATH = Path(os.getenv('CATALOG_DB_PATH', str(BASE_DIR / 'catalog.db')))  # SQLite index written by ingest
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '50'))
+CATALOG_MAX_PAGE_SIZE = int(os.getenv('CATALOG_MAX_PAGE_SIZE', '200'))
+
+# Rewrite Cache Configuration (rewritten m3u8 playlists in app-orig.py)
+REWRITE_CACHE_MAX_ENTRIES = int(os.getenv('REWRITE_CACHE_MAX_ENTRIES', '1024'))
+REWRITE_CACHE_MAX_BYTES = int(os.getenv('REWRITE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Logging Configuration (queue-based, drained to stdout by a background thread)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' (structured) or 'text'
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '/proxy/=0.01')  # path prefix=rate pairs for INFO/DEBUG records
+LOG_SAMPLE_DEFAULT = float(os.getenv('LOG_SAMPLE_DEFAULT', '1'))  # rate for request paths matching no prefix
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))  # records beyond this are dropped, never waited on
+LOG_BODY_DUMP = os.getenv('LOG_BODY_DUMP', 'false').lower() in ('1', 'true', 'yes')  # log playlist bodies and headers
+
+# Server-Timing Configuration (every response carries its phase breakdown)
+SERVER_TIMING_LOG_SAMPLE_RATE = float(os.getenv('SERVER_TIMING_LOG_SAMPLE_RATE', '0'))  # fraction of requests logged in full
+
+# Metrics Configuration (/metrics)
+INGEST_METRICS_PATH = Path(os.getenv('INGEST_METRICS_PATH', str(BASE_DIR / 'ingest_metrics.prom')))  # ingest writes, web serves
+
+# Cache invalidation (ingest -> proxy nodes)
+CACHE_INVALIDATE_TOKEN = os.getenv('CACHE_INVALIDATE_TOKEN')  # shared secret; unset disables the check
+PROXY_INVALIDATE_URLS = [url.strip() for url in os.getenv('PROXY_INVALIDATE_URLS', '').split(',') if url.strip()]
+
+# Segment Cache Configuration (on-disk byte-range cache for .ts files)
+SEGMENT_CACHE_DIR = Path(os.getenv('SEGMENT_CACHE_DIR', str(BASE_DIR / 'segment_cache')))
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv('SEGMENT_CACHE_MAX_BYTES', str(10 * 1024 ** 3)))
+SEGMENT_CACHE_POLICY = os.getenv('SEGMENT_CACHE_POLICY', 'lru')  # 'lru' or 'lfu'
+SEGMENT_CACHE_MAX_FILL_BYTES = int(os.getenv('SEGMENT_CACHE_MAX_FILL_BYTES', str(32 * 1024 * 1024)))  # larger ranges bypass the cache
+SEGMENT_CACHE_MAX_AGE = float(os.getenv('SEGMENT_CACHE_MAX_AGE', '3600'))  # seconds before a cached object is revalidated, 0 = never
+
+# Key Store Configuration (proxy_key)
+KEY_STORE_TTL = float(os.getenv('KEY_STORE_TTL', '3600'))
+KEY_STORE_NEGATIVE_TTL = float(os.getenv('KEY_STORE_NEGATIVE_TTL', '30'))  # how long unknown key names are remembered
+KEY_STORE_MAX_ENTRIES = int(os.getenv('KEY_STORE_MAX_ENTRIES', '10000'))
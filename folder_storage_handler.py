@@ -1,8 +1,123 @@
 import boto3
 from botocore.client import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
+import hashlib
+import json
+import logging
 import os
+import random
 import re
+import string
+import threading
+import time
+
+from config import POSTER_CACHE_CONTROL, PRESIGN_BUCKET_SECONDS, PRESIGN_REUSE_FRACTION, PRESIGN_CACHE_MAX_ENTRIES
+from config import PIPELINED_UPLOAD_PART_SIZE, PIPELINED_UPLOAD_POLL_INTERVAL
+from config import (TRANSFER_MAX_CONCURRENCY, TRANSFER_MIN_PART_SIZE, TRANSFER_MAX_PART_SIZE,
+                    TRANSFER_TARGET_PART_SECONDS, TRANSFER_MAX_BANDWIDTH, STORAGE_UPLOAD_WORKERS)
+from transfer_engine import BandwidthLimiter, MIN_PART_SIZE, TransferEngine
+from presigned_url_cache import PresignedUrlCache
+from metrics import instrument_boto3_client
+
+logger = logging.getLogger(__name__)
+
+# Object settings of uploaded TS files (no CDN compression, CORS for the players)
+TS_EXTRA_ARGS = {
+    'ContentType': 'video/mp2t',
+    'ContentEncoding': 'identity',
+    # Add CORS headers
+    'ACL': 'public-read',
+    'Metadata': {
+        'access-control-allow-origin': '*',
+        'access-control-allow-methods': 'GET, HEAD',
+        'access-control-max-age': '3000'
+    }
+}
+
+class GrowingFileUpload:
+    """Multipart upload of a file that is still being written (ffmpeg's TS output).
+
+    A background thread waits for ``find_file`` to return the file, then uploads every
+    complete ``part_size`` chunk as it lands on disk. ``finish()`` is called once the
+    writer has exited: it sends the remaining bytes as the last part and completes the
+    upload. Only appending writers are supported; bytes already sent are never re-read.
+    """
+
+    def __init__(self, session, bucket: str, key: str, find_file, part_size: int = PIPELINED_UPLOAD_PART_SIZE,
+                 poll_interval: float = PIPELINED_UPLOAD_POLL_INTERVAL, limiter: BandwidthLimiter = None):
+        self.session = session
+        self.bucket = bucket
+        self.key = key
+        self.find_file = find_file  # returns the Path being written, or None until it exists
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.poll_interval = poll_interval
+        self.limiter = limiter or BandwidthLimiter()
+
+        self.path = None
+        self.sent_bytes = 0
+        self.parts = []
+        self.error = None
+        self._stop = threading.Event()
+        self.upload_id = self.session.create_multipart_upload(Bucket=bucket, Key=key, **TS_EXTRA_ARGS)['UploadId']
+        self._thread = threading.Thread(target=self._tail, name=f"upload-{key}", daemon=True)
+        self._thread.start()
+
+    def _send_parts(self, final: bool = False):
+        if self.path is None:
+            self.path = self.find_file()
+            if self.path is None:
+                return
+        size = self.path.stat().st_size
+        with open(self.path, 'rb') as f:
+            while size - self.sent_bytes >= self.part_size or (final and size > self.sent_bytes):
+                f.seek(self.sent_bytes)
+                body = f.read(self.part_size)
+                self.limiter.consume(len(body))
+                number = len(self.parts) + 1
+                response = self.session.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                    PartNumber=number, Body=body)
+                self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+                self.sent_bytes += len(body)
+
+    def _tail(self):
+        try:
+            while not self._stop.wait(self.poll_interval):
+                self._send_parts()
+        except Exception as e:
+            self.error = e
+
+    def _stop_tailing(self):
+        self._stop.set()
+        self._thread.join()
+
+    def finish(self) -> bool:
+        """Upload what is left of the (now complete) file and complete the upload"""
+        self._stop_tailing()
+        try:
+            if self.error is not None:
+                raise self.error
+            self._send_parts(final=True)
+            if not self.parts:
+                raise ValueError(f"{self.key}: nothing was written")
+            self.session.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                   MultipartUpload={'Parts': self.parts})
+        except Exception as e:
+            logger.error(f"Failed to upload TS file {self.key} while it was written: {str(e)}")
+            self.abort()
+            return False
+        logger.info(f"Successfully uploaded TS file {self.key} ({len(self.parts)} parts sent while encoding)")
+        return True
+
+    def abort(self):
+        """Stop tailing and drop the parts uploaded so far"""
+        self._stop_tailing()
+        try:
+            self.session.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.warning(f"Warning: could not abort multipart upload of {self.key}: {str(e)}")
 
 class FolderStorageHandler:
     def __init__(self, config):
@@ -13,7 +128,20 @@ class FolderStorageHandler:
             aws_access_key_id=config['access_key'],
             aws_secret_access_key=config['secret_key'],
             region_name=config['region'],
-            config=Config(signature_version='s3v4')
+            # One connection per transfer part thread plus one per upload worker (small PUTs, manifests)
+            config=Config(signature_version='s3v4',
+                          max_pool_connections=TRANSFER_MAX_CONCURRENCY + STORAGE_UPLOAD_WORKERS)
+        )
+        instrument_boto3_client(self.session)
+
+        # Every TS upload goes through one engine: shared connection pool, part threads and bandwidth cap
+        self.transfers = TransferEngine(
+            self.session,
+            max_concurrency=TRANSFER_MAX_CONCURRENCY,
+            min_part_size=TRANSFER_MIN_PART_SIZE,
+            max_part_size=TRANSFER_MAX_PART_SIZE,
+            target_part_seconds=TRANSFER_TARGET_PART_SECONDS,
+            max_bandwidth=TRANSFER_MAX_BANDWIDTH
         )
         self.bucket = config['bucket_name']
         self.endpoint_url = config['endpoint_url']
@@ -23,23 +151,39 @@ class FolderStorageHandler:
         self.m3u8_folder = "Example_folder_for_m3u8"
         self.ts_folder = "Example_folder_for_TS"
 
+        # Catalog manifest maintained by ingest so web nodes can skip listing the bucket.
+        # With manifest_shards > 1 the root object only records the shard count and the
+        # videos are spread over _catalog.<n>.json by a hash of their name.
+        self.manifest_key = f"{self.m3u8_folder}/_catalog.json"
+        self.manifest_shards = int(config.get('manifest_shards', 1))
+
+        # Presigned URLs are reused until close to expiry instead of re-signed on every call
+        self.presigned_urls = PresignedUrlCache(
+            bucket_seconds=PRESIGN_BUCKET_SECONDS,
+            reuse_fraction=PRESIGN_REUSE_FRACTION,
+            max_entries=PRESIGN_CACHE_MAX_ENTRIES
+        )
+
+        # Files of the videos being uploaded (key, playlists, TS, assets) go up side by side on this pool
+        self.upload_executor = ThreadPoolExecutor(max_workers=STORAGE_UPLOAD_WORKERS, thread_name_prefix='upload')
+
     def check_connection(self):
         """Check if we can connect to the storage bucket"""
         try:
             # Check bucket
             self.session.head_bucket(Bucket=self.bucket)
-            print(f"Successfully connected to bucket: {self.bucket}!")
+            logger.info(f"Successfully connected to bucket: {self.bucket}!")
             
             return True
         except Exception as e:
-            print(f"Failed to connect to storage: {str(e)}")
+            logger.error(f"Failed to connect to storage: {str(e)}")
             return False
 
     def upload_key_file(self, local_path: str, object_key: str) -> bool:
         """Upload key file to the key folder"""
         try:
             full_key = f"{self.key_folder}/{object_key}"
-            print(f"Uploading key file {local_path} to {full_key}...")
+            logger.info(f"Uploading key file {local_path} to {full_key}...")
             
             # Add specific content headers to prevent CDN issues
             self.session.upload_file(
@@ -60,12 +204,26 @@ class FolderStorageHandler:
                 }
             )
             
-            print(f"Successfully uploaded key file {full_key}")
+            logger.info(f"Successfully uploaded key file {full_key}")
             return True
         except Exception as e:
-            print(f"Failed to upload key file {object_key}: {str(e)}")
+            logger.error(f"Failed to upload key file {object_key}: {str(e)}")
             return False
 
+    def get_key_file(self, object_key: str):
+        """Fetch a key file from the key folder, returning None if it does not exist.
+
+        Other storage errors are raised so callers can tell them apart from a missing key.
+        """
+        full_key = f"{self.key_folder}/{object_key}"
+        try:
+            response = self.session.get_object(Bucket=self.bucket, Key=full_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return response['Body'].read()
+
     def upload_m3u8_file(self, local_path: str, object_key: str, video_name: str, key_filename: str) -> bool:
         """Upload m3u8 file to the m3u8 folder with updated URLs"""
         try:
@@ -73,7 +231,7 @@ class FolderStorageHandler:
             self._update_m3u8_file(local_path, video_name, key_filename)
             
             full_key = f"{self.m3u8_folder}/{object_key}"
-            print(f"Uploading m3u8 file {local_path} to {full_key}...")
+            logger.info(f"Uploading m3u8 file {local_path} to {full_key}...")
             
             # Add proper content type and cache control headers
             self.session.upload_file(
@@ -94,10 +252,37 @@ class FolderStorageHandler:
                 }
             )
             
-            print(f"Successfully uploaded m3u8 file {full_key}")
+            logger.info(f"Successfully uploaded m3u8 file {full_key}")
             return True
         except Exception as e:
-            print(f"Failed to upload m3u8 file {object_key}: {str(e)}")
+            logger.error(f"Failed to upload m3u8 file {object_key}: {str(e)}")
+            return False
+
+    def upload_asset_file(self, local_path: str, object_key: str, content_type: str) -> bool:
+        """Upload a poster, preview or trickplay file next to the video's playlists"""
+        try:
+            full_key = f"{self.m3u8_folder}/{object_key}"
+            logger.info(f"Uploading asset {local_path} to {full_key}...")
+            self.session.upload_file(
+                local_path,
+                self.bucket,
+                full_key,
+                ExtraArgs={
+                    'ContentType': content_type,
+                    'CacheControl': POSTER_CACHE_CONTROL,
+                    # Add CORS headers (the player fetches the thumbnails track with XHR)
+                    'ACL': 'public-read',
+                    'Metadata': {
+                        'access-control-allow-origin': '*',
+                        'access-control-allow-methods': 'GET, HEAD',
+                        'access-control-max-age': '3000'
+                    }
+                }
+            )
+            logger.info(f"Successfully uploaded asset {full_key}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to upload asset {object_key}: {str(e)}")
             return False
 
     def _update_m3u8_file(self, local_path: str, video_name: str, key_filename: str):
@@ -126,68 +311,64 @@ class FolderStorageHandler:
             with open(local_path, 'w') as f:
                 f.writelines(modified_lines)
                 
-            print(f"Updated URLs in {local_path}")
+            logger.info(f"Updated URLs in {local_path}")
             return True
         except Exception as e:
-            print(f"Error updating m3u8 file {local_path}: {str(e)}")
+            logger.error(f"Error updating m3u8 file {local_path}: {str(e)}")
             return False
 
-    def upload_ts_file(self, local_path: str, object_key: str) -> bool:
-        """Upload TS file to the TS folder"""
+    def upload_ts_file(self, local_path: str, object_key: str, progress=None) -> bool:
+        """Upload TS file to the TS folder.
+
+        ``progress(bytes_sent, total_bytes)`` is called as parts complete; by default
+        progress is logged every 25%.
+        """
         try:
             full_key = f"{self.ts_folder}/{object_key}"
-            print(f"Uploading TS file {local_path} to {full_key}...")
+            logger.info(f"Uploading TS file {local_path} to {full_key}...")
             
             # Add specific content headers to prevent CDN compression
-            self.session.upload_file(
-                local_path, 
-                self.bucket, 
-                full_key,
-                ExtraArgs={
-                    'ContentType': 'video/mp2t',
-                    'ContentEncoding': 'identity',
-                    # Add CORS headers
-                    'ACL': 'public-read',
-                    'Metadata': {
-                        'access-control-allow-origin': '*',
-                        'access-control-allow-methods': 'GET, HEAD',
-                        'access-control-max-age': '3000'
-                    }
-                }
-            )
+            self.transfers.upload_file(local_path, self.bucket, full_key, TS_EXTRA_ARGS,
+                                       progress or self._progress_logger(full_key))
             
-            print(f"Successfully uploaded TS file {full_key}")
+            logger.info(f"Successfully uploaded TS file {full_key}")
             return True
         except Exception as e:
-            print(f"Failed to upload TS file {object_key}: {str(e)}")
+            logger.error(f"Failed to upload TS file {object_key}: {str(e)}")
             return False
 
-    def upload_video_files(self, video_dir: Path, video_name: str, key_filename: str) -> bool:
-        """Upload all files related to a video to their respective folders"""
+    def _progress_logger(self, full_key: str):
+        logged = [0]
+
+        def log_progress(sent: int, total: int):
+            quarter = sent * 4 // total if total else 4
+            if quarter > logged[0]:
+                logged[0] = quarter
+                logger.info(f"Uploading {full_key}: {sent * 100 // total if total else 100}% "
+                            f"({sent}/{total} bytes)")
+        return log_progress
+
+    def start_growing_ts_upload(self, object_key: str, find_file) -> GrowingFileUpload:
+        """Start uploading a TS file to the TS folder while it is still being written"""
+        full_key = f"{self.ts_folder}/{object_key}"
+        logger.info(f"Uploading TS file to {full_key} while it is written...")
+        return GrowingFileUpload(self.session, self.bucket, full_key, find_file, limiter=self.transfers.limiter)
+
+    def upload_video_files(self, video_dir: Path, video_name: str, key_filename: str,
+                           ts_uploaded: bool = False) -> bool:
+        """Upload all files related to a video to their respective folders.
+
+        The key, TS and asset files go up concurrently on the shared upload pool. The
+        playlists follow only once the key and TS are in place, so a viewer never gets
+        a playlist pointing at missing objects. ``ts_uploaded`` skips the TS file,
+        already sent by a ``GrowingFileUpload``.
+        """
         try:
-            # 1. Upload key file to key folder
             key_file = video_dir / key_filename
-            if key_file.exists():
-                if not self.upload_key_file(str(key_file), key_filename):
-                    return False
-            else:
-                print(f"Warning: Key file {key_file} does not exist, skipping upload")
+            if not key_file.exists():
+                logger.warning(f"Warning: Key file {key_file} does not exist, skipping upload")
                 return False
 
-            # 2. Upload m3u8 files to m3u8 folder
-            m3u8_files = [
-                (video_dir / "stream.m3u8", f"{video_name}/stream.m3u8"),
-                (video_dir / "iframe.m3u8", f"{video_name}/iframe.m3u8")
-            ]
-
-            for local_file, object_key in m3u8_files:
-                if local_file.exists():
-                    if not self.upload_m3u8_file(str(local_file), object_key, video_name, key_filename):
-                        return False
-                else:
-                    print(f"Warning: M3U8 file {local_file} does not exist, skipping upload")
-
-            # 3. Upload TS file to TS folder
             # First check for the video_name.ts file
             ts_file = video_dir / f"{video_name}.ts"
             
@@ -200,23 +381,71 @@ class FolderStorageHandler:
                     if ts_files:
                         ts_file = ts_files[0]
                     else:
-                        print(f"Error: No .ts files found for {video_name}")
+                        logger.error(f"Error: No .ts files found for {video_name}")
                         return False
-            
-            # Upload the TS file
-            object_key = f"{video_name}/{video_name}.ts"
-            if not self.upload_ts_file(str(ts_file), object_key):
+
+            # 1. Key file, TS file and assets, side by side
+            submit = self.upload_executor.submit
+            required = [submit(self.upload_key_file, str(key_file), key_filename)]
+            if not ts_uploaded:
+                required.append(submit(self.upload_ts_file, str(ts_file), f"{video_name}/{video_name}.ts"))
+
+            # Poster, preview and trickplay files are optional: the grid falls back to a placeholder
+            # and the player to a plain scrubber
+            assets = [(video_dir / "poster.jpg", "image/jpeg"), (video_dir / "preview.webp", "image/webp")]
+            assets += [(sprite, "image/jpeg") for sprite in sorted(video_dir.glob("trickplay/sprite_*.jpg"))]
+            optional = [submit(self.upload_asset_file, str(local_file),
+                               f"{video_name}/{local_file.relative_to(video_dir).as_posix()}", content_type)
+                        for local_file, content_type in assets if local_file.exists()]
+
+            # Wait for everything before deciding, so no upload of this video is still running afterwards
+            required_ok = all([future.result() for future in required])
+            for future in optional:
+                future.result()
+            if not required_ok:
+                return False
+
+            # 2. Playlists, now that the key and TS they point at exist (and the thumbnails track,
+            # now that its sprites do)
+            thumbnails = video_dir / "trickplay" / "thumbnails.vtt"
+            track = None
+            if thumbnails.exists():
+                track = submit(self.upload_asset_file, str(thumbnails), f"{video_name}/trickplay/thumbnails.vtt",
+                               "text/vtt")
+            m3u8_files = [
+                (video_dir / "stream.m3u8", f"{video_name}/stream.m3u8"),
+                (video_dir / "iframe.m3u8", f"{video_name}/iframe.m3u8")
+            ]
+            playlists = []
+            for local_file, object_key in m3u8_files:
+                if local_file.exists():
+                    playlists.append(submit(self.upload_m3u8_file, str(local_file), object_key, video_name,
+                                            key_filename))
+                else:
+                    logger.warning(f"Warning: M3U8 file {local_file} does not exist, skipping upload")
+            playlists_ok = all([future.result() for future in playlists])
+            if track is not None:
+                track.result()
+            if not playlists_ok:
                 return False
 
-            print(f"Successfully uploaded all files for {video_name}")
+            # 3. Record the video in the bucket's catalog manifest
+            if not self.update_manifest(video_name, {
+                'key_filename': key_filename,
+                'size_bytes': ts_file.stat().st_size,
+                'uploaded_at': datetime.now(timezone.utc).isoformat(timespec='seconds')
+            }):
+                logger.warning(f"Warning: catalog manifest was not updated for {video_name}")
+
+            logger.info(f"Successfully uploaded all files for {video_name}")
             return True
 
         except Exception as e:
-            print(f"Error uploading video files for {video_name}: {str(e)}")
+            logger.error(f"Error uploading video files for {video_name}: {str(e)}")
             return False
 
-    def generate_presigned_url(self, object_key: str, folder: str = None, expiration: int = 3600) -> str:
-        """Generate a presigned URL for an object from the specified folder"""
+    def _sign_url(self, folder: str, object_key: str, expiration: int) -> str:
+        """Run SigV4 signing for one object, returning None on failure"""
         try:
             # If folder is specified, prepend it to the object key
             full_key = object_key
@@ -233,17 +462,207 @@ class FolderStorageHandler:
             )
             return url
         except Exception as e:
-            print(f"Error generating presigned URL: {str(e)}")
+            logger.error(f"Error generating presigned URL: {str(e)}")
             return None
 
-    def list_videos(self):
-        """List all .m3u8 video files in the Example_folder_for_m3u8 folder."""
-        video_ids = []
-        response = self.session.list_objects_v2(Bucket=self.bucket, Prefix='Example_folder_for_m3u8/')
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                if obj['Key'].endswith('.m3u8'):
-                    # Extract folder name from the object key
-                    folder_name = obj['Key'].split('/')[-2]  # Get the folder name
-                    video_ids.append(folder_name)  # Use folder name as video ID
-        return list(set(video_ids))  # Return unique folder names 
\ No newline at end of file
+    def generate_presigned_url(self, object_key: str, folder: str = None, expiration: int = 3600) -> str:
+        """Generate a presigned URL for an object from the specified folder.
+
+        The URL is valid for at least ``expiration`` seconds and may come from the presigned URL cache.
+        """
+        return self.presigned_urls.get(folder, object_key, expiration, self._sign_url)
+
+    def generate_presigned_urls(self, objects, expiration: int = 3600) -> list:
+        """Presign many ``(folder, object_key)`` pairs at once; failed entries are None"""
+        return self.presigned_urls.get_many(list(objects), expiration, self._sign_url)
+
+    def video_objects(self, video_name: str, key_filename: str = None) -> dict:
+        """The objects a player needs for one video, as name -> (folder, object_key)"""
+        objects = {
+            'stream.m3u8': (self.m3u8_folder, f"{video_name}/stream.m3u8"),
+            'iframe.m3u8': (self.m3u8_folder, f"{video_name}/iframe.m3u8"),
+            'ts': (self.ts_folder, f"{video_name}/{video_name}.ts")
+        }
+        if key_filename:
+            objects['key'] = (self.key_folder, key_filename)
+        return objects
+
+    def iter_videos(self, start_after: str = None, stop_before: str = None, page_size: int = 1000):
+        """Lazily yield video folder names in the m3u8 folder, one listing page at a time.
+
+        ``Delimiter='/'`` makes S3 return one CommonPrefixes entry per video folder
+        instead of every object inside it. ``start_after``/``stop_before`` restrict the
+        listing to a slice of folder names so several listers can split the work.
+        """
+        prefix = f"{self.m3u8_folder}/"
+        params = {
+            'Bucket': self.bucket,
+            'Prefix': prefix,
+            'Delimiter': '/',
+            'PaginationConfig': {'PageSize': page_size}
+        }
+        if start_after:
+            params['StartAfter'] = prefix + start_after
+        for page in self.session.get_paginator('list_objects_v2').paginate(**params):
+            for common_prefix in page.get('CommonPrefixes', []):
+                folder_name = common_prefix['Prefix'][len(prefix):].rstrip('/')
+                if stop_before is not None and folder_name >= stop_before:
+                    return
+                yield folder_name
+
+    def list_videos(self, shards: int = 1):
+        """List all video folder names in the Example_folder_for_m3u8 folder.
+
+        With ``shards`` > 1 the name space is split on leading characters and the
+        slices are listed in parallel, which keeps large catalogs quick to refresh.
+        """
+        if shards <= 1:
+            return list(self.iter_videos())
+        alphabet = string.digits + string.ascii_uppercase + string.ascii_lowercase
+        shards = min(shards, len(alphabet))
+        boundaries = [alphabet[len(alphabet) * i // shards] for i in range(1, shards)]
+        slices = list(zip([None] + boundaries, boundaries + [None]))
+        with ThreadPoolExecutor(max_workers=shards) as pool:
+            results = pool.map(lambda bounds: list(self.iter_videos(*bounds)), slices)
+        return [folder_name for folder_names in results for folder_name in folder_names]
+
+    def _manifest_shard_key(self, video_name: str) -> str:
+        if self.manifest_shards <= 1:
+            return self.manifest_key
+        shard = int(hashlib.sha1(video_name.encode('utf-8')).hexdigest(), 16) % self.manifest_shards
+        return f"{self.m3u8_folder}/_catalog.{shard}.json"
+
+    def _get_json(self, object_key: str, etag: str = None):
+        """GET a JSON object, conditionally on ``etag``.
+
+        Returns ``(document, etag)``; ``document`` is None when the object is unchanged.
+        Returns None if the object does not exist.
+        """
+        params = {'Bucket': self.bucket, 'Key': object_key}
+        if etag:
+            params['IfNoneMatch'] = etag
+        try:
+            response = self.session.get_object(**params)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code in ('304', 'NotModified'):
+                return None, etag
+            if code in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read()), response['ETag']
+
+    def _update_json(self, object_key: str, mutate, attempts: int = 8) -> bool:
+        """Read-modify-write a JSON object, retrying if another writer got in between.
+
+        ``mutate`` returns the new document, or None to leave the object as it is.
+        """
+        for attempt in range(attempts):
+            current = self._get_json(object_key)
+            document, etag = current if current is not None else ({}, None)
+            document = mutate(document)
+            if document is None:
+                return True
+            params = {
+                'Bucket': self.bucket,
+                'Key': object_key,
+                'Body': json.dumps(document, separators=(',', ':')).encode('utf-8'),
+                'ContentType': 'application/json'
+            }
+            # Only succeed if the object is still the version we read (or still absent)
+            if etag:
+                params['IfMatch'] = etag
+            else:
+                params['IfNoneMatch'] = '*'
+            try:
+                self.session.put_object(**params)
+                return True
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                    raise
+                time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+        logger.error(f"Gave up updating {object_key} after {attempts} conflicting writes")
+        return False
+
+    def update_manifest(self, video_name: str, entry: dict) -> bool:
+        """Add or replace a video in the catalog manifest with a conditional read-modify-write.
+
+        A manifest object created here is seeded from a full bucket listing, so videos
+        uploaded before the manifest existed stay in the catalog.
+        """
+        listing = []
+
+        def seed(object_key: str) -> dict:
+            if not listing:
+                listing.append(self.list_videos())
+            return {name: {} for name in listing[0] if self._manifest_shard_key(name) == object_key}
+
+        def seed_missing(document, object_key):
+            if 'videos' in document:
+                return None
+            document['videos'] = seed(object_key)
+            return document
+
+        try:
+            if self.manifest_shards > 1:
+                root = self._get_json(self.manifest_key)
+                if root is None or root[0].get('shards') != self.manifest_shards:
+                    # New layout: write every shard before readers are pointed at them
+                    for shard in range(self.manifest_shards):
+                        object_key = f"{self.m3u8_folder}/_catalog.{shard}.json"
+                        if not self._update_json(object_key, lambda document: seed_missing(document, object_key)):
+                            return False
+
+                def set_layout(document):
+                    if document.get('shards') == self.manifest_shards:
+                        return None
+                    document['shards'] = self.manifest_shards
+                    return document
+                if not self._update_json(self.manifest_key, set_layout):
+                    return False
+
+            shard_key = self._manifest_shard_key(video_name)
+
+            def add_video(document):
+                document = seed_missing(document, shard_key) or document
+                document['videos'][video_name] = entry
+                document['updated_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+                return document
+            if not self._update_json(shard_key, add_video):
+                return False
+            logger.info(f"Recorded {video_name} in the catalog manifest")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to update catalog manifest for {video_name}: {str(e)}")
+            return False
+
+    def load_manifest(self, previous: dict = None):
+        """Load the catalog manifest, re-downloading only the objects whose ETag changed.
+
+        ``previous`` is the state returned by the last call. Returns the new state, whose
+        ``videos`` maps video names to their manifest entries, or None if the bucket has
+        no manifest.
+        """
+        previous = previous or {'etags': {}, 'documents': {}}
+        state = {'etags': {}, 'documents': {}}
+
+        def load(object_key):
+            result = self._get_json(object_key, previous['etags'].get(object_key))
+            if result is None:
+                return None
+            document, etag = result
+            state['etags'][object_key] = etag
+            state['documents'][object_key] = document if document is not None else previous['documents'][object_key]
+            return state['documents'][object_key]
+
+        root = load(self.manifest_key)
+        if root is None:
+            return None
+        documents = [root]
+        for shard in range(int(root.get('shards', 0))):
+            document = load(f"{self.m3u8_folder}/_catalog.{shard}.json")
+            if document is not None:
+                documents.append(document)
+        state['videos'] = {name: entry for document in documents for name, entry in document.get('videos', {}).items()}
+        return state
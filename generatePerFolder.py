@@ -1,66 +1,128 @@
+import logging
+import math
 import os
+import re
 import sys
+import time
 import secrets
 import subprocess
 import shutil
 import uuid
+import requests
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Optional
 from config import INPUT_DIR, OUTPUT_DIR, FFMPEG_PATH, SEGMENT_DURATION, KEY_LENGTH, LEASEWEB_PRIVATE_CONFIG
+from config import PROXY_INVALIDATE_URLS, CACHE_INVALIDATE_TOKEN, CATALOG_DB_PATH, INGEST_METRICS_PATH
+from config import LOG_LEVEL, LOG_FORMAT, LOG_BODY_DUMP, INGEST_WORKERS, INGEST_UPLOAD_WORKERS, INGEST_PIPELINED_UPLOAD
+from config import POSTER_WIDTH, POSTER_OFFSET, PREVIEW_ENABLED, PREVIEW_DURATION
+from config import (TRICKPLAY_ENABLED, TRICKPLAY_INTERVAL, TRICKPLAY_WIDTH, TRICKPLAY_HEIGHT, TRICKPLAY_COLUMNS,
+                    TRICKPLAY_ROWS)
 from folder_storage_handler import FolderStorageHandler
+from catalog_index import CatalogIndex
+from metrics import REGISTRY, INGEST_NAMESPACE, INGEST_STAGE_SECONDS, INGEST_VIDEOS
+from app_logging import configure_logging
+from ts_scanner import (AES_BLOCK_SIZE, PACKET_BLOCK_ALIGNMENT, can_decrypt, decrypt_segment, open_ts,
+                        scan_keyframes)
+
+logger = logging.getLogger(__name__)
 
 # Add CDN configuration
 CDN_BASE_URL = 'https://di-yusrkfqf.leasewebultracdn.com'
 
+def _vtt_timestamp(seconds: float) -> str:
+    """Format seconds as a WebVTT cue timestamp (HH:MM:SS.mmm)."""
+    millis = int(round(seconds * 1000))
+    return f"{millis // 3600000:02d}:{millis // 60000 % 60:02d}:{millis // 1000 % 60:02d}.{millis % 1000:03d}"
+
+def _key_iv(key_line: str, sequence: int) -> bytes:
+    """IV of an AES-128 segment: the tag's IV attribute, else its media sequence number"""
+    match = re.search(r'IV=0[xX]([0-9a-fA-F]+)', key_line)
+    if match:
+        return bytes.fromhex(match.group(1).rjust(32, '0'))
+    return sequence.to_bytes(AES_BLOCK_SIZE, 'big')
+
+def _with_iv(key_line: str, iv: bytes) -> str:
+    """The EXT-X-KEY line with an explicit IV attribute"""
+    key_line = re.sub(r',IV=0[xX][0-9a-fA-F]+', '', key_line)
+    return f"{key_line},IV=0x{iv.hex()}"
+
+@contextmanager
+def _timed(stage_seconds: dict, stage: str):
+    """Record how long a ``with`` block took under ``stage`` (encode runs in worker processes,
+    so its timings travel back with the result instead of going straight to the registry)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds[stage] = time.perf_counter() - started
+
+# Storage client of an encode worker process, only needed to upload TS files while they are written
+_worker_storage = None
+
+def _init_encode_worker():
+    """Give each encode worker process its own log listener (and storage client for pipelined uploads)."""
+    global _worker_storage
+    configure_logging(LOG_LEVEL, LOG_FORMAT)
+    if INGEST_PIPELINED_UPLOAD:
+        _worker_storage = FolderStorageHandler(LEASEWEB_PRIVATE_CONFIG)
+
+def _encode_in_worker(input_dir: Path, output_dir: Path, input_file: Path) -> dict:
+    """Run the ffmpeg stages of one video in an encode worker process."""
+    return VideoProcessor(input_dir, output_dir, storage_handler=_worker_storage)._encode_video(input_file)
+
 class VideoProcessor:
-    def __init__(self, input_dir: str, output_dir: str, storage_handler: FolderStorageHandler):
+    def __init__(self, input_dir: str, output_dir: str, storage_handler: Optional[FolderStorageHandler],
+                 catalog_index: Optional[CatalogIndex] = None):
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.storage = storage_handler
+        self.catalog_index = catalog_index
 
     def test_storage_connection(self) -> bool:
         """Test connection to storage and basic operations"""
-        print("\n=== Testing Storage Connection ===")
+        logger.info("=== Testing Storage Connection ===")
         
         # 1. Test basic connection
         if not self.storage.check_connection():
-            print("❌ Basic connection test failed!")
+            logger.error("❌ Basic connection test failed!")
             return False
-        print("✓ Basic connection test passed!")
+        logger.info("✓ Basic connection test passed!")
 
         # 2. Test presigned URL generation
-        print("\nTesting presigned URL generation...")
+        logger.info("Testing presigned URL generation...")
         test_url = self.storage.generate_presigned_url("test.txt", folder=self.storage.key_folder)
         if not test_url:
-            print("❌ Presigned URL generation test failed!")
+            logger.error("❌ Presigned URL generation test failed!")
             return False
-        print("✓ Presigned URL generation test passed!")
-        print(f"Sample presigned URL: {test_url}")
+        logger.info("✓ Presigned URL generation test passed!")
+        logger.info(f"Sample presigned URL: {test_url}")
 
-        print("\n✓ All storage tests passed successfully!")
+        logger.info("✓ All storage tests passed successfully!")
         return True
 
     def validate_environment(self) -> bool:
         """Validate all required components"""
-        print("\n=== Validating Environment ===")
+        logger.info("=== Validating Environment ===")
         
         # 1. Check FFmpeg
         if not os.path.exists(FFMPEG_PATH):
-            print("❌ FFmpeg not found at:", FFMPEG_PATH)
+            logger.error(f"❌ FFmpeg not found at: {FFMPEG_PATH}")
             return False
-        print("✓ FFmpeg found!")
+        logger.info("✓ FFmpeg found!")
 
         # 2. Check input directory
         if not self.input_dir.exists():
-            print(f"Creating input directory at {self.input_dir}")
+            logger.info(f"Creating input directory at {self.input_dir}")
             self.input_dir.mkdir(parents=True, exist_ok=True)
-        print("✓ Input directory ready!")
+        logger.info("✓ Input directory ready!")
 
         # 3. Check output directory
         if not self.output_dir.exists():
-            print(f"Creating output directory at {self.output_dir}")
+            logger.info(f"Creating output directory at {self.output_dir}")
             self.output_dir.mkdir(parents=True, exist_ok=True)
-        print("✓ Output directory ready!")
+        logger.info("✓ Output directory ready!")
 
         return True
 
@@ -103,79 +165,100 @@ class VideoProcessor:
             
         return key_info_path
 
-    def _create_iframe_playlist(self, input_file, video_dir, key_info_path, video_name):
-        """Create an iframe playlist for the video."""
-        print("2. Generating iframe playlist...")
-        output_ts = video_dir / f"{video_name}.ts"
-        
-        # Create a temporary playlist file
-        temp_playlist = video_dir / "iframe_temp.m3u8"
-        
-        # Generate a basic HLS playlist with single file
-        iframe_cmd = [
-            FFMPEG_PATH,
-            "-i", str(input_file),
-            "-c:v", "copy",
-            "-c:a", "copy",
-            "-force_key_frames", "expr:gte(t,n_forced*1)",
-            "-f", "hls",
-            "-hls_time", str(SEGMENT_DURATION),
-            "-movflags", "+faststart",
-            "-hls_segment_type", "mpegts",
-            "-hls_list_size", "0",
-            "-hls_flags", "single_file",
-            "-hls_key_info_file", str(key_info_path),
-            "-hls_playlist_type", "vod",
-            str(temp_playlist)
-        ]
-        
-        print(f"Running iframe FFmpeg command: {' '.join(iframe_cmd)}")
-        result = subprocess.run(iframe_cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            print(f"FFmpeg iframe error: {result.stderr}")
-            raise Exception(f"FFmpeg iframe command failed: {result.stderr}")
-        
-        print(f"FFmpeg iframe output: {result.stdout[:200]}...")  # Show first 200 chars of output
-        
-        # Check if temp playlist was created
-        if not temp_playlist.exists():
-            print(f"Warning: {temp_playlist} was not created!")
-            raise Exception(f"Temporary iframe playlist was not created")
-        
-        # Now modify the playlist to make it an iframe-only playlist
-        try:
-            with open(temp_playlist, "r") as f:
-                content = f.read()
-            
-            # Add the I-FRAMES-ONLY tag after the version tag
-            lines = content.split('\n')
-            for i, line in enumerate(lines):
-                if line.startswith('#EXT-X-VERSION:'):
-                    lines.insert(i + 1, '#EXT-X-I-FRAMES-ONLY')
-                    break
-            
-            # Write the modified content to the final iframe.m3u8 file
-            with open(video_dir / "iframe.m3u8", "w") as f:
-                f.write('\n'.join(lines))
-            
-            # Remove the temporary file
-            os.remove(temp_playlist)
-            
-            # Also remove the temporary TS file created for the iframe playlist
-            temp_ts = video_dir / "iframe_temp0.ts"
-            if temp_ts.exists():
-                os.remove(temp_ts)
-                print(f"Removed temporary TS file: {temp_ts}")
-            
-            print("✓ Iframe playlist generated!")
-        except Exception as e:
-            print(f"Error modifying iframe playlist: {str(e)}")
-            raise
+    def _create_iframe_playlist(self, video_dir: Path, ts_file: Path, key: bytes):
+        """Build iframe.m3u8 from stream.m3u8 and the single-file TS ffmpeg already wrote.
+
+        Every keyframe gets its own entry. AES-128 segments are decrypted with ``key``
+        to find them; as each segment is one CBC chain ending in PKCS7 padding, a
+        keyframe's entry runs from the nearest packet-and-block boundary in front of it
+        to the end of its segment, with the preceding ciphertext block as its IV.
+        Without the ``cryptography`` package, encrypted segments get one entry each.
+        """
+        logger.info("2. Generating iframe playlist...")
+        header = []
+        media_sequence = 0
+        segments = []  # (EXT-X-KEY line in effect, duration, byte length, byte offset, URI)
+        key_line, duration, byte_range = None, None, None
+        with open(video_dir / "stream.m3u8", "r") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("#EXT-X-KEY"):
+                    key_line = line
+                elif line.startswith("#EXTINF:"):
+                    duration = float(line[len("#EXTINF:"):].split(",")[0])
+                elif line.startswith("#EXT-X-BYTERANGE:"):
+                    length, _, offset = line[len("#EXT-X-BYTERANGE:"):].partition("@")
+                    byte_range = (int(length), int(offset) if offset else None)
+                elif line.startswith("#EXT-X-MEDIA-SEQUENCE") or line.startswith("#EXT-X-PLAYLIST-TYPE"):
+                    header.append(line)
+                    if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                        media_sequence = int(line.split(":", 1)[1])
+                elif line and not line.startswith("#") and duration is not None:
+                    length, offset = byte_range or (None, None)
+                    if offset is None:  # continues right after the previous segment
+                        offset = segments[-1][3] + segments[-1][2] if segments else 0
+                    segments.append((key_line, duration, length, offset, line))
+                    duration, byte_range = None, None
+
+        entries = []  # (EXT-X-KEY line for the entry, duration, byte length, byte offset, URI)
+        keyframe_count = 0
+        if not can_decrypt():
+            logger.warning("Warning: cryptography is not installed, encrypted segments get one iframe entry each")
+        with open_ts(ts_file) as data:
+            for index, (key_line, duration, length, offset, uri) in enumerate(segments):
+                encrypted = key_line is not None and "METHOD=NONE" not in key_line
+                if encrypted:
+                    # Without an IV attribute the segment's IV is its media sequence number
+                    iv = _key_iv(key_line, media_sequence + index)
+                    if not can_decrypt():
+                        entries.append((_with_iv(key_line, iv), duration, length, offset, uri))
+                        continue
+                    keyframes = scan_keyframes(decrypt_segment(data, offset, length, key, iv))
+                else:
+                    keyframes = scan_keyframes(data, offset, offset + length)
+                    keyframes = [kf._replace(offset=kf.offset - offset) for kf in keyframes]
+                if not keyframes:
+                    entries.append((_with_iv(key_line, iv) if encrypted else key_line, duration, length, offset, uri))
+                    continue
+                keyframe_count += len(keyframes)
+                # Keyframe times relative to the segment start, from their PTS (evenly spread without one)
+                first_pts = keyframes[0].pts
+                times = [(kf.pts - first_pts if kf.pts is not None and first_pts is not None
+                          else duration * i / len(keyframes)) for i, kf in enumerate(keyframes)]
+                for i, kf in enumerate(keyframes):
+                    until = times[i + 1] if i + 1 < len(keyframes) else duration
+                    if encrypted:
+                        start = kf.offset - kf.offset % PACKET_BLOCK_ALIGNMENT
+                        entry_iv = data[offset + start - AES_BLOCK_SIZE:offset + start] if start else iv
+                        entries.append((_with_iv(key_line, entry_iv), max(until - times[i], 0.0),
+                                        length - start, offset + start, uri))
+                    else:
+                        entries.append((key_line, max(until - times[i], 0.0), kf.size, offset + kf.offset, uri))
+
+        lines = ["#EXTM3U", "#EXT-X-VERSION:4",
+                 f"#EXT-X-TARGETDURATION:{max(math.ceil(entry[1]) for entry in entries) if entries else 0}"]
+        lines += header
+        lines.append("#EXT-X-I-FRAMES-ONLY")
+        current_key = None
+        for key_line, duration, length, offset, uri in entries:
+            if key_line != current_key and key_line is not None:
+                lines.append(key_line)
+            current_key = key_line
+            lines += [f"#EXTINF:{duration:.6f},", f"#EXT-X-BYTERANGE:{length}@{offset}", uri]
+        lines.append("#EXT-X-ENDLIST")
+        with open(video_dir / "iframe.m3u8", "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        if keyframe_count:
+            logger.info(f"✓ Iframe playlist generated ({keyframe_count} keyframes in {len(segments)} segments)")
+        else:
+            logger.info(f"✓ Iframe playlist generated ({len(segments)} segments, one entry each)")
+        if LOG_BODY_DUMP:
+            logger.info("First few lines of iframe.m3u8:\n" + "\n".join(lines[:10]))
 
     def _modify_m3u8_urls(self, m3u8_path: Path, video_name: str, key_filename: str):
         """Modify the m3u8 file to use CDN URLs instead of direct storage URLs."""
-        print(f"Modifying m3u8 file URLs: {m3u8_path}")
+        logger.info(f"Modifying m3u8 file URLs: {m3u8_path}")
         
         try:
             with open(m3u8_path, 'r') as f:
@@ -195,234 +278,408 @@ class VideoProcessor:
             with open(m3u8_path, 'w') as f:
                 f.write(content)
             
-            print(f"✓ Successfully modified URLs in {m3u8_path.name}")
+            logger.info(f"✓ Successfully modified URLs in {m3u8_path.name}")
             
         except Exception as e:
-            print(f"Error modifying m3u8 URLs: {str(e)}")
+            logger.error(f"Error modifying m3u8 URLs: {str(e)}")
             raise
 
-    def process_video(self, input_file: Path):
-        """Process a single video file."""
-        try:
-            video_name = input_file.stem
-            print(f"\nProcessing video: {video_name}")
-            
-            # Setup directory and generate key
-            video_dir = self._setup_video_directory(video_name)
-            print(f"Created video directory: {video_dir}")
-            
-            key, key_filename = self._generate_key()
-            print(f"Generated key with filename: {key_filename}")
-            
-            key_info_path = self._write_key_file(video_dir, key, key_filename)
-            print(f"Wrote key info file at: {key_info_path}")
-            
-            # Create a temporary key info file that uses local path
-            temp_key_info_path = video_dir / "temp_key_info"
-            key_path = video_dir / key_filename
-            with open(temp_key_info_path, 'w') as f:
-                # Use local path for the key file during encoding
-                f.write(f"{key_filename}\n{str(key_path)}\n")
+    def _notify_proxies(self, video_name: str):
+        """Tell every proxy node to drop its cached playlists for a freshly uploaded video."""
+        headers = {'X-Invalidate-Token': CACHE_INVALIDATE_TOKEN} if CACHE_INVALIDATE_TOKEN else {}
+        for base_url in PROXY_INVALIDATE_URLS:
+            invalidate_url = f"{base_url.rstrip('/')}/cache/invalidate/{video_name}"
+            try:
+                response = requests.post(invalidate_url, headers=headers, timeout=5)
+                if response.status_code == 200:
+                    logger.info(f"✓ Invalidated cached playlists on {base_url}")
+                else:
+                    logger.warning(f"Warning: cache invalidation on {base_url} returned status {response.status_code}")
+            except requests.RequestException as e:
+                logger.warning(f"Warning: could not invalidate cache on {base_url}: {str(e)}")
+
+    def _playlist_stats(self, video_dir: Path) -> tuple[float, int]:
+        """Total duration and segment count of the generated stream playlist."""
+        duration = 0.0
+        segment_count = 0
+        with open(video_dir / "stream.m3u8", "r") as f:
+            for line in f:
+                if line.startswith("#EXTINF:"):
+                    duration += float(line[len("#EXTINF:"):].split(",")[0])
+                    segment_count += 1
+        return duration, segment_count
+
+    def _create_poster(self, input_file: Path, video_dir: Path):
+        """Extract a poster frame (and optionally a short animated preview) for the library grid."""
+        duration, _ = self._playlist_stats(video_dir)
+        offset = min(POSTER_OFFSET, duration / 2)
+        poster_cmd = [
+            FFMPEG_PATH,
+            "-ss", f"{offset:.3f}",
+            "-i", str(input_file),
+            "-frames:v", "1",
+            "-vf", f"scale={POSTER_WIDTH}:-2",
+            "-q:v", "4",
+            "-y", str(video_dir / "poster.jpg")
+        ]
+        result = subprocess.run(poster_cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            logger.warning(f"Warning: poster extraction failed: {result.stderr[-500:]}")
+        else:
+            logger.info(f"✓ Poster extracted at {offset:.1f}s ({os.path.getsize(video_dir / 'poster.jpg')} bytes)")
 
-            stream_cmd = [
+        if PREVIEW_ENABLED:
+            preview_cmd = [
                 FFMPEG_PATH,
+                "-ss", f"{offset:.3f}",
+                "-t", str(PREVIEW_DURATION),
                 "-i", str(input_file),
-                "-c:v", "copy",
-                "-c:a", "copy",
-                "-force_key_frames", "expr:gte(t,n_forced*1)",
-                "-f", "hls",
-                "-hls_time", str(SEGMENT_DURATION),
-                "-movflags", "+faststart",
-                "-hls_segment_type", "mpegts",
-                "-hls_list_size", "0",
-                "-hls_flags", "independent_segments+single_file",
-                "-hls_key_info_file", str(temp_key_info_path),
-                "-hls_playlist_type", "vod",
-                str(video_dir / "stream.m3u8")
+                "-an",
+                "-vf", f"fps=8,scale={POSTER_WIDTH}:-2",
+                "-loop", "0",
+                "-q:v", "60",
+                "-y", str(video_dir / "preview.webp")
             ]
-            
-            print(f"Running FFmpeg command: {' '.join(stream_cmd)}")
-            result = subprocess.run(stream_cmd, capture_output=True, text=True)
-            
+            result = subprocess.run(preview_cmd, capture_output=True, text=True)
             if result.returncode != 0:
-                print(f"FFmpeg error: {result.stderr}")
-                raise Exception(f"FFmpeg command failed: {result.stderr}")
-            
-            print(f"FFmpeg output: {result.stdout[:200]}...")
-            print("✓ Main stream playlist generated!")
-            
-            # Check if files were created
-            if not (video_dir / "stream.m3u8").exists():
-                print(f"Warning: stream.m3u8 was not created!")
+                logger.warning(f"Warning: preview extraction failed: {result.stderr[-500:]}")
             else:
-                print(f"stream.m3u8 was created successfully, size: {os.path.getsize(video_dir / 'stream.m3u8')} bytes")
-                
-                # Update URLs in stream.m3u8
-                print("Updating URLs in stream.m3u8...")
-                with open(video_dir / "stream.m3u8", "r") as f:
-                    lines = f.readlines()
-                
-                modified_lines = []
-                for line in lines:
-                    if line.startswith("#EXT-X-KEY"):
-                        # Replace the key URI with full CDN URL
-                        line = line.replace(f'URI="{key_filename}"', f'URI="{CDN_BASE_URL}/Example_folder_for_Key/{key_filename}"')
-                        # Make sure line includes the closing quote and IV
-                        if not line.strip().endswith('"'):
-                            if 'IV=' in line:
-                                # Keep the IV parameter
-                                iv_part = line.split('IV=')[1]
-                                line = line.split('IV=')[0] + f'IV={iv_part}'
-                            else:
-                                # Add the closing quote
-                                line = line.rstrip() + '"\n'
-                    elif line.strip() == "stream.ts":
-                        # Replace the local TS file path with CDN URL
-                        line = f"{CDN_BASE_URL}/Example_folder_for_TS/{video_name}/{video_name}.ts\n"
-                    modified_lines.append(line)
-                
-                with open(video_dir / "stream.m3u8", "w") as f:
-                    f.writelines(modified_lines)
-                print("✓ Updated URLs in stream.m3u8")
-                
-                print("\nFirst few lines of updated stream.m3u8:")
-                for i, line in enumerate(modified_lines):
-                    if i < 10:
-                        print(line.strip())
-            
-            # In single file mode, FFmpeg creates a file named stream0.ts
-            ts_file = video_dir / f"{video_name}_000.ts"  # Updated to match new naming pattern
-            if not ts_file.exists():
-                print(f"Warning: {ts_file.name} was not created!")
-            else:
-                print(f"{ts_file.name} was created successfully, size: {os.path.getsize(ts_file)} bytes")
-                # Rename to video_name.ts
-                ts_file.rename(video_dir / f"{video_name}.ts")
-                print(f"Renamed {ts_file.name} to {video_dir / f'{video_name}.ts'}")
-            
-            # Update iframe playlist command to use local paths
-            iframe_cmd = [
-                FFMPEG_PATH,
-                "-i", str(input_file),
-                "-c:v", "copy",
-                "-c:a", "copy",
-                "-force_key_frames", "expr:gte(t,n_forced*1)",
-                "-f", "hls",
-                "-hls_time", str(SEGMENT_DURATION),
-                "-movflags", "+faststart",
-                "-hls_segment_type", "mpegts",
-                "-hls_list_size", "0",
-                "-hls_flags", "single_file",
-                "-hls_key_info_file", str(temp_key_info_path),
-                "-hls_playlist_type", "vod",
-                str(video_dir / "iframe.m3u8")
-            ]
+                logger.info(f"✓ Animated preview created ({os.path.getsize(video_dir / 'preview.webp')} bytes)")
+
+    def _create_trickplay(self, input_file: Path, video_dir: Path):
+        """Render scrubber thumbnails into sprite sheets plus a WebVTT track mapping time ranges to sprite tiles."""
+        duration, _ = self._playlist_stats(video_dir)
+        trickplay_dir = video_dir / "trickplay"
+        trickplay_dir.mkdir(exist_ok=True)
+        trickplay_cmd = [
+            FFMPEG_PATH,
+            "-i", str(input_file),
+            "-an",
+            "-vf", (f"fps=1/{TRICKPLAY_INTERVAL},"
+                    f"scale={TRICKPLAY_WIDTH}:{TRICKPLAY_HEIGHT}:force_original_aspect_ratio=decrease,"
+                    f"pad={TRICKPLAY_WIDTH}:{TRICKPLAY_HEIGHT}:(ow-iw)/2:(oh-ih)/2,"
+                    f"tile={TRICKPLAY_COLUMNS}x{TRICKPLAY_ROWS}"),
+            "-q:v", "5",
+            "-y", str(trickplay_dir / "sprite_%03d.jpg")
+        ]
+        result = subprocess.run(trickplay_cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            logger.warning(f"Warning: trickplay extraction failed: {result.stderr[-500:]}")
+            shutil.rmtree(trickplay_dir)
+            return
+
+        # Sprite URLs are versioned so a re-ingested video never shows another upload's cached tiles
+        sprites = sorted(trickplay_dir.glob("sprite_*.jpg"))
+        version = int(time.time())
+        per_sprite = TRICKPLAY_COLUMNS * TRICKPLAY_ROWS
+        thumbnail_count = min(math.ceil(duration / TRICKPLAY_INTERVAL), len(sprites) * per_sprite)
+        cues = ["WEBVTT", ""]
+        for i in range(thumbnail_count):
+            start = i * TRICKPLAY_INTERVAL
+            end = min(start + TRICKPLAY_INTERVAL, duration)
+            x = (i % TRICKPLAY_COLUMNS) * TRICKPLAY_WIDTH
+            y = (i // TRICKPLAY_COLUMNS % TRICKPLAY_ROWS) * TRICKPLAY_HEIGHT
+            cues.append(f"{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}")
+            cues.append(f"{sprites[i // per_sprite].name}?v={version}"
+                        f"#xywh={x},{y},{TRICKPLAY_WIDTH},{TRICKPLAY_HEIGHT}")
+            cues.append("")
+        with open(trickplay_dir / "thumbnails.vtt", "w") as f:
+            f.write("\n".join(cues))
+        logger.info(f"✓ Trickplay track created ({thumbnail_count} thumbnails in {len(sprites)} sprite sheets)")
+
+    def _index_video(self, video_dir: Path, video_name: str, key_filename: str):
+        """Record an uploaded video in the catalog index."""
+        duration, segment_count = self._playlist_stats(video_dir)
+        ts_file = video_dir / f"{video_name}.ts"
+        self.catalog_index.upsert(
+            video_name,
+            duration=round(duration, 3),
+            size_bytes=ts_file.stat().st_size if ts_file.exists() else None,
+            segment_count=segment_count,
+            key_filename=key_filename
+        )
+        logger.info(f"✓ Indexed {video_name} in the catalog ({segment_count} segments, {duration:.1f}s)")
+
+    def _write_metrics(self):
+        """Leave ingest metrics where the web app's /metrics endpoint picks them up."""
+        try:
+            REGISTRY.write_textfile(INGEST_METRICS_PATH)
+        except OSError as e:
+            logger.warning(f"Warning: could not write ingest metrics to {INGEST_METRICS_PATH}: {str(e)}")
+
+    def _encode_video(self, input_file: Path) -> dict:
+        """Run the ffmpeg stages of one video: remux, iframe playlist, poster and trickplay."""
+        stage_seconds = {}
+        video_name = input_file.stem
+        logger.info(f"Processing video: {video_name}")
+        
+        # Setup directory and generate key
+        video_dir = self._setup_video_directory(video_name)
+        logger.info(f"Created video directory: {video_dir}")
+        
+        key, key_filename = self._generate_key()
+        logger.info(f"Generated key with filename: {key_filename}")
+        
+        key_info_path = self._write_key_file(video_dir, key, key_filename)
+        logger.info(f"Wrote key info file at: {key_info_path}")
+        
+        # Create a temporary key info file that uses local path
+        temp_key_info_path = video_dir / "temp_key_info"
+        key_path = video_dir / key_filename
+        with open(temp_key_info_path, 'w') as f:
+            # Use local path for the key file during encoding
+            f.write(f"{key_filename}\n{str(key_path)}\n")
+
+        stream_cmd = [
+            FFMPEG_PATH,
+            "-i", str(input_file),
+            "-c:v", "copy",
+            "-c:a", "copy",
+            "-force_key_frames", "expr:gte(t,n_forced*1)",
+            "-f", "hls",
+            "-hls_time", str(SEGMENT_DURATION),
+            "-movflags", "+faststart",
+            "-hls_segment_type", "mpegts",
+            "-hls_list_size", "0",
+            "-hls_flags", "independent_segments+single_file",
+            "-hls_key_info_file", str(temp_key_info_path),
+            "-hls_playlist_type", "vod",
+            str(video_dir / "stream.m3u8")
+        ]
+        
+        logger.info(f"Running FFmpeg command: {' '.join(stream_cmd)}")
+        ts_upload = None
+        if INGEST_PIPELINED_UPLOAD and self.storage is not None:
+            # Send the TS in parts while ffmpeg is still appending to it
+            try:
+                ts_upload = self.storage.start_growing_ts_upload(
+                    f"{video_name}/{video_name}.ts", lambda: next(iter(sorted(video_dir.glob("*.ts"))), None))
+            except Exception as e:
+                logger.warning(f"Could not start the pipelined TS upload, uploading it after encoding: {e}")
+        with _timed(stage_seconds, 'remux'):
+            try:
+                result = subprocess.run(stream_cmd, capture_output=True, text=True)
+            except BaseException:
+                if ts_upload is not None:
+                    ts_upload.abort()
+                raise
+            ts_uploaded = False
+            if ts_upload is not None:
+                if result.returncode == 0:
+                    ts_uploaded = ts_upload.finish()  # on failure the TS is uploaded again after encoding
+                else:
+                    ts_upload.abort()
+        
+        if result.returncode != 0:
+            logger.error(f"FFmpeg error: {result.stderr}")
+            raise Exception(f"FFmpeg command failed: {result.stderr}")
+        
+        logger.debug(f"FFmpeg output: {result.stdout[:200]}...")
+        logger.info("✓ Main stream playlist generated!")
+        
+        # Check if files were created
+        if not (video_dir / "stream.m3u8").exists():
+            logger.warning("Warning: stream.m3u8 was not created!")
+        else:
+            logger.info(f"stream.m3u8 was created successfully, size: {os.path.getsize(video_dir / 'stream.m3u8')} bytes")
             
-            print("2. Generating iframe playlist...")
-            print(f"Running iframe FFmpeg command: {' '.join(iframe_cmd)}")
-            result = subprocess.run(iframe_cmd, capture_output=True, text=True)
+            # Update URLs in stream.m3u8
+            logger.info("Updating URLs in stream.m3u8...")
+            with open(video_dir / "stream.m3u8", "r") as f:
+                lines = f.readlines()
             
-            if result.returncode != 0:
-                print(f"FFmpeg iframe error: {result.stderr}")
-                raise Exception(f"FFmpeg iframe command failed: {result.stderr}")
+            modified_lines = []
+            for line in lines:
+                if line.startswith("#EXT-X-KEY"):
+                    # Replace the key URI with full CDN URL
+                    line = line.replace(f'URI="{key_filename}"', f'URI="{CDN_BASE_URL}/Example_folder_for_Key/{key_filename}"')
+                    # Make sure line includes the closing quote and IV
+                    if not line.strip().endswith('"'):
+                        if 'IV=' in line:
+                            # Keep the IV parameter
+                            iv_part = line.split('IV=')[1]
+                            line = line.split('IV=')[0] + f'IV={iv_part}'
+                        else:
+                            # Add the closing quote
+                            line = line.rstrip() + '"\n'
+                elif line.strip() == "stream.ts":
+                    # Replace the local TS file path with CDN URL
+                    line = f"{CDN_BASE_URL}/Example_folder_for_TS/{video_name}/{video_name}.ts\n"
+                modified_lines.append(line)
             
-            # Modify the iframe playlist to add I-FRAMES-ONLY tag and update URLs
-            if (video_dir / "iframe.m3u8").exists():
-                with open(video_dir / "iframe.m3u8", "r") as f:
-                    lines = f.readlines()
-                
-                modified_lines = []
-                for line in lines:
-                    if line.startswith("#EXT-X-KEY"):
-                        # Replace the key URI with full CDN URL
-                        line = line.replace(f'URI="{key_filename}"', f'URI="{CDN_BASE_URL}/Example_folder_for_Key/{key_filename}"')
-                        # Make sure line includes the closing quote and IV
-                        if not line.strip().endswith('"'):
-                            if 'IV=' in line:
-                                # Keep the IV parameter
-                                iv_part = line.split('IV=')[1]
-                                line = line.split('IV=')[0] + f'IV={iv_part}'
-                            else:
-                                # Add the closing quote
-                                line = line.rstrip() + '"\n'
-                    elif line.strip() == "iframe.ts":
-                        # Replace the local TS file path with CDN URL
-                        line = f"{CDN_BASE_URL}/Example_folder_for_TS/{video_name}/{video_name}.ts\n"
-                    modified_lines.append(line)
-                
-                # Add I-FRAMES-ONLY tag after version tag
-                for i, line in enumerate(modified_lines):
-                    if line.startswith("#EXT-X-VERSION"):
-                        modified_lines.insert(i + 1, "#EXT-X-I-FRAMES-ONLY\n")
-                        break
-                
-                with open(video_dir / "iframe.m3u8", "w") as f:
-                    f.writelines(modified_lines)
-                
-                print("✓ Updated iframe playlist with I-FRAMES-ONLY tag and CDN URLs")
-                
-                print("\nFirst few lines of updated iframe.m3u8:")
-                for i, line in enumerate(modified_lines):
-                    if i < 10:
-                        print(line.strip())
-            else:
-                print(f"Warning: iframe.m3u8 was not created!")
+            with open(video_dir / "stream.m3u8", "w") as f:
+                f.writelines(modified_lines)
+            logger.info("✓ Updated URLs in stream.m3u8")
             
+            if LOG_BODY_DUMP:
+                logger.info("First few lines of updated stream.m3u8:\n" + "".join(modified_lines[:10]).rstrip())
+        
+        # In single file mode, FFmpeg names the TS after the playlist
+        ts_file = video_dir / "stream.ts"
+        if not ts_file.exists():
+            logger.warning(f"Warning: {ts_file.name} was not created!")
+        else:
+            logger.info(f"{ts_file.name} was created successfully, size: {os.path.getsize(ts_file)} bytes")
+            # Rename to video_name.ts
+            ts_file.rename(video_dir / f"{video_name}.ts")
+            logger.info(f"Renamed {ts_file.name} to {video_dir / f'{video_name}.ts'}")
+        
+        # The I-frame playlist comes from the TS written above rather than a second ffmpeg pass
+        if (video_dir / "stream.m3u8").exists() and (video_dir / f"{video_name}.ts").exists():
+            with _timed(stage_seconds, 'iframe'):
+                self._create_iframe_playlist(video_dir, video_dir / f"{video_name}.ts", key)
+        else:
+            logger.warning("Warning: iframe.m3u8 was not created!")
+        
+        # Poster (and preview) for the library grid, trickplay thumbnails for the player's scrubber
+        if (video_dir / "stream.m3u8").exists():
+            with _timed(stage_seconds, 'poster'):
+                self._create_poster(input_file, video_dir)
+            if TRICKPLAY_ENABLED:
+                with _timed(stage_seconds, 'trickplay'):
+                    self._create_trickplay(input_file, video_dir)
+
+        return {
+            'input_file': input_file,
+            'video_dir': video_dir,
+            'video_name': video_name,
+            'key_filename': key_filename,
+            'ts_uploaded': ts_uploaded,
+            'stage_seconds': stage_seconds
+        }
+
+    def _publish_video(self, encoded: dict):
+        """Upload an encoded video, then index it and tell the proxies about it."""
+        input_file, video_dir = encoded['input_file'], encoded['video_dir']
+        video_name, key_filename = encoded['video_name'], encoded['key_filename']
+        try:
             # Upload to storage
-            print("3. Uploading files to storage...")
-            success = self.storage.upload_video_files(video_dir, video_name, key_filename)
+            logger.info(f"3. Uploading files for {video_name} to storage...")
+            with INGEST_STAGE_SECONDS.time(stage='upload'):
+                success = self.storage.upload_video_files(video_dir, video_name, key_filename,
+                                                          ts_uploaded=encoded['ts_uploaded'])
             if success:
-                print("✓ Files uploaded to storage!")
+                logger.info(f"✓ Files for {video_name} uploaded to storage!")
+                if self.catalog_index is not None:
+                    with INGEST_STAGE_SECONDS.time(stage='index'):
+                        self._index_video(video_dir, video_name, key_filename)
+                with INGEST_STAGE_SECONDS.time(stage='notify'):
+                    self._notify_proxies(video_name)
             else:
-                print("❌ Failed to upload some files to storage!")
+                logger.error(f"❌ Failed to upload some files for {video_name} to storage!")
                 return False, f"Failed to upload files for {video_name}"
             
             # Clean up temporary files
+            temp_key_info_path = video_dir / "temp_key_info"
             if temp_key_info_path.exists():
                 os.remove(temp_key_info_path)
             
             return True, None
             
         except Exception as e:
-            print(f"Error processing video {input_file.name}: {str(e)}")
+            logger.error(f"Error processing video {input_file.name}: {str(e)}")
             return False, str(e)
 
+    def _observe_stages(self, encoded: dict):
+        for stage, seconds in encoded['stage_seconds'].items():
+            INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+
+    def process_video(self, input_file: Path):
+        """Process a single video file."""
+        try:
+            encoded = self._encode_video(input_file)
+        except Exception as e:
+            logger.error(f"Error processing video {input_file.name}: {str(e)}")
+            return False, str(e)
+        self._observe_stages(encoded)
+        return self._publish_video(encoded)
+
+    def _record_result(self, results: list, input_file: Path, success: bool, message: Optional[str]):
+        INGEST_VIDEOS.inc(outcome='success' if success else 'failure')
+        results.append((input_file.name, success, message))
+        self._write_metrics()
+
+    def _process_concurrently(self, mp4_files: list, workers: int) -> list:
+        """Encode up to ``workers`` videos at once in worker processes and upload finished ones on threads.
+
+        Each video's encode and publish outcome is recorded on its own, so one failing
+        video (or ffmpeg run) never takes the others down with it.
+        """
+        logger.info(f"Processing with {workers} encode workers and {INGEST_UPLOAD_WORKERS} upload threads")
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_encode_worker) as encoders, \
+                ThreadPoolExecutor(max_workers=INGEST_UPLOAD_WORKERS, thread_name_prefix='ingest-upload') as uploaders:
+            # future -> (input file, encoded video once it is being published)
+            pending = {encoders.submit(_encode_in_worker, self.input_dir, self.output_dir, input_file): (input_file, None)
+                       for input_file in mp4_files}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    input_file, encoded = pending.pop(future)
+                    if encoded is None:
+                        try:
+                            encoded = future.result()
+                        except Exception as e:
+                            logger.error(f"Error processing video {input_file.name}: {str(e)}")
+                            self._record_result(results, input_file, False, str(e))
+                            continue
+                        self._observe_stages(encoded)
+                        publish = uploaders.submit(self._timed_publish, encoded)
+                        pending[publish] = (input_file, encoded)
+                    else:
+                        success, message = future.result()
+                        self._record_result(results, input_file, success, message)
+        return results
+
+    def _timed_publish(self, encoded: dict):
+        """Publish an encoded video, observing its total time (encode plus publish) like ``process_video``."""
+        started = time.perf_counter()
+        try:
+            return self._publish_video(encoded)
+        finally:
+            INGEST_STAGE_SECONDS.observe(sum(encoded['stage_seconds'].values()) + time.perf_counter() - started,
+                                         stage='total')
+
     def process_all_videos(self) -> bool:
-        """Process all MP4 files in the input directory."""
+        """Process all MP4 files in the input directory, INGEST_WORKERS at a time."""
         mp4_files = list(self.input_dir.glob("*.mp4"))
         
         if not mp4_files:
-            print("\n❌ No MP4 files found in input directory.")
-            print(f"Please place MP4 files in: {self.input_dir}")
+            logger.error("❌ No MP4 files found in input directory.")
+            logger.info(f"Please place MP4 files in: {self.input_dir}")
             return False
 
-        print(f"\nFound {len(mp4_files)} MP4 files to process.")
+        logger.info(f"Found {len(mp4_files)} MP4 files to process.")
         
-        successful = 0
-        results = []
-        
-        for input_file in mp4_files:
-            success, message = self.process_video(input_file)
-            results.append((input_file.name, success, message))
-            if success:
-                successful += 1
+        workers = INGEST_WORKERS or os.cpu_count() or 1
+        if workers > 1 and len(mp4_files) > 1:
+            results = self._process_concurrently(mp4_files, min(workers, len(mp4_files)))
+        else:
+            results = []
+            for input_file in mp4_files:
+                with INGEST_STAGE_SECONDS.time(stage='total'):
+                    success, message = self.process_video(input_file)
+                self._record_result(results, input_file, success, message)
+        successful = sum(1 for _, success, _ in results if success)
 
-        print(f"\n=== Processing Summary ===")
-        print(f"Total videos: {len(mp4_files)}")
-        print(f"Successfully processed: {successful}")
-        print(f"Failed: {len(mp4_files) - successful}")
+        logger.info("=== Processing Summary ===")
+        logger.info(f"Total videos: {len(mp4_files)}")
+        logger.info(f"Successfully processed: {successful}")
+        logger.info(f"Failed: {len(mp4_files) - successful}")
         
         if len(mp4_files) - successful > 0:
-            print("\nFailed videos:")
+            logger.error("Failed videos:")
             for name, success, message in results:
                 if not success:
-                    print(f"  - {name}: {message}")
+                    logger.error(f"  - {name}: {message}")
         
         return successful == len(mp4_files)
 
 def main():
     """Main entry point for the script."""
-    print("\n=== Video Processing System (Single-File HLS with Folder Organization) ===")
+    configure_logging(LOG_LEVEL, LOG_FORMAT)
+    logger.info("=== Video Processing System (Single-File HLS with Folder Organization) ===")
+    REGISTRY.namespace = INGEST_NAMESPACE
     
     try:
         # Step 1: Initialize storage handler with private bucket configuration
@@ -432,32 +689,31 @@ def main():
         processor = VideoProcessor(
             input_dir=INPUT_DIR,
             output_dir=OUTPUT_DIR,
-            storage_handler=storage
+            storage_handler=storage,
+            catalog_index=CatalogIndex(CATALOG_DB_PATH)
         )
         
         # Step 3: Validate environment
         if not processor.validate_environment():
-            print("\n❌ Environment validation failed. Please fix the issues and try again.")
+            logger.error("❌ Environment validation failed. Please fix the issues and try again.")
             return 1
         
         # Step 4: Test storage connection
         if not processor.test_storage_connection():
-            print("\n❌ Storage connection test failed. Please check your credentials and try again.")
+            logger.error("❌ Storage connection test failed. Please check your credentials and try again.")
             return 1
         
         # Step 5: Process all videos
-        print("\n=== Starting Video Processing (Single-File HLS with Folder Organization) ===")
+        logger.info("=== Starting Video Processing (Single-File HLS with Folder Organization) ===")
         if not processor.process_all_videos():
-            print("\n⚠️ Some videos failed to process. Check the logs for details.")
+            logger.warning("⚠️ Some videos failed to process. Check the logs for details.")
             return 1
         
-        print("\nDone!")
+        logger.info("Done!")
         return 0
         
     except Exception as e:
-        print(f"\n❌ An error occurred: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"❌ An error occurred: {str(e)}")
         return 1
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+from single_flight import SingleFlight
+
+
+class KeyStore:
+    """In-memory store for HLS encryption keys fetched through the storage handler.
+
+    Keys are kept for ``ttl`` seconds, and unknown key names are remembered for
+    ``negative_ttl`` seconds so repeated misses don't reach object storage either.
+    At most ``max_entries`` names (known and unknown) are held, least recently
+    used first out. Concurrent misses for the same key share one storage fetch.
+    """
+
+    def __init__(self, storage_handler, ttl: float = 3600, negative_ttl: float = 30, max_entries: int = 10000,
+                 single_flight: SingleFlight = None):
+        self.storage = storage_handler
+        self.single_flight = single_flight or SingleFlight()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self._keys = OrderedDict()  # key name -> (key bytes or None, expires_at)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.fetch_errors = 0
+
+    def get(self, key_name: str):
+        """Return the key bytes for ``key_name``, or None if no such key exists"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get(key_name)
+            if entry is not None and entry[1] > now:
+                self._keys.move_to_end(key_name)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        try:
+            key, _ = self.single_flight.do(('key', key_name), lambda: self.storage.get_key_file(key_name))
+        except Exception:
+            with self._lock:
+                self.fetch_errors += 1
+            raise
+
+        expires_at = time.monotonic() + (self.ttl if key is not None else self.negative_ttl)
+        with self._lock:
+            self._keys[key_name] = (key, expires_at)
+            self._keys.move_to_end(key_name)
+            while len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
+        return key
+
+    def invalidate(self, key_name: str = None):
+        """Forget one key name, or every key when ``key_name`` is None"""
+        with self._lock:
+            if key_name is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(key_name, None)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                'entries': len(self._keys),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'negative_ttl': self.negative_ttl,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'fetch_errors': self.fetch_errors,
+                'hit_ratio': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,352 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Default latency buckets (seconds): sub-millisecond cache hits up to slow upstream transfers
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Ingest stages run for seconds to hours
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with an optional fixed set of label names"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> total
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, name: str):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f'{name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """Bucketed distribution (cumulative on output) with an optional fixed set of label names"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of a ``with`` block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self, name: str):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f'{name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(counts[-1], 6))}'
+            yield f'{name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered in the Prometheus text exposition format.
+
+    Counters and histograms are updated in place on the hot path (a dict update under
+    a lock). Collectors are called only at scrape time and turn the ``stats()`` of the
+    caching layers into gauges, so those layers need no changes of their own.
+    Every family name is prefixed with ``namespace``.
+    """
+
+    def __init__(self, namespace: str = 'hls'):
+        self.namespace = namespace
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collect):
+        """Add a scrape-time callable yielding ``(name, kind, help, [(labels dict, value), ...])``"""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        """Return every metric with at least one sample, in the text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            name = f'{self.namespace}_{metric.name}'
+            samples = list(metric.samples(name))
+            if samples:
+                lines += [f'# HELP {name} {metric.help}', f'# TYPE {name} {metric.kind}'] + samples
+        for collect in collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+                continue
+            for family_name, kind, help, samples in families:
+                name = f'{self.namespace}_{family_name}'
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write_textfile(self, path):
+        """Atomically write the current metrics to ``path`` (textfile-collector style)"""
+        path = Path(path)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+PROXY_REQUEST_SECONDS = REGISTRY.histogram(
+    'proxy_request_seconds', 'Time from request start until the last response byte was sent, per route',
+    ('route', 'method', 'status'))
+RESPONSE_BYTES = REGISTRY.counter(
+    'response_bytes_total', 'Response body bytes sent to clients, per route', ('route',))
+UPSTREAM_TTFB_SECONDS = REGISTRY.histogram(
+    'upstream_ttfb_seconds', 'Time until upstream response headers arrived, per host', ('host',))
+S3_REQUESTS = REGISTRY.counter(
+    's3_requests_total', 'Object storage API calls by operation and outcome', ('operation', 'outcome'))
+S3_REQUEST_SECONDS = REGISTRY.histogram(
+    's3_request_seconds', 'Object storage API call latency by operation', ('operation',))
+# Ingest runs as its own process and renders under the INGEST_NAMESPACE, so its families
+# (including its S3 calls) never clash with the web process's when /metrics serves both
+INGEST_NAMESPACE = 'hls_ingest'
+INGEST_STAGE_SECONDS = REGISTRY.histogram(
+    'stage_seconds', 'Duration of each VideoProcessor stage', ('stage',), buckets=STAGE_BUCKETS)
+INGEST_VIDEOS = REGISTRY.counter(
+    'videos_total', 'Videos processed by VideoProcessor, by outcome', ('outcome',))
+
+
+def cache_collector(caches: dict):
+    """Collector exposing hits, misses and hit ratio of caches whose ``stats()`` report them"""
+    def collect():
+        stats = {name: cache.stats() for name, cache in caches.items()}
+        yield ('cache_hits_total', 'counter', 'Cache lookups answered from the cache',
+               [({'cache': name}, s['hits'] + s.get('negative_hits', 0) + s.get('partial_hits', 0))
+                for name, s in stats.items()])
+        yield ('cache_misses_total', 'counter', 'Cache lookups that went upstream',
+               [({'cache': name}, s['misses']) for name, s in stats.items()])
+        yield ('cache_hit_ratio', 'gauge', 'Fraction of lookups answered entirely from the cache',
+               [({'cache': name}, s['hit_ratio']) for name, s in stats.items()])
+    return collect
+
+
+def instrument_boto3_client(client):
+    """Count and time every API call a boto3 client makes (including multipart upload parts)"""
+    def before_call(model, context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    def after_call(http_response, model, context, **kwargs):
+        S3_REQUESTS.inc(operation=model.name, outcome=str(http_response.status_code))
+        S3_REQUEST_SECONDS.observe(time.perf_counter() - context.get('metrics_started', time.perf_counter()),
+                                   operation=model.name)
+
+    def after_call_error(exception, context, event_name, **kwargs):
+        # Connection-level failures: no HTTP status (and no operation model) is passed along
+        operation = event_name.rsplit('.', 1)[-1]
+        S3_REQUESTS.inc(operation=operation, outcome='error')
+        S3_REQUEST_SECONDS.observe(time.perf_counter() - context.get('metrics_started', time.perf_counter()),
+                                   operation=operation)
+
+    client.meta.events.register('before-call.s3', before_call)
+    client.meta.events.register('after-call.s3', after_call)
+    client.meta.events.register('after-call-error.s3', after_call_error)
+    return client
+
+
+def _record_wsgi_request(environ, started, state, sent_bytes):
+    route = environ.get('metrics.route', 'unmatched')
+    PROXY_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                  method=environ.get('REQUEST_METHOD', ''), status=state.get('status', ''))
+    RESPONSE_BYTES.inc(sent_bytes, route=route)
+
+
+class _CountingBody:
+    """WSGI response iterable that counts bytes sent and records the request when it is closed"""
+
+    def __init__(self, body, environ, started, state):
+        self._body = body
+        self._environ = environ
+        self._started = started
+        self._state = state
+        self._bytes = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._bytes += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            _record_wsgi_request(self._environ, self._started, self._state, self._bytes)
+
+
+class MetricsMiddleware:
+    """WSGI middleware timing each request until its body has been sent in full.
+
+    Streamed responses are timed to their last byte, not just their headers. The
+    route label is the matched URL rule (set by ``instrument_flask``), so paths
+    with video IDs don't create one series per video. ``wsgi.file_wrapper`` bodies
+    are returned as they are, so the server can still send them with ``sendfile``;
+    their bytes are taken from Content-Length when the server closes them.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        state = {}
+
+        def recording_start_response(status, headers, exc_info=None):
+            state['status'] = status.split(' ', 1)[0]
+            state['length'] = next((value for name, value in headers if name.lower() == 'content-length'), None)
+            return start_response(status, headers, exc_info)
+
+        body = self.wsgi_app(environ, recording_start_response)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            body_close = getattr(body, 'close', None)
+
+            def close():
+                try:
+                    if body_close is not None:
+                        body_close()
+                finally:
+                    length = state.get('length')
+                    _record_wsgi_request(environ, started, state, int(length) if length and length.isdigit() else 0)
+            body.close = close
+            return body
+        return _CountingBody(body, environ, started, state)
+
+
+def instrument_flask(app):
+    """Record per-route request metrics for a Flask app"""
+    from flask import request
+
+    @app.before_request
+    def label_route():
+        request.environ['metrics.route'] = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+    return app
+
+
+class ASGIMetricsMiddleware:
+    """ASGI counterpart of ``MetricsMiddleware``; the route label is the endpoint's name"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        state = {'status': '', 'bytes': 0}
+
+        async def recording_send(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = str(message['status'])
+            elif message['type'] == 'http.response.body':
+                state['bytes'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            endpoint = scope.get('endpoint')
+            route = getattr(endpoint, '__name__', 'unmatched')
+            PROXY_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=scope.get('method', ''),
+                                          status=state['status'])
+            RESPONSE_BYTES.inc(state['bytes'], route=route)
+
+
+def render_metrics(extra_textfiles=()) -> str:
+    """This process's metrics followed by those other processes (ingest) left in textfiles"""
+    text = REGISTRY.render()
+    for path in extra_textfiles:
+        try:
+            text += Path(path).read_text()
+        except FileNotFoundError:
+            continue
+    return text
+
+
+# Content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
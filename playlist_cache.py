@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from werkzeug.http import generate_etag, http_date, quote_etag
+
+# A cached playlist with the validators the proxy serves it under. ``upstream_etag`` is
+# what the CDN sent, kept so an expired copy can be revalidated upstream.
+CachedPlaylist = namedtuple('CachedPlaylist', ['body', 'etag', 'last_modified', 'upstream_etag'])
+
+
+class PlaylistCache:
+    """Bounded in-process cache for playlists, keyed by (video_id, variant).
+
+    Entries expire after ``ttl`` seconds (None keeps them until evicted); expired
+    entries are kept around so they can be revalidated upstream instead of
+    re-downloaded. When either ``max_entries`` or ``max_bytes`` would be exceeded,
+    the least recently used entries are evicted first.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # (video_id, variant) -> (CachedPlaylist, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _expires_at(self):
+        return time.monotonic() + self.ttl if self.ttl is not None else None
+
+    def get(self, video_id: str, variant: str = 'stream'):
+        """Return the cached CachedPlaylist, or None if missing or expired"""
+        key = (video_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def stale(self, video_id: str, variant: str = 'stream'):
+        """Return the cached CachedPlaylist even if it has expired, e.g. to revalidate it upstream"""
+        with self._lock:
+            entry = self._entries.get((video_id, variant))
+            return entry[0] if entry is not None else None
+
+    def put(self, video_id: str, body: bytes, variant: str = 'stream', etag: str = None,
+            last_modified: str = None) -> CachedPlaylist:
+        """Store a playlist body with its upstream validators, evicting least recently used entries.
+
+        A strong upstream ETag is served as-is; otherwise a strong ETag is derived from
+        the body. Without an upstream Last-Modified, the time the body changed is used.
+        """
+        key = (video_id, variant)
+        own_etag = etag if etag and not etag.startswith('W/') else quote_etag(generate_etag(body))
+        with self._lock:
+            previous = self._entries.get(key)
+            if last_modified is None:
+                unchanged = previous is not None and previous[0].body == body
+                last_modified = previous[0].last_modified if unchanged else http_date(time.time())
+            playlist = CachedPlaylist(body, own_etag, last_modified, etag)
+            if len(body) > self.max_bytes:
+                return playlist
+            if previous is not None:
+                self._remove(key)
+            self._entries[key] = (playlist, self._expires_at())
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            return playlist
+
+    def refresh(self, video_id: str, variant: str = 'stream'):
+        """Restart the TTL of a copy upstream confirmed is unchanged (304); returns it, or None if gone"""
+        key = (video_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], self._expires_at())
+            self._entries.move_to_end(key)
+            self.revalidations += 1
+            return entry[0]
+
+    def invalidate(self, video_id: str, variant: str = None) -> int:
+        """Drop one variant (or every variant) of a video, e.g. after ingest re-uploads it"""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == video_id and (variant is None or key[1] == variant)]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """Drop every cached playlist"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        playlist, _ = self._entries.pop(key)
+        self._bytes -= len(playlist.body)
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
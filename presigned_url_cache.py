@@ -0,0 +1,112 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# SigV4 presigned URLs cannot be valid for longer than a week
+MAX_PRESIGN_EXPIRATION = 7 * 24 * 3600
+
+
+class PresignedUrlCache:
+    """Bounded in-memory cache of presigned GET URLs, keyed by (folder, key, expiry bucket).
+
+    Requested expirations are rounded up to a multiple of ``bucket_seconds`` so nearby
+    values share entries. URLs are signed for the bucket plus a ``reuse_fraction`` of it
+    and handed out again while they still have at least the bucket's lifetime left, so
+    every caller gets a URL valid for as long as it asked and one signature serves
+    ``bucket * reuse_fraction`` seconds of requests. At most ``max_entries`` URLs are
+    held, least recently used first out.
+    """
+
+    def __init__(self, bucket_seconds: int = 60, reuse_fraction: float = 0.25, max_entries: int = 10000):
+        self.bucket_seconds = bucket_seconds
+        self.reuse_fraction = reuse_fraction
+        self.max_entries = max_entries
+
+        self._urls = OrderedDict()  # (folder, key, expiry bucket) -> (url, expires_at wall-clock)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.sign_errors = 0
+
+    def expiry_bucket(self, expiration: int) -> int:
+        """Round a requested expiration up to its bucket"""
+        bucket = math.ceil(expiration / self.bucket_seconds) * self.bucket_seconds
+        return min(max(bucket, self.bucket_seconds), MAX_PRESIGN_EXPIRATION)
+
+    def signing_expiration(self, bucket: int) -> int:
+        """How long URLs for ``bucket`` are signed for (the bucket plus the reuse window)"""
+        return min(int(bucket * (1 + self.reuse_fraction)), MAX_PRESIGN_EXPIRATION)
+
+    def get_many(self, objects, expiration: int, sign) -> list:
+        """Return presigned URLs for ``objects`` (``(folder, key)`` pairs), in order.
+
+        Only objects without a cached URL that is still good for ``expiration`` seconds
+        are passed to ``sign(folder, key, expires_in)``; entries it returns None for
+        (signing failed) are not cached.
+        """
+        bucket = self.expiry_bucket(expiration)
+        now = time.time()
+        urls = [None] * len(objects)
+        missing = []
+        with self._lock:
+            for i, (folder, key) in enumerate(objects):
+                entry = self._urls.get((folder, key, bucket))
+                if entry is not None and entry[1] - now >= bucket:
+                    self._urls.move_to_end((folder, key, bucket))
+                    urls[i] = entry[0]
+                    self.hits += 1
+                else:
+                    missing.append(i)
+                    self.misses += 1
+        if not missing:
+            return urls
+
+        expires_in = self.signing_expiration(bucket)
+        signed = []
+        for i in missing:
+            folder, key = objects[i]
+            signed_at = time.time()
+            urls[i] = sign(folder, key, expires_in)
+            signed.append((i, signed_at + expires_in))
+
+        with self._lock:
+            for i, expires_at in signed:
+                if urls[i] is None:
+                    self.sign_errors += 1
+                    continue
+                folder, key = objects[i]
+                self._urls[(folder, key, bucket)] = (urls[i], expires_at)
+                self._urls.move_to_end((folder, key, bucket))
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return urls
+
+    def get(self, folder: str, key: str, expiration: int, sign):
+        """Return a presigned URL for one object (see ``get_many``)"""
+        return self.get_many([(folder, key)], expiration, sign)[0]
+
+    def invalidate(self, folder: str = None, key: str = None):
+        """Forget the URLs of one object, or every URL when ``key`` is None"""
+        with self._lock:
+            if key is None:
+                self._urls.clear()
+            else:
+                for cache_key in [k for k in self._urls if k[:2] == (folder, key)]:
+                    del self._urls[cache_key]
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and current occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._urls),
+                'max_entries': self.max_entries,
+                'bucket_seconds': self.bucket_seconds,
+                'reuse_fraction': self.reuse_fraction,
+                'hits': self.hits,
+                'misses': self.misses,
+                'sign_errors': self.sign_errors,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,231 @@
+import uuid
+
+import requests
+from flask import Response
+from werkzeug.http import parse_date, parse_etags, parse_if_range_header, parse_range_header, unquote_etag
+
+# Size of each chunk relayed from upstream to the client. This bounds the memory a
+# single proxied transfer holds, independent of the size of the file.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Client headers forwarded upstream so byte-range fetches only pull the requested bytes
+RANGE_REQUEST_HEADERS = ('Range', 'If-Range')
+
+# Client validators forwarded upstream when the proxy has no copy of its own to compare against
+CONDITIONAL_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+# Upstream headers passed back to the client on relayed responses (bodies are relayed still encoded)
+RELAYED_RESPONSE_HEADERS = ('Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified',
+                            'Content-Encoding')
+
+
+def iter_upstream(response: requests.Response, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield an upstream body chunk by chunk as it arrives, closing the upstream response when done.
+
+    The bytes are passed on exactly as received (any Content-Encoding is not undone),
+    so they match the upstream Content-Length and Content-Range. The WSGI server
+    closes this generator when the client disconnects, which also releases the
+    upstream connection.
+    """
+    try:
+        for chunk in response.raw.stream(chunk_size, decode_content=False):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+def _iter_slice(chunks, start: int, stop: int):
+    """Yield only bytes ``start`` to ``stop`` (exclusive) of a chunked body, stopping early"""
+    position = 0
+    try:
+        for chunk in chunks:
+            chunk_end = position + len(chunk)
+            if chunk_end > start:
+                yield chunk[max(start - position, 0):stop - position]
+            position = chunk_end
+            if position >= stop:
+                break
+    finally:
+        chunks.close()
+
+
+def range_request_headers(headers) -> dict:
+    """Pick the client's Range/If-Range headers so they can be forwarded upstream"""
+    return {name: headers[name] for name in RANGE_REQUEST_HEADERS if name in headers}
+
+
+def conditional_request_headers(headers) -> dict:
+    """Pick the client's If-None-Match/If-Modified-Since headers so they can be forwarded upstream"""
+    return {name: headers[name] for name in CONDITIONAL_REQUEST_HEADERS if name in headers}
+
+
+def not_modified(headers, etag: str, last_modified: str) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the current validators (RFC 9110 13.2.2)"""
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match:
+        # If-None-Match takes precedence and uses weak comparison
+        return etag is not None and parse_etags(if_none_match).contains_weak(unquote_etag(etag)[0])
+    if_modified_since = parse_date(headers.get('If-Modified-Since'))
+    modified = parse_date(last_modified)
+    return if_modified_since is not None and modified is not None and modified <= if_modified_since
+
+
+def not_modified_response(etag: str, last_modified: str) -> Response:
+    """A header-only 304 carrying the validators the client should keep"""
+    response = Response(status=304)
+    if etag:
+        response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = last_modified
+    return response
+
+
+def parse_byte_range(headers):
+    """Parse the client's Range header, returning None unless it is a valid bytes range"""
+    byte_range = parse_range_header(headers.get('Range'))
+    if byte_range is None or byte_range.units != 'bytes':
+        return None
+    return byte_range
+
+
+def if_range_matches(if_range: str, etag: str, last_modified: str) -> bool:
+    """Evaluate an If-Range precondition against the current validators (RFC 9110 13.1.5)"""
+    if not if_range:
+        return True
+    if if_range.strip().startswith('W/'):
+        # Weak validators never match If-Range
+        return False
+    parsed = parse_if_range_header(if_range)
+    if parsed.date is not None:
+        return last_modified is not None and if_range.strip() == last_modified.strip()
+    if etag is None:
+        return False
+    current, weak = unquote_etag(etag)
+    return not weak and current == parsed.etag
+
+
+def resolve_span(start: int, stop, length: int):
+    """Turn a parsed (start, stop) range into absolute [start, stop) offsets, or None if unsatisfiable"""
+    if stop is None:
+        stop = length
+        if start < 0:
+            start = max(length + start, 0)
+    stop = min(stop, length)
+    if start >= stop:
+        return None
+    return start, stop
+
+
+def relay_response(response: requests.Response, content_type: str, byte_range=None) -> Response:
+    """Build a client response from a streamed upstream response.
+
+    The upstream status (200/206/304/416/...) and its range headers are kept as-is.
+    If the client asked for a single range and upstream answered 200 anyway, the
+    requested span is cut out of the stream here so the client still gets a 206.
+    """
+    status = response.status_code
+    headers = {name: response.headers[name] for name in RELAYED_RESPONSE_HEADERS if name in response.headers}
+
+    if response.request.method == 'HEAD':
+        response.close()
+        body = ()  # an empty iterable keeps the upstream Content-Length intact
+    elif (status == 200 and byte_range is not None and len(byte_range.ranges) == 1
+          and 'If-Range' not in response.request.headers and 'Content-Length' in headers):
+        length = int(headers['Content-Length'])
+        span = resolve_span(*byte_range.ranges[0], length)
+        if span is None:
+            response.close()
+            return Response(b'', status=416, headers={'Content-Range': f'bytes */{length}', 'Accept-Ranges': 'bytes'},
+                            content_type=content_type)
+        start, stop = span
+        body = _iter_slice(iter_upstream(response), start, stop)
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{length}'
+        headers['Content-Length'] = str(stop - start)
+    else:
+        body = iter_upstream(response)
+
+    headers.setdefault('Accept-Ranges', 'bytes')
+    return Response(body, status=status, headers=headers, content_type=content_type)
+
+
+def multirange_response(fetch, url: str, byte_range, headers: dict, content_type: str) -> Response:
+    """Serve a multi-range request as multipart/byteranges, fetching each range upstream.
+
+    Upstream is asked for one range at a time, pinned to the ETag seen on an initial
+    HEAD, so the client only pays for the bytes it asked for.
+    """
+    base_headers = {name: value for name, value in headers.items() if name not in RANGE_REQUEST_HEADERS}
+
+    head = fetch('HEAD', url, base_headers)
+    head.close()
+    etag = head.headers.get('ETag')
+    last_modified = head.headers.get('Last-Modified')
+    if head.status_code != 200 or 'Content-Length' not in head.headers:
+        return relay_response(fetch('GET', url, base_headers), content_type)
+    if not if_range_matches(headers.get('If-Range'), etag, last_modified):
+        # The representation changed since the client cached it: send it whole
+        return relay_response(fetch('GET', url, base_headers), content_type)
+
+    length = int(head.headers['Content-Length'])
+    spans = [span for span in (resolve_span(start, stop, length) for start, stop in byte_range.ranges) if span]
+    if not spans:
+        return Response(b'', status=416, headers={'Content-Range': f'bytes */{length}', 'Accept-Ranges': 'bytes'},
+                        content_type=content_type)
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n').encode('ascii')
+        for start, stop in spans
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    body_length = sum(len(part) for part in part_headers) + sum(stop - start for start, stop in spans) + len(closing)
+
+    def generate():
+        for (start, stop), part_header in zip(spans, part_headers):
+            range_headers = dict(base_headers, Range=f'bytes={start}-{stop - 1}')
+            if etag:
+                range_headers['If-Match'] = etag
+            part = fetch('GET', url, range_headers)
+            if part.status_code == 206:
+                chunks = iter_upstream(part)
+            elif part.status_code == 200:
+                chunks = _iter_slice(iter_upstream(part), start, stop)
+            else:
+                # Object changed or vanished mid-response; the short body tells the client to retry
+                part.close()
+                return
+            yield part_header
+            yield from chunks
+        yield closing
+
+    response_headers = {'Content-Length': str(body_length), 'Accept-Ranges': 'bytes'}
+    if etag:
+        response_headers['ETag'] = etag
+    if last_modified:
+        response_headers['Last-Modified'] = last_modified
+    return Response(generate(), status=206, headers=response_headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}')
+
+
+def proxy_ranged(fetch, url: str, request, content_type: str, headers: dict = None) -> Response:
+    """Proxy ``url`` for a Flask ``request``, honouring Range, If-Range, conditionals and HEAD.
+
+    ``fetch(method, url, headers)`` performs the upstream request and must return a
+    streamed ``requests`` response. HEAD is answered from an upstream HEAD, so it
+    never transfers a body; the client's validators are passed on so upstream can
+    answer a revalidation with a 304.
+    """
+    headers = dict(headers or {})
+    headers.update(conditional_request_headers(request.headers))
+    if request.method == 'HEAD':
+        return relay_response(fetch('HEAD', url, headers), content_type)
+
+    byte_range = parse_byte_range(request.headers)
+    if byte_range is not None:
+        headers.update(range_request_headers(request.headers))
+        if len(byte_range.ranges) > 1:
+            return multirange_response(fetch, url, byte_range, headers, content_type)
+    return relay_response(fetch('GET', url, headers), content_type, byte_range)
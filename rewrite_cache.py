@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class RewriteCache:
+    """Bounded LRU of rewritten playlists, keyed by the upstream validator plus the rewrite parameters.
+
+    A rewritten playlist depends only on the upstream bytes and the parameters the
+    rewrite was given, so a strong upstream ETag (or a hash of the body when there is
+    none) identifies the result. Hits skip both decoding and rewriting; the CPU time
+    spent on misses, and the time each hit saved, are kept as metrics.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key -> (body, cpu_seconds)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rewrite_cpu_seconds = 0.0
+        self.cpu_seconds_saved = 0.0
+
+    @staticmethod
+    def key(url: str, etag: str, body: bytes, *params) -> tuple:
+        """Build a cache key from the upstream validator (or a body hash) and the rewrite parameters"""
+        if etag and not etag.startswith('W/'):
+            validator = etag
+        else:
+            # Weak validators don't promise identical bytes, so fall back to hashing them
+            validator = hashlib.sha256(body).hexdigest()
+        return (url, validator) + params
+
+    def get(self, key: tuple):
+        """Return the rewritten playlist for ``key``, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.cpu_seconds_saved += entry[1]
+            return entry[0]
+
+    def put(self, key: tuple, body: bytes, cpu_seconds: float):
+        """Store a rewritten playlist along with the CPU time it took to produce"""
+        with self._lock:
+            self.rewrite_cpu_seconds += cpu_seconds
+            if len(body) > self.max_bytes:
+                return
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, cpu_seconds)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Return hit/miss counters, occupancy and rewrite CPU time"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'rewrite_cpu_seconds': round(self.rewrite_cpu_seconds, 6),
+                'cpu_seconds_saved': round(self.cpu_seconds_saved, 6),
+            }
+
@@ -0,0 +1,442 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from flask import Response
+from werkzeug.http import parse_content_range_header
+
+from proxy_stream import (STREAM_CHUNK_SIZE, if_range_matches, iter_upstream, not_modified, not_modified_response,
+                          parse_byte_range, proxy_ranged, range_request_headers, relay_response, resolve_span)
+import server_timing
+from single_flight import SingleFlight
+
+# Counters that describe how a request was served, also reported in its Server-Timing header
+_OUTCOMES = ('hits', 'partial_hits', 'misses', 'not_modified')
+
+
+class _Entry:
+    """Cached byte ranges of one upstream object"""
+
+    __slots__ = ('key', 'size', 'etag', 'last_modified', 'ranges', 'hits', 'last_access', 'validated_at')
+
+    def __init__(self, key, size, etag=None, last_modified=None, ranges=None, hits=0, last_access=None,
+                 validated_at=None):
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.ranges = ranges or []  # sorted, non-overlapping [start, stop) pairs
+        self.hits = hits
+        self.last_access = last_access or time.time()
+        self.validated_at = validated_at or time.time()  # when upstream last confirmed these validators
+
+    @property
+    def cached_bytes(self) -> int:
+        return sum(stop - start for start, stop in self.ranges)
+
+    @property
+    def complete(self) -> bool:
+        return self.ranges == [[0, self.size]]
+
+    def missing(self, start: int, stop: int) -> list:
+        """Return the sub-spans of [start, stop) that are not cached yet"""
+        spans = []
+        position = start
+        for cached_start, cached_stop in self.ranges:
+            if cached_stop <= position:
+                continue
+            if cached_start >= stop:
+                break
+            if cached_start > position:
+                spans.append((position, cached_start))
+            position = max(position, cached_stop)
+            if position >= stop:
+                break
+        if position < stop:
+            spans.append((position, stop))
+        return spans
+
+    def add(self, start: int, stop: int):
+        """Record [start, stop) as cached, merging it with overlapping or adjacent ranges"""
+        merged = []
+        for cached_start, cached_stop in sorted(self.ranges + [[start, stop]]):
+            if merged and cached_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], cached_stop)
+            else:
+                merged.append([cached_start, cached_stop])
+        self.ranges = merged
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class SegmentCache:
+    """Byte-range-aware on-disk cache for large upstream objects (single-file .ts).
+
+    Each object is stored as a sparse ``<digest>.data`` file plus a ``<digest>.json``
+    index of the byte ranges present, so the cache survives restarts. Partially cached
+    requests only fetch the missing spans upstream. Objects are revalidated upstream
+    once they are older than ``max_age`` seconds (0 never). When the cached bytes exceed
+    ``max_bytes``, whole objects are evicted by least recent (``lru``) or least
+    frequent (``lfu``) use. Concurrent fills of the same span share one upstream fetch.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int = 10 * 1024 ** 3, policy: str = 'lru',
+                 max_fill_bytes: int = 32 * 1024 * 1024, max_age: float = 3600, single_flight: SingleFlight = None):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown segment cache eviction policy: {policy}")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.max_fill_bytes = max_fill_bytes
+        self.max_age = max_age
+        self.single_flight = single_flight or SingleFlight()
+
+        self._entries = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'partial_hits': 0,
+            'misses': 0,
+            'not_modified': 0,
+            'revalidations': 0,
+            'bytes_from_disk': 0,
+            'bytes_from_upstream': 0,
+            'evictions': 0,
+        }
+        self._load()
+
+    def _paths(self, key: str):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{digest}.data", self.cache_dir / f"{digest}.json"
+
+    def _load(self):
+        """Rebuild the in-memory index from the metadata files left by a previous run"""
+        for meta_path in self.cache_dir.glob('*.json'):
+            data_path = meta_path.with_suffix('.data')
+            try:
+                with open(meta_path, 'r') as f:
+                    entry = _Entry(**json.load(f))
+            except (OSError, ValueError, TypeError):
+                entry = None
+            if entry is None or not data_path.exists():
+                meta_path.unlink(missing_ok=True)
+                data_path.unlink(missing_ok=True)
+                continue
+            self._entries[entry.key] = entry
+            self._bytes += entry.cached_bytes
+
+    def _save(self, entry: _Entry):
+        _, meta_path = self._paths(entry.key)
+        tmp_path = meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entry.to_dict(), f)
+        os.replace(tmp_path, meta_path)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+        if name in _OUTCOMES:
+            server_timing.record('segment-cache', desc=name)
+
+    def lookup(self, key: str):
+        """Return the entry for ``key`` (marking it as used), or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.hits += 1
+                entry.last_access = time.time()
+            return entry
+
+    def data_path(self, key: str) -> Path:
+        return self._paths(key)[0]
+
+    def begin(self, key: str, size: int, etag: str = None, last_modified: str = None) -> _Entry:
+        """Return the entry to fill for ``key``, starting over if the upstream object changed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.size == size and entry.etag == etag:
+                entry.validated_at = time.time()
+                return entry
+            if entry is not None:
+                self._remove(entry)
+            entry = self._entries[key] = _Entry(key, size, etag, last_modified)
+        data_path, _ = self._paths(key)
+        with open(data_path, 'wb') as f:
+            f.truncate(size)  # sparse until ranges are written
+        return entry
+
+    def write(self, entry: _Entry, offset: int, chunks) -> int:
+        """Write a fetched span at ``offset`` and record whatever was written in full"""
+        data_path, _ = self._paths(entry.key)
+        written = 0
+        try:
+            fd = os.open(data_path, os.O_WRONLY)
+        except FileNotFoundError:
+            return 0  # evicted while the fetch was in flight
+        try:
+            for chunk in chunks:
+                os.pwrite(fd, chunk, offset + written)
+                written += len(chunk)
+        finally:
+            os.close(fd)
+            if written:
+                with self._lock:
+                    if self._entries.get(entry.key) is entry:
+                        before = entry.cached_bytes
+                        entry.add(offset, offset + written)
+                        self._bytes += entry.cached_bytes - before
+                        self._save(entry)
+                        self._evict(keep=entry)
+                self.count('bytes_from_upstream', written)
+        return written
+
+    def expired(self, entry: _Entry) -> bool:
+        """Whether ``entry`` must be revalidated upstream before it is served again"""
+        return self.max_age > 0 and time.time() - entry.validated_at > self.max_age
+
+    def revalidated(self, entry: _Entry):
+        """Record that upstream confirmed ``entry`` is unchanged"""
+        with self._lock:
+            entry.validated_at = time.time()
+            self.counters['revalidations'] += 1
+            if self._entries.get(entry.key) is entry:
+                self._save(entry)
+
+    def discard(self, key: str) -> bool:
+        """Drop an object from the cache, e.g. when upstream reports it changed or it was re-uploaded"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove(entry)
+            return entry is not None
+
+    def _remove(self, entry: _Entry):
+        del self._entries[entry.key]
+        self._bytes -= entry.cached_bytes
+        for path in self._paths(entry.key):
+            path.unlink(missing_ok=True)
+
+    def _evict(self, keep: _Entry):
+        if self.policy == 'lfu':
+            rank = lambda entry: (entry.hits, entry.last_access)
+        else:
+            rank = lambda entry: entry.last_access
+        candidates = None
+        while self._bytes > self.max_bytes:
+            if candidates is None:
+                candidates = sorted((entry for entry in self._entries.values() if entry is not keep), key=rank)
+            if not candidates:
+                break
+            self._remove(candidates.pop(0))
+            self.counters['evictions'] += 1
+
+    def stats(self) -> dict:
+        """Return hit counters and current occupancy"""
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['partial_hits'] + self.counters['misses']
+            return dict(
+                self.counters,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                policy=self.policy,
+                hit_ratio=round(self.counters['hits'] / lookups, 4) if lookups else 0.0,
+            )
+
+
+def _iter_file(f, length: int, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Read exactly ``length`` bytes from the current position of ``f``"""
+    try:
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _disk_response(cache: SegmentCache, entry: _Entry, start: int, stop: int, status: int, content_type: str,
+                   environ):
+    """Serve [start, stop) of a cached object straight from disk.
+
+    When the span runs to the end of the file and the WSGI server provides
+    ``wsgi.file_wrapper`` (gunicorn), the body goes out with zero-copy ``sendfile``;
+    the wrapper reads to EOF, so shorter spans are read chunk by chunk instead.
+    Returns None if the object was evicted or discarded since it was looked up.
+    """
+    try:
+        f = open(cache.data_path(entry.key), 'rb')
+    except FileNotFoundError:
+        return None
+    f.seek(start)
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and stop == entry.size:
+        body = file_wrapper(f, STREAM_CHUNK_SIZE)
+    else:
+        body = _iter_file(f, stop - start)
+
+    headers = {'Content-Length': str(stop - start), 'Accept-Ranges': 'bytes'}
+    if status == 206:
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{entry.size}'
+    if entry.etag:
+        headers['ETag'] = entry.etag
+    if entry.last_modified:
+        headers['Last-Modified'] = entry.last_modified
+    cache.count('bytes_from_disk', stop - start)
+    return Response(body, status=status, headers=headers, content_type=content_type, direct_passthrough=True)
+
+
+def serve_segment(cache: SegmentCache, fetch, url: str, request, content_type: str, headers: dict = None) -> Response:
+    """Serve a (ranged) request for a large object through the segment cache.
+
+    Single-range GETs are filled span by span into the cache and then served from
+    disk; whole-object GETs are served from disk once the object is fully cached.
+    Revalidations of a cached object get a 304 without contacting upstream.
+    Everything else (multi-range, uncached full fetches, oversized ranges) is
+    relayed straight from upstream, validators included.
+    """
+    headers = dict(headers or {})
+    byte_range = parse_byte_range(request.headers)
+    entry = cache.lookup(url)
+    if entry is not None and cache.expired(entry):
+        expired = entry
+        entry, _ = cache.single_flight.do(('revalidate', url),
+                                          lambda: _revalidate(cache, fetch, url, expired, headers))
+
+    def from_disk(entry, start, stop, status):
+        response = _disk_response(cache, entry, start, stop, status, content_type, request.environ)
+        if response is None:  # evicted concurrently: fetch it like a miss
+            return proxy_ranged(fetch, url, request, content_type, headers)
+        return response
+
+    if entry is not None and not_modified(request.headers, entry.etag, entry.last_modified):
+        # Revalidation of a copy we hold: answered locally with headers only
+        cache.count('not_modified')
+        return not_modified_response(entry.etag, entry.last_modified)
+    if request.method == 'HEAD' and entry is not None:
+        response = Response((), headers={'Content-Length': str(entry.size), 'Accept-Ranges': 'bytes'},
+                            content_type=content_type)
+        if entry.etag:
+            response.headers['ETag'] = entry.etag
+        if entry.last_modified:
+            response.headers['Last-Modified'] = entry.last_modified
+        return response
+    if request.method == 'HEAD' or (byte_range is not None and len(byte_range.ranges) > 1):
+        return proxy_ranged(fetch, url, request, content_type, headers)
+
+    if entry is not None and not if_range_matches(request.headers.get('If-Range'),
+                                                   entry.etag, entry.last_modified):
+        byte_range = None  # the client's copy is stale: it gets the whole object
+
+    if byte_range is None:
+        if entry is not None and entry.complete:
+            cache.count('hits')
+            return from_disk(entry, 0, entry.size, 200)
+        cache.count('misses')
+        return proxy_ranged(fetch, url, request, content_type, headers)
+
+    if entry is None:
+        # First sight of this object: the upstream 206 tells us its size and validators
+        cache.count('misses')
+
+        def first_fill():
+            response = fetch('GET', url, dict(headers, **range_request_headers(request.headers)))
+            content_range = parse_content_range_header(response.headers.get('Content-Range'))
+            if (response.status_code != 206 or content_range is None or content_range.length is None
+                    or content_range.stop - content_range.start > cache.max_fill_bytes
+                    or 'Content-Encoding' in response.headers):
+                return response
+            new_entry = cache.begin(url, content_range.length, response.headers.get('ETag'),
+                                    response.headers.get('Last-Modified'))
+            if cache.write(new_entry, content_range.start, iter_upstream(response)) < content_range.stop - content_range.start:
+                return False
+            return content_range.start, content_range.stop
+
+        result, shared = cache.single_flight.do(('segment', url, request.headers['Range']), first_fill)
+        entry = cache.lookup(url)
+        if isinstance(result, tuple) and entry is not None:
+            if not_modified(request.headers, entry.etag, entry.last_modified):
+                cache.count('not_modified')
+                return not_modified_response(entry.etag, entry.last_modified)
+            return from_disk(entry, result[0], result[1], 206)
+        if not shared and not isinstance(result, (tuple, bool)):
+            # Not cacheable (error status, unknown size or oversized range): relay the leader's response
+            return relay_response(result, content_type, byte_range)
+        return proxy_ranged(fetch, url, request, content_type, headers)
+
+    span = resolve_span(*byte_range.ranges[0], entry.size)
+    if span is None:
+        return Response(b'', status=416, headers={'Content-Range': f'bytes */{entry.size}', 'Accept-Ranges': 'bytes'},
+                        content_type=content_type)
+    start, stop = span
+    missing = entry.missing(start, stop)
+    if sum(missing_stop - missing_start for missing_start, missing_stop in missing) > cache.max_fill_bytes:
+        cache.count('misses')
+        return proxy_ranged(fetch, url, request, content_type, headers)
+    cache.count('partial_hits' if missing else 'hits')
+
+    for missing_start, missing_stop in missing:
+        result, shared = cache.single_flight.do(
+            ('segment', url, missing_start, missing_stop),
+            lambda: _fill_span(cache, fetch, url, entry, missing_start, missing_stop, headers))
+        if result is True:
+            continue
+        if not shared and result is not False:
+            return relay_response(result, content_type, byte_range)
+        return proxy_ranged(fetch, url, request, content_type, headers)
+
+    return from_disk(entry, start, stop, 206)
+
+
+def _fill_span(cache: SegmentCache, fetch, url: str, entry: _Entry, start: int, stop: int, headers: dict):
+    """Fetch [start, stop) of a cached object from upstream; returns True once it is on disk.
+
+    If upstream no longer serves that range of the same object (or sends it
+    content-encoded, which the cache cannot serve back), the cached copy is dropped
+    and the upstream response is returned for the caller to relay. A 200 means our
+    If-Range failed because the object changed: that whole body is not what the
+    client asked for, so it is closed and False returned for a fresh fetch instead.
+    """
+    fill_headers = dict(headers, Range=f'bytes={start}-{stop - 1}')
+    if entry.etag:
+        fill_headers['If-Range'] = entry.etag
+    response = fetch('GET', url, fill_headers)
+    if response.status_code != 206 or 'Content-Encoding' in response.headers:
+        cache.discard(url)
+        if response.status_code == 200 and 'If-Range' in fill_headers:
+            response.close()
+            return False
+        return response
+    return cache.write(entry, start, iter_upstream(response)) == stop - start
+
+
+def unchanged(entry: _Entry, status: int, response_headers) -> bool:
+    """Whether a revalidation response (to a request carrying the entry's validators) confirms the cached copy"""
+    if status == 304:
+        return True
+    return (status == 200 and response_headers.get('ETag') == entry.etag
+            and response_headers.get('Content-Length') == str(entry.size))
+
+
+def _revalidate(cache: SegmentCache, fetch, url: str, entry: _Entry, headers: dict):
+    """Check an expired entry with an upstream HEAD; returns it if unchanged, otherwise drops it and returns None"""
+    check_headers = dict(headers)
+    if entry.etag:
+        check_headers['If-None-Match'] = entry.etag
+    elif entry.last_modified:
+        check_headers['If-Modified-Since'] = entry.last_modified
+    response = fetch('HEAD', url, check_headers)
+    response.close()
+    if unchanged(entry, response.status_code, response.headers):
+        cache.revalidated(entry)
+        return entry
+    cache.discard(url)
+    return None
@@ -0,0 +1,145 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+# The timings of the request being handled. Contextvars follow both the WSGI worker
+# thread and the asyncio task, so the upstream client and the caching layers can add
+# phases without every call passing a timing object along.
+_current = contextvars.ContextVar('server_timing', default=None)
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTiming:
+    """Phases of one request, sent back in a ``Server-Timing`` header.
+
+    Phases are recorded in the order they happen. ``header()`` only covers what
+    happened before the response headers went out. The transfer of a streamed body is
+    recorded afterwards, so it only appears in the sampled timing log.
+    """
+
+    __slots__ = ('started', 'phases', 'sampled')
+
+    def __init__(self, sample_rate: float = 0.0):
+        self.started = time.perf_counter()
+        self.phases = []  # (name, seconds or None, description or None)
+        self.sampled = sample_rate > 0 and random.random() < sample_rate
+
+    def add(self, name: str, seconds: float = None, desc: str = None):
+        self.phases.append((name, seconds, desc))
+
+    @contextmanager
+    def measure(self, name: str, desc: str = None):
+        """Record the wall-clock duration of a ``with`` block as one phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, desc)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self, total: float = None) -> str:
+        """Format the phases (plus ``total`` seconds, if given) as a Server-Timing value"""
+        entries = []
+        for name, seconds, desc in self.phases + ([('total', total, None)] if total is not None else []):
+            entry = name
+            if seconds is not None:
+                entry += f';dur={seconds * 1000:.2f}'
+            if desc:
+                entry += f';desc="{desc}"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+def current():
+    """The ServerTiming of the request being handled, or None outside a request"""
+    return _current.get()
+
+
+def record(name: str, seconds: float = None, desc: str = None):
+    """Add a phase to the current request's timings, if there is one"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, seconds, desc)
+
+
+@contextmanager
+def measure(name: str, desc: str = None):
+    """Time a ``with`` block as a phase of the current request (a no-op outside a request)"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    with timing.measure(name, desc):
+        yield
+
+
+def begin(sample_rate: float = 0.0) -> ServerTiming:
+    """Start collecting timings for the request being handled"""
+    timing = ServerTiming(sample_rate)
+    _current.set(timing)
+    return timing
+
+
+def log_sample(timing: ServerTiming, method: str, path: str, status):
+    """Log the full timing breakdown of a sampled request once its body has been sent"""
+    if timing.sampled:
+        # Already sampled at SERVER_TIMING_LOG_SAMPLE_RATE, so the route's log sampling is skipped
+        header = timing.header(timing.elapsed())
+        logger.info(f"timing {method} {path} {status} {header}",
+                    extra={'sampled': True, 'method': method, 'status': status, 'server_timing': header})
+
+
+def instrument_flask(app, sample_rate: float = 0.0):
+    """Send a Server-Timing header on every response of a Flask app"""
+    from flask import request
+
+    @app.before_request
+    def start_timing():
+        begin(sample_rate)
+
+    @app.after_request
+    def add_server_timing(response):
+        timing = current()
+        if timing is None:
+            return response
+        response.headers['Server-Timing'] = timing.header(timing.elapsed())
+        response.headers['Timing-Allow-Origin'] = '*'
+        if timing.sampled:
+            method, path, status = request.method, request.path, response.status_code
+            response.call_on_close(lambda: log_sample(timing, method, path, status))
+        return response
+
+    return app
+
+
+class ASGIServerTimingMiddleware:
+    """ASGI counterpart of ``instrument_flask``"""
+
+    def __init__(self, app, sample_rate: float = 0.0):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        timing = begin(self.sample_rate)
+        state = {'status': ''}
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'server-timing', timing.header(timing.elapsed()).encode('latin-1')),
+                    (b'timing-allow-origin', b'*'),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            log_sample(timing, scope.get('method', ''), scope.get('path', ''), state['status'])
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+
+class _Call:
+    """One in-flight call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution.
+
+    The first caller for a key runs the function; callers arriving while it is in
+    flight wait and receive the same result (or exception). Keys are tuples whose
+    first element names the kind of fetch (``'playlist'``, ``'key'``, ...), which is
+    what the counters are grouped by.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {}  # kind -> {'executed': n, 'collapsed': n}
+
+    def do(self, key: tuple, fn):
+        """Run ``fn()`` for ``key`` unless an identical call is already in flight.
+
+        Returns ``(result, shared)``; ``shared`` is True for callers that received the
+        result of another caller's execution.
+        """
+        with self._lock:
+            counters = self._counters.setdefault(key[0], {'executed': 0, 'collapsed': 0})
+            call = self._calls.get(key)
+            if call is not None:
+                counters['collapsed'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                counters['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        """Return executed/collapsed counts per kind of fetch"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'kinds': {kind: dict(counters) for kind, counters in self._counters.items()},
+                'collapsed': sum(counters['collapsed'] for counters in self._counters.values()),
+            }
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutine fetches on one event loop.
+
+    The shared fetch runs as its own task, so a caller cancelled mid-wait (its client
+    disconnected) neither cancels the fetch nor fails the other callers.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._counters = {}
+
+    async def do(self, key: tuple, fn):
+        """Await ``fn()`` for ``key`` unless an identical call is already in flight; returns ``(result, shared)``"""
+        counters = self._counters.setdefault(key[0], {'executed': 0, 'collapsed': 0})
+        task = self._calls.get(key)
+        if task is not None:
+            counters['collapsed'] += 1
+            return await asyncio.shield(task), True
+
+        task = self._calls[key] = asyncio.ensure_future(fn())
+        counters['executed'] += 1
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), False
+
+    def _finished(self, key: tuple, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved so a fetch whose callers all left doesn't log "never retrieved"
+
+    def stats(self) -> dict:
+        """Return executed/collapsed counts per kind of fetch"""
+        return {
+            'in_flight': len(self._calls),
+            'kinds': {kind: dict(counters) for kind, counters in self._counters.items()},
+            'collapsed': sum(counters['collapsed'] for counters in self._counters.values()),
+        }
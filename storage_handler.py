@@ -1,8 +1,13 @@
 import boto3
 from botocore.client import Config
 from pathlib import Path
+import logging
 import os
 
+from metrics import instrument_boto3_client
+
+logger = logging.getLogger(__name__)
+
 class LeasewebStorageHandler:
     def __init__(self, control_config, cdn_config):
         # Initialize control bucket client
@@ -14,6 +19,7 @@ class LeasewebStorageHandler:
             region_name=control_config['region'],
             config=Config(signature_version='s3v4')
         )
+        instrument_boto3_client(self.control_session)
         self.control_bucket = control_config['bucket_name']
 
         # Initialize CDN bucket client
@@ -25,6 +31,7 @@ class LeasewebStorageHandler:
             region_name=cdn_config['region'],
             config=Config(signature_version='s3v4')
         )
+        instrument_boto3_client(self.cdn_session)
         self.cdn_bucket = cdn_config['bucket_name']
 
     def check_connection(self):
@@ -32,37 +39,37 @@ class LeasewebStorageHandler:
         try:
             # Check control bucket
             self.control_session.head_bucket(Bucket=self.control_bucket)
-            print("Successfully connected to Control Storage!")
+            logger.info("Successfully connected to Control Storage!")
 
             # Check CDN bucket
             self.cdn_session.head_bucket(Bucket=self.cdn_bucket)
-            print("Successfully connected to CDN Storage!")
+            logger.info("Successfully connected to CDN Storage!")
             
             return True
         except Exception as e:
-            print(f"Failed to connect to storage: {str(e)}")
+            logger.error(f"Failed to connect to storage: {str(e)}")
             return False
 
     def upload_control_file(self, local_path: str, object_key: str) -> bool:
         """Upload control files (m3u8, key) to control bucket"""
         try:
-            print(f"Uploading control file {local_path} to {object_key}...")
+            logger.info(f"Uploading control file {local_path} to {object_key}...")
             self.control_session.upload_file(local_path, self.control_bucket, object_key)
-            print(f"Successfully uploaded control file {object_key}")
+            logger.info(f"Successfully uploaded control file {object_key}")
             return True
         except Exception as e:
-            print(f"Failed to upload control file {object_key}: {str(e)}")
+            logger.error(f"Failed to upload control file {object_key}: {str(e)}")
             return False
 
     def upload_segment_file(self, local_path: str, object_key: str) -> bool:
         """Upload segment files to CDN bucket"""
         try:
-            print(f"Uploading media file {local_path} to {object_key}...")
+            logger.info(f"Uploading media file {local_path} to {object_key}...")
             self.cdn_session.upload_file(local_path, self.cdn_bucket, object_key)
-            print(f"Successfully uploaded media file {object_key}")
+            logger.info(f"Successfully uploaded media file {object_key}")
             return True
         except Exception as e:
-            print(f"Failed to upload media file {object_key}: {str(e)}")
+            logger.error(f"Failed to upload media file {object_key}: {str(e)}")
             return False
 
     def upload_video_files(self, video_dir: Path, video_name: str, key_filename: str) -> bool:
@@ -80,7 +87,7 @@ class LeasewebStorageHandler:
                     if not self.upload_control_file(str(local_file), object_key):
                         return False
                 else:
-                    print(f"Warning: Control file {local_file} does not exist, skipping upload")
+                    logger.warning(f"Warning: Control file {local_file} does not exist, skipping upload")
 
             # 2. Upload media files to CDN bucket
             # First check for the video_name.ts file
@@ -95,7 +102,7 @@ class LeasewebStorageHandler:
                     if ts_files:
                         ts_file = ts_files[0]
                     else:
-                        print(f"Error: No .ts files found for {video_name}")
+                        logger.error(f"Error: No .ts files found for {video_name}")
                         return False
             
             # Upload the TS file
@@ -103,11 +110,11 @@ class LeasewebStorageHandler:
             if not self.upload_segment_file(str(ts_file), object_key):
                 return False
 
-            print(f"Successfully uploaded all files for {video_name}")
+            logger.info(f"Successfully uploaded all files for {video_name}")
             return True
 
         except Exception as e:
-            print(f"Error uploading video files for {video_name}: {str(e)}")
+            logger.error(f"Error uploading video files for {video_name}: {str(e)}")
             return False
 
     def generate_presigned_url(self, object_key: str, expiration: int = 3600) -> str:
@@ -123,5 +130,5 @@ class LeasewebStorageHandler:
             )
             return url
         except Exception as e:
-            print(f"Error generating presigned URL: {str(e)}")
+            logger.error(f"Error generating presigned URL: {str(e)}")
             return None 
\ No newline at end of file
@@ -0,0 +1,90 @@
+import io
+import os
+
+import pytest
+import requests
+from flask import Flask
+from urllib3.response import HTTPResponse
+
+# config.py refuses to load without storage credentials; none of the tests talk to storage
+os.environ.setdefault('LEASEWEB_ACCESS_KEY', 'test-access-key')
+os.environ.setdefault('LEASEWEB_SECRET_KEY', 'test-secret-key')
+
+
+def upstream_response(status: int = 200, body: bytes = b'', headers: dict = None, method: str = 'GET',
+                      request_headers: dict = None) -> requests.Response:
+    """A streamed ``requests`` response as UpstreamClient returns it, without a network"""
+    response = requests.Response()
+    response.status_code = status
+    response.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    response.raw = HTTPResponse(body=io.BytesIO(body), preload_content=False, status=status)
+    response.request = requests.Request(method, 'https://cdn.example/video.ts', headers=request_headers).prepare()
+    return response
+
+
+TS_PACKET_SIZE = 188
+PMT_PID = 0x1000
+VIDEO_PID = 0x100
+AUDIO_PID = 0x101
+
+
+def ts_packet(pid: int, payload: bytes = b'', start: bool = False, random_access: bool = False) -> bytes:
+    """One TS packet, padded out to 188 bytes with adaptation field stuffing"""
+    room = TS_PACKET_SIZE - 4 - len(payload)
+    assert room >= (2 if random_access else 0)
+    header = bytes([0x47, (0x40 if start else 0) | pid >> 8, pid & 0xff])
+    if not room:
+        return header + b'\x10' + payload
+    adaptation = b'' if room == 1 else bytes([0x40 if random_access else 0]) + b'\xff' * (room - 2)
+    return header + b'\x30' + bytes([room - 1]) + adaptation + payload
+
+
+def psi_packets() -> bytes:
+    """A PAT announcing one program on ``PMT_PID``, followed by that (minimal) PMT"""
+    pat = bytes([0, 0x00, 0xb0, 13, 0, 1, 0xc1, 0, 0, 0, 1, 0xe0 | PMT_PID >> 8, PMT_PID & 0xff]) + b'\0' * 4
+    pmt = bytes([0, 0x02, 0xb0, 13, 0, 1, 0xc1, 0, 0, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0]) + b'\0' * 4
+    return ts_packet(0, pat, start=True) + ts_packet(PMT_PID, pmt, start=True)
+
+
+def pes_packets(pid: int, packets: int, pts: float = None, random_access: bool = False) -> bytes:
+    """A PES (video on ``VIDEO_PID``, else audio) spread over ``packets`` TS packets"""
+    stream_id = 0xe0 if pid == VIDEO_PID else 0xc0
+    header = bytes([0, 0, 1, stream_id, 0, 0, 0x80])
+    if pts is None:
+        header += bytes([0x00, 0])
+    else:
+        ticks = round(pts * 90000)
+        header += bytes([0x80, 5, 0x21 | (ticks >> 29) & 0x0e, ticks >> 22 & 0xff, (ticks >> 14) & 0xfe | 1,
+                         ticks >> 7 & 0xff, (ticks << 1) & 0xfe | 1])
+    first = ts_packet(pid, header + b'\xaa' * 64, start=True, random_access=random_access)
+    return first + b''.join(ts_packet(pid, b'\xbb' * 184) for _ in range(packets - 1))
+
+
+class FakeUpstream:
+    """``fetch(method, url, headers)`` serving byte ranges of one object and recording each request"""
+
+    def __init__(self, data: bytes, etag: str = '"v1"', last_modified: str = 'Mon, 05 Oct 2026 10:00:00 GMT'):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+
+    def __call__(self, method, url, headers):
+        self.requests.append((method, dict(headers)))
+        validators = {'ETag': self.etag, 'Last-Modified': self.last_modified, 'Accept-Ranges': 'bytes'}
+        if headers.get('If-None-Match') == self.etag:
+            return upstream_response(304, b'', validators, method, headers)
+        body, status = self.data, 200
+        range_header = headers.get('Range')
+        if range_header and headers.get('If-Range', self.etag) == self.etag:
+            first, _, last = range_header[len('bytes='):].partition('-')
+            start, stop = int(first), min(int(last) + 1 if last else len(self.data), len(self.data))
+            body, status = self.data[start:stop], 206
+            validators['Content-Range'] = f'bytes {start}-{stop - 1}/{len(self.data)}'
+        validators['Content-Length'] = str(len(body))
+        return upstream_response(status, b'' if method == 'HEAD' else body, validators, method, headers)
+
+
+@pytest.fixture
+def flask_app():
+    return Flask(__name__)
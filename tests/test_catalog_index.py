@@ -0,0 +1,67 @@
+import pytest
+
+from catalog_index import CatalogIndex, decode_cursor, display_name
+
+
+@pytest.fixture
+def index(tmp_path):
+    return CatalogIndex(tmp_path / 'catalog.db')
+
+
+def ids(videos) -> list:
+    return [video['id'] for video in videos]
+
+
+def test_display_name_titles_the_file_stem():
+    assert display_name('top_gun-maverick') == 'Top Gun Maverick'
+
+
+def test_backfill_only_adds_unknown_videos(index):
+    index.upsert('android', name='Android Demo', duration=12.5)
+    assert index.backfill(['android', 'maverick']) == 1
+    assert index.get('android')['name'] == 'Android Demo'
+    assert index.get('android')['duration'] == 12.5
+    assert index.get('maverick')['name'] == 'Maverick'
+    assert index.backfill(['android', 'maverick']) == 0
+
+
+def test_prune_deletes_videos_missing_from_a_full_listing(index):
+    index.backfill(['a', 'b', 'c'])
+    assert index.prune(['b', 'c', 'd']) == 1
+    assert index.get('a') is None
+    assert index.count() == 2
+    assert index.prune(['b', 'c']) == 0  # the listing is not remembered between calls
+
+
+def test_page_orders_by_title_and_follows_cursors(index):
+    for video_id in ('delta', 'alpha', 'Charlie', 'bravo', 'echo'):
+        index.backfill([video_id])
+    videos, cursor = index.page(limit=2)
+    assert ids(videos) == ['alpha', 'bravo']
+    videos, cursor = index.page(cursor=cursor, limit=2)
+    assert ids(videos) == ['Charlie', 'delta']
+    videos, cursor = index.page(cursor=cursor, limit=2)
+    assert ids(videos) == ['echo']
+    assert cursor is None
+
+
+def test_page_prefix_search_is_case_insensitive(index):
+    index.backfill(['maverick', 'Matrix', 'android'])
+    videos, cursor = index.page(prefix='MA')
+    assert ids(videos) == ['Matrix', 'maverick']
+    assert cursor is None
+
+
+def test_equal_titles_are_paged_by_id(index):
+    index.upsert('b', name='Same')
+    index.upsert('a', name='Same')
+    first, cursor = index.page(limit=1)
+    second, _ = index.page(cursor=cursor, limit=1)
+    assert ids(first + second) == ['a', 'b']
+
+
+def test_malformed_cursor_raises_value_error(index):
+    with pytest.raises(ValueError):
+        index.page(cursor='not-a-cursor')
+    with pytest.raises(ValueError):
+        decode_cursor('bm90IGpzb24=')
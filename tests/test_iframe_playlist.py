@@ -0,0 +1,125 @@
+import re
+
+import pytest
+
+import generatePerFolder
+from generatePerFolder import VideoProcessor, _key_iv, _with_iv
+from ts_scanner import PACKET_BLOCK_ALIGNMENT, scan_keyframes
+
+from conftest import AUDIO_PID, VIDEO_PID, pes_packets, psi_packets
+
+KEY = bytes(range(16))
+KEY_LINE = '#EXT-X-KEY:METHOD=AES-128,URI="https://cdn.example/key.key"'
+SEGMENT_IV = bytes(range(0xa0, 0xb0))
+
+
+def gop(pts: float, frame_packets: int) -> bytes:
+    """PAT, PMT, a 3-packet keyframe, an audio packet and a second video frame"""
+    return (psi_packets() + pes_packets(VIDEO_PID, 3, pts=pts, random_access=True) + pes_packets(AUDIO_PID, 1, pts=pts)
+            + pes_packets(VIDEO_PID, frame_packets, pts=pts + 0.04))
+
+
+# Two 2-second segments; GOP sizes keep most keyframes off the 752-byte packet/block grid
+SEGMENTS = [gop(0.0, 3) + gop(1.0, 5), gop(2.0, 4) + gop(3.0, 3) + gop(3.5, 2)]
+KEYFRAME_PTS = [0.0, 1.0, 2.0, 3.0, 3.5]
+DURATIONS = [1.0, 1.0, 1.0, 0.5, 0.5]
+
+
+def aes(data: bytes, iv: bytes, decrypt: bool = False) -> bytes:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    cipher = Cipher(algorithms.AES(KEY), modes.CBC(iv))
+    if decrypt:
+        decryptor, unpadder = cipher.decryptor(), padding.PKCS7(128).unpadder()
+        return unpadder.update(decryptor.update(data) + decryptor.finalize()) + unpadder.finalize()
+    encryptor, padder = cipher.encryptor(), padding.PKCS7(128).padder()
+    return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+
+def write_stream(video_dir, segments, key_lines) -> list:
+    """Write video.ts and a byte-range stream.m3u8 for it, returning each segment's byte offset"""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:4', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0',
+             '#EXT-X-PLAYLIST-TYPE:VOD']
+    offsets, offset = [], 0
+    for segment, key_line in zip(segments, key_lines):
+        if key_line:
+            lines.append(key_line)
+        # The first byte range carries its offset, the second continues right after it
+        lines += ['#EXTINF:2.000000,', f'#EXT-X-BYTERANGE:{len(segment)}' + ('' if offsets else '@0'), 'video.ts']
+        offsets.append(offset)
+        offset += len(segment)
+    lines.append('#EXT-X-ENDLIST')
+    (video_dir / 'stream.m3u8').write_text('\n'.join(lines) + '\n')
+    (video_dir / 'video.ts').write_bytes(b''.join(segments))
+    return offsets
+
+
+def iframe_entries(video_dir) -> list:
+    """(EXT-X-KEY line, duration, byte length, byte offset) of every iframe.m3u8 entry"""
+    lines = (video_dir / 'iframe.m3u8').read_text().splitlines()
+    assert '#EXT-X-I-FRAMES-ONLY' in lines
+    entries, key_line = [], None
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-KEY'):
+            key_line = line
+        elif line.startswith('#EXTINF:'):
+            length, offset = lines[i + 1][len('#EXT-X-BYTERANGE:'):].split('@')
+            entries.append((key_line, float(line[len('#EXTINF:'):].rstrip(',')), int(length), int(offset)))
+    return entries
+
+
+def test_key_iv_defaults_to_the_media_sequence_number():
+    assert _key_iv(KEY_LINE, 5) == (5).to_bytes(16, 'big')
+    assert _key_iv(KEY_LINE + ',IV=0x1f', 5) == b'\x00' * 15 + b'\x1f'
+    assert _key_iv(KEY_LINE + ',IV=0X' + SEGMENT_IV.hex(), 5) == SEGMENT_IV
+
+
+def test_with_iv_replaces_an_existing_iv():
+    assert _with_iv(KEY_LINE, SEGMENT_IV) == f'{KEY_LINE},IV=0x{SEGMENT_IV.hex()}'
+    assert _with_iv(KEY_LINE + ',IV=0x01', SEGMENT_IV) == f'{KEY_LINE},IV=0x{SEGMENT_IV.hex()}'
+
+
+def test_plain_segments_get_one_entry_per_keyframe(tmp_path):
+    offsets = write_stream(tmp_path, SEGMENTS, [None, None])
+    VideoProcessor(tmp_path, tmp_path, None)._create_iframe_playlist(tmp_path, tmp_path / 'video.ts', KEY)
+    entries = iframe_entries(tmp_path)
+    expected = [kf._replace(offset=kf.offset + segment_offset)
+                for segment, segment_offset in zip(SEGMENTS, offsets) for kf in scan_keyframes(segment)]
+    assert [(length, offset) for _, _, length, offset in entries] == [(kf.size, kf.offset) for kf in expected]
+    assert [duration for _, duration, _, _ in entries] == pytest.approx(DURATIONS)
+    assert all(key_line is None for key_line, _, _, _ in entries)
+
+
+def test_encrypted_entries_decrypt_with_their_own_iv(tmp_path):
+    pytest.importorskip('cryptography')
+    # The first segment's IV is its media sequence number (0), the second one has an explicit IV
+    ciphertexts = [aes(SEGMENTS[0], bytes(16)), aes(SEGMENTS[1], SEGMENT_IV)]
+    offsets = write_stream(tmp_path, ciphertexts, [KEY_LINE, _with_iv(KEY_LINE, SEGMENT_IV)])
+    VideoProcessor(tmp_path, tmp_path, None)._create_iframe_playlist(tmp_path, tmp_path / 'video.ts', KEY)
+
+    data = (tmp_path / 'video.ts').read_bytes()
+    entries = iframe_entries(tmp_path)
+    assert len(entries) == len(KEYFRAME_PTS)
+    assert [duration for _, duration, _, _ in entries] == pytest.approx(DURATIONS)
+    for (key_line, _, length, offset), pts in zip(entries, KEYFRAME_PTS):
+        segment = max(i for i, segment_offset in enumerate(offsets) if segment_offset <= offset)
+        # Entries start on a packet and AES block boundary and run to the end of their segment
+        assert (offset - offsets[segment]) % PACKET_BLOCK_ALIGNMENT == 0
+        assert offset + length == offsets[segment] + len(ciphertexts[segment])
+        iv = bytes.fromhex(re.search(r'IV=0x([0-9a-f]{32})$', key_line).group(1))
+        plaintext = aes(data[offset:offset + length], iv, decrypt=True)
+        assert plaintext == SEGMENTS[segment][len(SEGMENTS[segment]) - len(plaintext):]
+        assert plaintext[0] == 0x47
+        assert scan_keyframes(plaintext)[0].pts == pytest.approx(pts)
+
+
+def test_encrypted_segments_without_cryptography_get_one_entry_each(tmp_path, monkeypatch):
+    monkeypatch.setattr(generatePerFolder, 'can_decrypt', lambda: False)
+    offsets = write_stream(tmp_path, SEGMENTS, [KEY_LINE, None])
+    VideoProcessor(tmp_path, tmp_path, None)._create_iframe_playlist(tmp_path, tmp_path / 'video.ts', KEY)
+    entries = iframe_entries(tmp_path)
+    assert [(length, offset) for _, _, length, offset in entries] == [
+        (len(segment), offset) for segment, offset in zip(SEGMENTS, offsets)]
+    assert [key_line for key_line, _, _, _ in entries] == [
+        _with_iv(KEY_LINE, bytes(16)), _with_iv(KEY_LINE, (1).to_bytes(16, 'big'))]
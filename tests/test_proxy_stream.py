@@ -0,0 +1,94 @@
+from flask import request
+from werkzeug.datastructures import Headers
+
+from proxy_stream import (if_range_matches, not_modified, parse_byte_range, proxy_ranged, relay_response,
+                          resolve_span)
+
+from conftest import FakeUpstream, upstream_response
+
+LAST_MODIFIED = 'Mon, 05 Oct 2026 10:00:00 GMT'
+
+
+def body_of(response) -> bytes:
+    return b''.join(response.response)
+
+
+def test_resolve_span_handles_open_suffix_and_unsatisfiable_ranges():
+    assert resolve_span(*parse_byte_range(Headers({'Range': 'bytes=10-'})).ranges[0], 100) == (10, 100)
+    assert resolve_span(*parse_byte_range(Headers({'Range': 'bytes=-30'})).ranges[0], 100) == (70, 100)
+    assert resolve_span(*parse_byte_range(Headers({'Range': 'bytes=90-200'})).ranges[0], 100) == (90, 100)
+    assert resolve_span(*parse_byte_range(Headers({'Range': 'bytes=100-'})).ranges[0], 100) is None
+
+
+def test_parse_byte_range_ignores_other_units():
+    assert parse_byte_range(Headers({'Range': 'items=0-5'})) is None
+    assert parse_byte_range(Headers()) is None
+
+
+def test_if_range_matches_strong_etag_or_exact_date_only():
+    assert if_range_matches(None, '"v1"', LAST_MODIFIED)
+    assert if_range_matches('"v1"', '"v1"', LAST_MODIFIED)
+    assert not if_range_matches('"v0"', '"v1"', LAST_MODIFIED)
+    assert not if_range_matches('W/"v1"', 'W/"v1"', LAST_MODIFIED)
+    assert if_range_matches(LAST_MODIFIED, '"v1"', LAST_MODIFIED)
+    assert not if_range_matches('Sun, 04 Oct 2026 10:00:00 GMT', '"v1"', LAST_MODIFIED)
+
+
+def test_not_modified_prefers_if_none_match_over_if_modified_since():
+    assert not_modified(Headers({'If-None-Match': 'W/"v1"'}), '"v1"', LAST_MODIFIED)
+    assert not_modified(Headers({'If-None-Match': '"v0", "v1"'}), '"v1"', LAST_MODIFIED)
+    assert not not_modified(Headers({'If-None-Match': '"v0"', 'If-Modified-Since': LAST_MODIFIED}),
+                            '"v1"', LAST_MODIFIED)
+    assert not_modified(Headers({'If-Modified-Since': LAST_MODIFIED}), None, LAST_MODIFIED)
+    assert not not_modified(Headers({'If-Modified-Since': 'Sun, 04 Oct 2026 10:00:00 GMT'}), None, LAST_MODIFIED)
+
+
+def test_relay_response_cuts_a_single_range_out_of_a_full_upstream_body():
+    data = bytes(range(200))
+    upstream = upstream_response(200, data, {'Content-Length': str(len(data)), 'ETag': '"v1"'})
+    response = relay_response(upstream, 'video/mp2t', parse_byte_range(Headers({'Range': 'bytes=10-19'})))
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 10-19/200'
+    assert response.headers['Content-Length'] == '10'
+    assert body_of(response) == data[10:20]
+
+
+def test_relay_response_keeps_a_full_body_when_if_range_was_sent_upstream():
+    data = b'x' * 50
+    upstream = upstream_response(200, data, {'Content-Length': '50'}, request_headers={'If-Range': '"v0"'})
+    response = relay_response(upstream, 'video/mp2t', parse_byte_range(Headers({'Range': 'bytes=0-9'})))
+    assert response.status_code == 200
+    assert body_of(response) == data
+
+
+def test_relay_response_answers_an_unsatisfiable_range_with_416():
+    upstream = upstream_response(200, b'x' * 50, {'Content-Length': '50'})
+    response = relay_response(upstream, 'video/mp2t', parse_byte_range(Headers({'Range': 'bytes=60-70'})))
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */50'
+
+
+def test_relay_response_passes_encoded_bodies_through_with_their_length():
+    encoded = b'\x1f\x8b compressed bytes'
+    upstream = upstream_response(200, encoded, {'Content-Length': str(len(encoded)), 'Content-Encoding': 'gzip'})
+    response = relay_response(upstream, 'video/mp2t')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert body_of(response) == encoded
+
+
+def test_proxy_ranged_forwards_range_and_validators(flask_app):
+    upstream = FakeUpstream(bytes(range(100)))
+    with flask_app.test_request_context(headers={'Range': 'bytes=5-9', 'If-Range': '"v1"'}):
+        response = proxy_ranged(upstream, 'https://cdn.example/video.ts', request, 'video/mp2t')
+    assert upstream.requests == [('GET', {'Range': 'bytes=5-9', 'If-Range': '"v1"'})]
+    assert response.status_code == 206
+    assert body_of(response) == bytes(range(5, 10))
+
+
+def test_proxy_ranged_relays_an_upstream_304(flask_app):
+    upstream = FakeUpstream(b'data')
+    with flask_app.test_request_context(headers={'If-None-Match': '"v1"'}):
+        response = proxy_ranged(upstream, 'https://cdn.example/video.ts', request, 'video/mp2t')
+    assert upstream.requests[0][1]['If-None-Match'] == '"v1"'
+    assert response.status_code == 304
+    assert response.headers['ETag'] == '"v1"'
@@ -0,0 +1,154 @@
+import time
+from wsgiref.util import FileWrapper
+
+import pytest
+from flask import request
+
+from segment_cache import SegmentCache, _Entry, serve_segment
+
+from conftest import FakeUpstream
+
+URL = 'https://cdn.example/Example_folder_for_TS/video/video.ts'
+DATA = bytes(range(256)) * 64  # 16 KiB
+
+
+def body_of(response) -> bytes:
+    try:
+        return b''.join(response.response)
+    finally:
+        response.close()
+
+
+def serve(cache, upstream, flask_app, headers=None, environ=None):
+    with flask_app.test_request_context(headers=headers or {}, environ_base=environ):
+        return serve_segment(cache, upstream, URL, request, 'video/mp2t')
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SegmentCache(tmp_path, max_bytes=len(DATA) * 4)
+
+
+def test_entry_tracks_missing_spans_and_merges_ranges():
+    entry = _Entry('key', 100)
+    entry.add(10, 20)
+    entry.add(30, 40)
+    assert entry.missing(0, 50) == [(0, 10), (20, 30), (40, 50)]
+    entry.add(20, 30)
+    assert entry.ranges == [[10, 40]]
+    assert entry.missing(15, 35) == []
+    entry.add(0, 100)
+    assert entry.complete
+
+
+def test_first_range_request_fills_the_cache_and_repeats_are_served_from_disk(cache, flask_app):
+    upstream = FakeUpstream(DATA)
+    response = serve(cache, upstream, flask_app, {'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert body_of(response) == DATA[100:200]
+
+    response = serve(cache, upstream, flask_app, {'Range': 'bytes=120-149'})
+    assert body_of(response) == DATA[120:150]
+    assert len(upstream.requests) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_partial_hit_only_fetches_the_missing_span(cache, flask_app):
+    upstream = FakeUpstream(DATA)
+    body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'}))
+    response = serve(cache, upstream, flask_app, {'Range': 'bytes=50-299'})
+    assert body_of(response) == DATA[50:300]
+    method, headers = upstream.requests[-1]
+    assert headers['Range'] == 'bytes=100-299'
+    assert headers['If-Range'] == '"v1"'
+    assert cache.lookup(URL).ranges == [[0, 300]]
+
+
+def test_revalidation_of_a_cached_object_is_answered_locally(cache, flask_app):
+    upstream = FakeUpstream(DATA)
+    body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-9'}))
+    response = serve(cache, upstream, flask_app, {'If-None-Match': '"v1"'})
+    assert response.status_code == 304
+    assert len(upstream.requests) == 1
+
+
+def test_object_changed_upstream_is_dropped_and_relayed(cache, flask_app):
+    upstream = FakeUpstream(DATA)
+    body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'}))
+    upstream.etag, upstream.data = '"v2"', DATA[::-1]
+    response = serve(cache, upstream, flask_app, {'Range': 'bytes=0-199'})
+    # The If-Range fill got a 200 for the new object; the client still gets just the range it asked for
+    assert body_of(response) == DATA[::-1][:200]
+    assert cache.lookup(URL) is None
+
+
+def test_cached_bytes_survive_a_restart(tmp_path, flask_app):
+    upstream = FakeUpstream(DATA)
+    body_of(serve(SegmentCache(tmp_path), upstream, flask_app, {'Range': 'bytes=0-99'}))
+    reloaded = SegmentCache(tmp_path)
+    assert reloaded.lookup(URL).ranges == [[0, 100]]
+    assert body_of(serve(reloaded, upstream, flask_app, {'Range': 'bytes=10-19'})) == DATA[10:20]
+    assert len(upstream.requests) == 1
+
+
+@pytest.mark.parametrize('policy, kept', [('lru', 'a'), ('lfu', 'b')])
+def test_eviction_policy(tmp_path, policy, kept):
+    cache = SegmentCache(tmp_path, max_bytes=200, policy=policy)
+    for key in ('a', 'b'):
+        cache.write(cache.begin(key, 100), 0, [b'x' * 100])
+    for _ in range(3):
+        cache.lookup('b')  # b: used more often
+    time.sleep(0.01)
+    cache.lookup('a')  # a: used most recently
+    cache.write(cache.begin('c', 100), 0, [b'x' * 100])
+    assert cache.lookup(kept) is not None
+    assert cache.lookup({'a': 'b', 'b': 'a'}[kept]) is None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 200
+
+
+def test_evicted_data_file_falls_back_to_upstream(cache, flask_app):
+    upstream = FakeUpstream(DATA)
+    body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'}))
+    cache.data_path(URL).unlink()
+    response = serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'})
+    assert body_of(response) == DATA[:100]
+    assert len(upstream.requests) == 2
+
+
+def test_file_wrapper_is_only_used_for_spans_ending_at_eof(cache, flask_app):
+    upstream = FakeUpstream(DATA)
+    environ = {'wsgi.file_wrapper': FileWrapper}
+    body_of(serve(cache, upstream, flask_app, {'Range': f'bytes=0-{len(DATA) - 1}'}, environ))
+
+    response = serve(cache, upstream, flask_app, {'Range': 'bytes=100-199'}, environ)
+    assert not isinstance(response.response, FileWrapper)
+    assert body_of(response) == DATA[100:200]
+
+    response = serve(cache, upstream, flask_app, {'Range': f'bytes={len(DATA) - 100}-'}, environ)
+    assert isinstance(response.response, FileWrapper)
+    assert body_of(response) == DATA[-100:]
+
+
+def test_expired_entries_are_revalidated_before_use(tmp_path, flask_app):
+    cache = SegmentCache(tmp_path, max_age=60)
+    upstream = FakeUpstream(DATA)
+    body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'}))
+    cache.lookup(URL).validated_at -= 120
+
+    assert body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'})) == DATA[:100]
+    assert upstream.requests[-1] == ('HEAD', {'If-None-Match': '"v1"'})
+    assert not cache.expired(cache.lookup(URL))
+
+    cache.lookup(URL).validated_at -= 120
+    upstream.etag = '"v2"'
+    body_of(serve(cache, upstream, flask_app, {'Range': 'bytes=0-99'}))
+    assert cache.lookup(URL).etag == '"v2"'  # the changed object was dropped and filled again
+
+
+def test_discard_reports_whether_anything_was_cached(cache):
+    cache.write(cache.begin(URL, 10), 0, [b'x' * 10])
+    assert cache.discard(URL)
+    assert not cache.discard(URL)
+    assert not cache.data_path(URL).exists()
@@ -0,0 +1,72 @@
+import pytest
+
+from ts_scanner import TS_PACKET_SIZE, Keyframe, TsScanError, can_decrypt, decrypt_segment, scan_keyframes
+
+from conftest import AUDIO_PID, VIDEO_PID, pes_packets, psi_packets, ts_packet
+
+# PAT, PMT, keyframe (3 packets), audio, frame (2 packets), PAT, PMT, keyframe (2 packets), audio
+STREAM = (psi_packets() + pes_packets(VIDEO_PID, 3, pts=10.0, random_access=True) + pes_packets(AUDIO_PID, 1, pts=10.0)
+          + pes_packets(VIDEO_PID, 2, pts=10.04)
+          + psi_packets() + pes_packets(VIDEO_PID, 2, pts=12.0, random_access=True) + pes_packets(AUDIO_PID, 1))
+
+
+def at(packets: int) -> int:
+    return packets * TS_PACKET_SIZE
+
+
+def test_keyframes_include_psi_and_run_to_the_next_video_frame():
+    assert scan_keyframes(STREAM) == [Keyframe(0, at(6), 10.0), Keyframe(at(8), at(5), 12.0)]
+
+
+def test_scan_a_packet_aligned_range():
+    assert scan_keyframes(STREAM, at(6), len(STREAM)) == [Keyframe(at(8), at(5), 12.0)]
+
+
+def test_keyframe_without_pts():
+    stream = psi_packets() + pes_packets(VIDEO_PID, 2, random_access=True)
+    assert scan_keyframes(stream) == [Keyframe(0, at(4), None)]
+
+
+def test_stream_without_keyframes():
+    stream = psi_packets() + pes_packets(VIDEO_PID, 2, pts=1.0) + pes_packets(AUDIO_PID, 1, pts=1.0)
+    assert scan_keyframes(stream) == []
+
+
+def test_audio_random_access_points_are_not_keyframes():
+    stream = psi_packets() + pes_packets(AUDIO_PID, 1, pts=1.0, random_access=True) + pes_packets(VIDEO_PID, 1)
+    assert scan_keyframes(stream) == []
+
+
+def test_misaligned_range_raises():
+    with pytest.raises(TsScanError):
+        scan_keyframes(STREAM, 1)
+    with pytest.raises(TsScanError):
+        scan_keyframes(STREAM[:-1])
+
+
+def test_lost_sync_raises():
+    broken = bytearray(STREAM)
+    broken[at(4)] = 0
+    with pytest.raises(TsScanError, match=f'byte {at(4)}'):
+        scan_keyframes(bytes(broken))
+
+
+def test_continuation_packets_are_not_pes_starts():
+    # A video payload that happens to look like a PES start code, but without payload_unit_start set
+    stream = psi_packets() + pes_packets(VIDEO_PID, 1, pts=0.0, random_access=True)
+    stream += ts_packet(VIDEO_PID, b'\x00\x00\x01\xe0' + b'\xcc' * 160, random_access=True)
+    assert scan_keyframes(stream) == [Keyframe(0, at(4), 0.0)]
+
+
+def test_decrypt_segment():
+    pytest.importorskip('cryptography')
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    key, iv = bytes(range(16)), bytes(range(16, 32))
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    ciphertext = encryptor.update(padder.update(STREAM) + padder.finalize()) + encryptor.finalize()
+    data = b'\x00' * 32 + ciphertext
+    assert can_decrypt()
+    assert decrypt_segment(data, 32, len(ciphertext), key, iv) == STREAM
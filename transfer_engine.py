@@ -0,0 +1,166 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 limits: parts of at least 5 MiB (except the last one), at most 10,000 parts per upload
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+
+class BandwidthLimiter:
+    """Token bucket capping the combined upload rate of every transfer sharing it.
+
+    Each caller reserves its bytes on a shared timeline and sleeps until its slot, so
+    the average rate across all threads stays at ``bytes_per_second``. 0 disables the cap.
+    """
+
+    def __init__(self, bytes_per_second: float = 0):
+        self.bytes_per_second = bytes_per_second
+        self._next_free = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        if self.bytes_per_second <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next_free = max(self._next_free, now)
+            wait = self._next_free - now
+            self._next_free += amount / self.bytes_per_second
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TransferEngine:
+    """Multipart uploader sharing one S3 client (one connection pool) across all uploads.
+
+    Parts of every upload run on a single pool of ``max_concurrency`` threads, so
+    concurrent uploads share connections instead of each opening their own. Part size
+    follows the file size (it must fit in 10,000 parts) and the throughput measured on
+    earlier parts, aiming at ``target_part_seconds`` per part; small files go up in a
+    single PUT. With a bandwidth cap, a file runs no more parts at once than the cap
+    can feed at the measured per-connection rate.
+    """
+
+    def __init__(self, client, max_concurrency: int = 16, min_part_size: int = 8 * 1024 * 1024,
+                 max_part_size: int = 64 * 1024 * 1024, target_part_seconds: float = 2.0,
+                 max_bandwidth: float = 0):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.min_part_size = max(min_part_size, MIN_PART_SIZE)
+        self.max_part_size = max(max_part_size, self.min_part_size)
+        self.target_part_seconds = target_part_seconds
+        self.limiter = BandwidthLimiter(max_bandwidth)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='transfer')
+
+        self._lock = threading.Lock()
+        self.stream_rate = None  # bytes per second of a single part upload (moving average)
+        self.bytes_sent = 0
+        self.parts_sent = 0
+        self.files_sent = 0
+
+    def _record_part(self, size: int, seconds: float):
+        with self._lock:
+            rate = size / max(seconds, 1e-6)
+            self.stream_rate = rate if self.stream_rate is None else 0.8 * self.stream_rate + 0.2 * rate
+            self.bytes_sent += size
+            self.parts_sent += 1
+
+    def part_size_for(self, size: int) -> int:
+        """Part size for a file of ``size`` bytes, in whole MiB"""
+        with self._lock:
+            rate = self.stream_rate
+        wanted = rate * self.target_part_seconds if rate else self.min_part_size
+        part_size = min(max(wanted, self.min_part_size), self.max_part_size)
+        part_size = max(part_size, math.ceil(size / MAX_PARTS))
+        mib = 1024 * 1024
+        return math.ceil(part_size / mib) * mib
+
+    def concurrency_for(self, part_count: int) -> int:
+        """Parts of one file to keep in flight"""
+        concurrency = self.max_concurrency
+        with self._lock:
+            rate = self.stream_rate
+        if self.limiter.bytes_per_second > 0 and rate:
+            concurrency = min(concurrency, max(2, math.ceil(self.limiter.bytes_per_second / rate)))
+        return max(1, min(concurrency, part_count))
+
+    def _send_part(self, path, bucket, key, upload_id, number, offset, length, progress):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            body = f.read(length)
+        self.limiter.consume(len(body))
+        started = time.perf_counter()
+        response = self.client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+        self._record_part(len(body), time.perf_counter() - started)
+        progress(len(body))
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    def upload_file(self, path, bucket: str, key: str, extra_args: dict = None, callback=None):
+        """Upload ``path`` to ``bucket``/``key``; ``callback(bytes_sent, total_bytes)`` reports progress.
+
+        Raises the storage error if the upload fails (a multipart upload is aborted first).
+        """
+        extra_args = extra_args or {}
+        size = os.path.getsize(path)
+        part_size = self.part_size_for(size)
+        sent = [0]
+        progress_lock = threading.Lock()
+
+        def progress(amount):
+            with progress_lock:
+                sent[0] += amount
+                done = sent[0]
+            if callback is not None:
+                callback(done, size)
+
+        if size <= part_size:
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.limiter.consume(size)
+            started = time.perf_counter()
+            self.client.put_object(Bucket=bucket, Key=key, Body=body, **extra_args)
+            self._record_part(size, time.perf_counter() - started)
+            progress(size)
+            with self._lock:
+                self.files_sent += 1
+            return
+
+        offsets = range(0, size, part_size)
+        slots = threading.BoundedSemaphore(self.concurrency_for(len(offsets)))
+        upload_id = self.client.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)['UploadId']
+        futures = []
+        try:
+            for number, offset in enumerate(offsets, 1):
+                slots.acquire()
+                if any(future.done() and future.exception() for future in futures):
+                    slots.release()
+                    break
+                future = self._executor.submit(self._send_part, path, bucket, key, upload_id, number, offset,
+                                               min(part_size, size - offset), progress)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            parts = [future.result() for future in futures]
+            self.client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                  MultipartUpload={'Parts': parts})
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+        with self._lock:
+            self.files_sent += 1
+
+    def stats(self) -> dict:
+        """Return totals and the measured per-connection throughput"""
+        with self._lock:
+            return {
+                'files_sent': self.files_sent,
+                'parts_sent': self.parts_sent,
+                'bytes_sent': self.bytes_sent,
+                'stream_rate': round(self.stream_rate) if self.stream_rate else None,
+                'max_concurrency': self.max_concurrency,
+                'max_bandwidth': self.limiter.bytes_per_second,
+            }
@@ -0,0 +1,131 @@
+import mmap
+import re
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:  # optional: without it AES-128 segments can't be scanned for keyframes
+    Cipher = None
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = b'G'  # 0x47
+
+# Header byte 1 values with the payload_unit_start_indicator bit (0x40) set
+_PAYLOAD_UNIT_START = re.compile(rb'[\x40-\x7f\xc0-\xff]')
+_LOST_SYNC = re.compile(rb'[^G]')
+
+PTS_CLOCK = 90000
+
+AES_BLOCK_SIZE = 16
+# Smallest offset step that is both a TS packet and an AES block boundary (4 packets)
+PACKET_BLOCK_ALIGNMENT = 752
+
+
+class TsScanError(ValueError):
+    """Raised when a byte range is not a whole number of aligned TS packets"""
+
+
+class Keyframe(NamedTuple):
+    offset: int  # first byte of the keyframe, PAT/PMT packets directly in front of it included
+    size: int  # bytes up to the start of the next video frame (interleaved audio included)
+    pts: Optional[float]  # presentation time in seconds, None if the PES header carries none
+
+
+@contextmanager
+def open_ts(path):
+    """Memory-map a TS file read-only"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def _pts(data, payload: int) -> Optional[float]:
+    if data[payload + 7] & 0x80 == 0:
+        return None
+    b = data[payload + 9:payload + 14]
+    ticks = ((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+    return ticks / PTS_CLOCK
+
+
+def _pmt_pids(data, payload: int) -> set:
+    """PMT PIDs listed in the PAT section starting at ``payload``"""
+    section = payload + 1 + data[payload]  # skip the pointer field
+    section_end = section + 3 + ((data[section + 1] & 0x0f) << 8 | data[section + 2]) - 4  # CRC excluded
+    pids = set()
+    for entry in range(section + 8, section_end, 4):
+        if data[entry] or data[entry + 1]:  # program 0 points at the network PID, not a PMT
+            pids.add((data[entry + 2] & 0x1f) << 8 | data[entry + 3])
+    return pids
+
+
+def scan_keyframes(data, start: int = 0, end: int = None) -> List[Keyframe]:
+    """Find the video keyframes (random access points) in ``data[start:end]``.
+
+    ``data`` is a bytes-like object, typically a memory-mapped file from ``open_ts``.
+    Sync bytes and payload-unit-start flags are checked a whole column at a time
+    (one strided slice per header byte), so Python only looks at the packets that
+    start a PES or PSI section. The video PID is the first one carrying a video PES.
+    """
+    end = len(data) if end is None else end
+    if start % TS_PACKET_SIZE or (end - start) % TS_PACKET_SIZE:
+        raise TsScanError(f"Range {start}-{end} is not aligned to {TS_PACKET_SIZE}-byte TS packets")
+
+    sync = data[start:end:TS_PACKET_SIZE]
+    lost = _LOST_SYNC.search(sync)
+    if lost:
+        raise TsScanError(f"Lost TS sync at byte {start + lost.start() * TS_PACKET_SIZE}")
+    pid_high = data[start + 1:end:TS_PACKET_SIZE]
+    pid_low = data[start + 2:end:TS_PACKET_SIZE]
+
+    def pid_of(index: int) -> int:
+        return (pid_high[index] & 0x1f) << 8 | pid_low[index]
+
+    psi_pids = {0}
+    video_pid = None
+    frames = []  # (packet index, is keyframe, pts) of every video PES start
+    for match in _PAYLOAD_UNIT_START.finditer(pid_high):
+        index = match.start()
+        pid = pid_of(index)
+        if pid != video_pid and video_pid is not None and pid != 0:
+            continue
+        packet = start + index * TS_PACKET_SIZE
+        adaptation = data[packet + 3] & 0x20
+        payload = packet + 4 + (1 + data[packet + 4] if adaptation else 0)
+        if payload + 14 > packet + TS_PACKET_SIZE:
+            continue
+        if pid == 0:
+            psi_pids |= _pmt_pids(data, payload)
+            continue
+        if video_pid is None:
+            if data[payload:payload + 3] != b'\x00\x00\x01' or not 0xe0 <= data[payload + 3] <= 0xef:
+                continue
+            video_pid = pid
+        random_access = adaptation and data[packet + 4] > 0 and data[packet + 5] & 0x40
+        frames.append((index, bool(random_access), _pts(data, payload)))
+
+    keyframes = []
+    packet_count = len(sync)
+    for position, (index, random_access, pts) in enumerate(frames):
+        if not random_access:
+            continue
+        first = index
+        while first > 0 and pid_of(first - 1) in psi_pids:
+            first -= 1
+        last = frames[position + 1][0] if position + 1 < len(frames) else packet_count
+        keyframes.append(Keyframe(start + first * TS_PACKET_SIZE, (last - first) * TS_PACKET_SIZE, pts))
+    return keyframes
+
+
+def can_decrypt() -> bool:
+    """Whether AES-128 segments can be decrypted for scanning (needs the ``cryptography`` package)"""
+    return Cipher is not None
+
+
+def decrypt_segment(data, offset: int, length: int, key: bytes, iv: bytes) -> bytes:
+    """Decrypt one AES-128 (CBC, PKCS7) HLS segment stored at ``data[offset:offset + length]``"""
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    padded = decryptor.update(data[offset:offset + length]) + decryptor.finalize()
+    unpadder = padding.PKCS7(AES_BLOCK_SIZE * 8).unpadder()
+    return unpadder.update(padded) + unpadder.finalize()
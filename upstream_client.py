@@ -0,0 +1,204 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import server_timing
+from metrics import UPSTREAM_TTFB_SECONDS
+
+# Seconds the current thread spent opening upstream connections (TCP + TLS) during its last request
+_connect_time = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_time.seconds = getattr(_connect_time, 'seconds', 0.0) + time.perf_counter() - started
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_time.seconds = getattr(_connect_time, 'seconds', 0.0) + time.perf_counter() - started
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class UpstreamPoolTimeout(requests.Timeout):
+    """Raised when no upstream connection slot frees up within the acquire timeout"""
+
+
+class _HostState:
+    """Concurrency gate and counters for a single upstream host"""
+
+    def __init__(self, max_connections: int):
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.requests = 0
+        self.waits = 0
+        self.in_flight = 0
+
+
+class UpstreamClient:
+    """Shared keep-alive HTTP client used by the proxy routes for CDN and object storage fetches.
+
+    Every host gets its own urllib3 connection pool of ``pool_size`` sockets. A
+    per-host semaphore of the same size bounds concurrency, so callers queue for a
+    slot (up to ``acquire_timeout`` seconds) instead of opening extra sockets.
+    """
+
+    def __init__(self, pool_size: int = 50, max_hosts: int = 10, connect_timeout: float = 3.05,
+                 read_timeout: float = 30, acquire_timeout: float = 10):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.acquire_timeout = acquire_timeout
+
+        self.adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size,
+                                   pool_block=True, max_retries=0)
+        # Connections time their own connect() so Server-Timing can split it from the TTFB
+        self.adapter.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_state(self, host: str) -> _HostState:
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = _HostState(self.pool_size)
+            return state
+
+    def _acquire(self, host: str) -> _HostState:
+        state = self._host_state(host)
+        if not state.slots.acquire(blocking=False):
+            with self._lock:
+                state.waits += 1
+            if not state.slots.acquire(timeout=self.acquire_timeout):
+                raise UpstreamPoolTimeout(f"No free upstream connection to {host} after {self.acquire_timeout}s")
+        with self._lock:
+            state.requests += 1
+            state.in_flight += 1
+        return state
+
+    def _release(self, state: _HostState):
+        with self._lock:
+            state.in_flight -= 1
+        state.slots.release()
+
+    def request(self, method: str, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        """Send a request upstream over a pooled connection.
+
+        Redirects are followed, as the ``requests.get`` calls this replaces did. With
+        ``stream=True`` the connection slot stays checked out until the caller closes
+        the response; reading it to the end does not release it, so always close
+        streamed responses.
+        """
+        host = urlsplit(url).hostname
+        started = time.perf_counter()
+        state = self._acquire(host)
+        acquired = time.perf_counter()
+        _connect_time.seconds = 0.0
+        try:
+            response = self.session.request(method, url, headers=headers, timeout=self.timeout, stream=stream)
+        except Exception:
+            self._release(state)
+            raise
+        finished = time.perf_counter()
+        headers_received = response.elapsed.total_seconds()  # until headers were parsed, connect included
+        UPSTREAM_TTFB_SECONDS.observe(headers_received, host=host)
+
+        # Pool wait, connect, time to first byte and (for buffered bodies) the transfer
+        if acquired - started >= 0.0005:
+            server_timing.record('upstream-queue', acquired - started)
+        if _connect_time.seconds:
+            server_timing.record('upstream-connect', _connect_time.seconds)
+        server_timing.record('upstream-ttfb', max(headers_received - _connect_time.seconds, 0.0))
+        if not stream:
+            server_timing.record('upstream-transfer', max(finished - acquired - headers_received, 0.0))
+
+        if not stream:
+            self._release(state)
+            return response
+
+        released = threading.Event()
+        close = response.close
+        timing = server_timing.current()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self._release(state)
+                    if timing is not None:
+                        timing.add('upstream-transfer', time.perf_counter() - finished)
+
+        response.close = close_and_release
+        return response
+
+    def get(self, url: str, headers: dict = None, stream: bool = False) -> requests.Response:
+        """GET ``url`` upstream"""
+        return self.request('GET', url, headers=headers, stream=stream)
+
+    def head(self, url: str, headers: dict = None) -> requests.Response:
+        """HEAD ``url`` upstream"""
+        return self.request('HEAD', url, headers=headers)
+
+    def stats(self) -> dict:
+        """Return per-host pool statistics (reuse ratio, waits, open sockets)"""
+        pools = {}
+        container = self.adapter.poolmanager.pools
+        for pool_key in container.keys():
+            pool = container.get(pool_key)
+            if pool is not None:
+                pools[pool.host] = pool
+
+        hosts = {}
+        with self._lock:
+            states = list(self._hosts.items())
+        for host, state in states:
+            pool = pools.get(host)
+            opened = pool.num_connections if pool else 0
+            pooled_requests = pool.num_requests if pool else 0
+            open_sockets = 0
+            if pool is not None and pool.pool is not None:
+                idle = list(pool.pool.queue)
+                checked_out = pool.pool.maxsize - len(idle)
+                open_sockets = checked_out + sum(1 for conn in idle if getattr(conn, 'sock', None) is not None)
+            hosts[host] = {
+                'requests': state.requests,
+                'in_flight': state.in_flight,
+                'waits': state.waits,
+                'connections_opened': opened,
+                'open_sockets': open_sockets,
+                'reuse_ratio': round(1 - opened / pooled_requests, 4) if pooled_requests else 0.0,
+            }
+
+        return {
+            'pool_size': self.pool_size,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'hosts': hosts,
+        }